@@ -2,6 +2,7 @@ from functools import partial
 import tkinter as tk
 from tkinter import Label, Button, font, Text
 from schedules.auto_schedule_creator import AutoScheduleCreator
+from schedules.schedule_creator import ScheduleCreator
 import logging
 import os
 import settings
@@ -42,8 +43,11 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
         self.display_price_per_kwh = display_price_per_kwh
         self.auto_schedule_creator = auto_schedule_creator
         self.btn_create_now, self.btn_apply_settings, self.btn_toggle_enabled = None, None, None
+        self.btn_toggle_rolling_horizon = None
         # widget labels
         self.lbl_title, self.lbl_associated_schedule = None, None
+        # Statistics of the schedule cache shared by all creators
+        self.lbl_cache_stats = None
         # widget labels for setting names
         self.lbl_max_total_cost, self.lbl_h_period_split, self.lbl_max_h, self.lbl_min_h, self.lbl_calc_h, \
             self.lbl_calc_min = None, None, None, None, None, None
@@ -64,6 +68,7 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
         self.update_actual_settings()
         self.update_btn_colors()
         self.update_associated_schedule()
+        self.update_cache_stats()
 
     def update_actual_settings(self):
         period_split_h, max_total_cost, max_hours_to_run, min_hours_to_run, calculation_time_h, \
@@ -87,6 +92,10 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
             self.btn_toggle_enabled.config(bg="green")
         else:
             self.btn_toggle_enabled.config(bg="#f0f0f0")
+        if self.auto_schedule_creator.get_rolling_horizon_enabled():
+            self.btn_toggle_rolling_horizon.config(bg="green")
+        else:
+            self.btn_toggle_rolling_horizon.config(bg="#f0f0f0")
 
     def set_parameters_from_user_input(self):
         max_total_str = self.txt_max_total_cost.get("1.0", "end-1c")
@@ -120,6 +129,12 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
 
     def generate_schedule_now(self):
         self.auto_schedule_creator.execute_schedule_generation()
+        self.update_cache_stats()
+
+    def update_cache_stats(self):
+        stats = ScheduleCreator.get_cache_stats()
+        self.lbl_cache_stats.config(text=f"Cache hits {stats['hits']}, misses {stats['misses']}, "
+                                         f"size {stats['size']}/{stats['max_size']}")
 
     def toggle_auto_create(self):
         # Enable or disable auto creation of schedules
@@ -128,6 +143,13 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
             self.auto_schedule_creator.set_auto_create_enabled(not self.auto_schedule_creator.get_auto_create_enabled())
             self.update_btn_colors()
 
+    def toggle_rolling_horizon(self):
+        # Plan again at every period boundary or create schedule once a day
+        if self.auto_schedule_creator:
+            self.auto_schedule_creator.set_rolling_horizon_enabled(
+                not self.auto_schedule_creator.get_rolling_horizon_enabled())
+            self.update_btn_colors()
+
     def _prepare_widget_elements(self):
         # Create a custom font with bold style
         bold_font = font.Font(family="Helvetica", size=12, weight="bold")
@@ -166,6 +188,10 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
         self.btn_toggle_enabled = Button(self, text='TOGGLE AUTO CREATE',
                                          command=partial(self.toggle_auto_create),
                                          width=self.BTN_WIDTH)
+        self.btn_toggle_rolling_horizon = Button(self, text='TOGGLE ROLLING HORIZON',
+                                                 command=partial(self.toggle_rolling_horizon),
+                                                 width=self.BTN_WIDTH)
+        self.lbl_cache_stats = Label(self, text="Cache hits 0, misses 0")
 
     def _place_widget_elements(self):
         self.lbl_title.grid(row=0, column=0, columnspan=3)
@@ -191,3 +217,5 @@ class AutoHourlyScheduleCreatorWidget(tk.Frame):
         self.btn_create_now.grid(row=8, column=0, columnspan=3)
         self.btn_apply_settings.grid(row=9, column=0, columnspan=3)
         self.btn_toggle_enabled.grid(row=10, column=0, columnspan=3)
+        self.btn_toggle_rolling_horizon.grid(row=11, column=0, columnspan=3)
+        self.lbl_cache_stats.grid(row=12, column=0, columnspan=3)
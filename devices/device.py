@@ -71,6 +71,9 @@ class Device(DeviceSubject, StateSaver):
         self.device_type = device_type
         # if false device in auto mode if true in manual mode
         self.auto_man = False
+        # Table of live readings of all devices, set by attach_fleet_state
+        self.fleet_state = None
+        self.fleet_slot = -1
         self.load_state()
 
     def __str__(self):
@@ -209,3 +212,39 @@ class Device(DeviceSubject, StateSaver):
         Example: check status of device, check device state vs command, etc.
         """
         pass
+
+    def supervise(self, supervisor) -> bool:
+        """
+        Hand periodic checks over to a DeviceSupervisor. Implement in devices whose checks can be driven by deadlines.
+        :param supervisor: DeviceSupervisor that will call on_deadline
+        :return: True if the device is supervised and loop() does not need to be called
+        """
+        return False
+
+    def on_deadline(self, deadline_name: str):
+        """
+        Called by the DeviceSupervisor when a deadline scheduled by the device expires
+        :param deadline_name: name given when scheduling
+        """
+        pass
+
+    def attach_fleet_state(self, fleet_state):
+        """
+        Take a slot in the FleetStateTable and keep the device readings written there
+        :param fleet_state: FleetStateTable shared by all devices
+        """
+        self.fleet_state = fleet_state
+        self.fleet_slot = fleet_state.add_slot(self.name, self.device_type)
+        self.update_fleet_state()
+
+    def get_fleet_values(self) -> dict:
+        """
+        Implement in devices that have readings
+        :return: FleetStateTable column: value
+        """
+        return {}
+
+    def update_fleet_state(self):
+        # Call after the device readings have changed
+        if self.fleet_state is not None:
+            self.fleet_state.set_values(self.fleet_slot, self.get_fleet_values())
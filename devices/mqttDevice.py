@@ -3,25 +3,62 @@ Class that inherits from device class
 For controlling/monitoring a mqtt device
 """
 
+import time
+import logging
+import os
 from devices.device import Device
 from typing import Callable
 from abc import abstractmethod
 from devices.deviceTypes import DeviceType
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "mqtt_device.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
 
 
 class MqttDevice(Device):
     # Value for
     NO_DATA_VALUE = -0.99
+    TIME_SINCE_LAST_MSG_TO_CONSIDER_ONLINE_S = 60
+    # Names of deadlines used with the DeviceSupervisor
+    DEADLINE_OFFLINE = "offline"
+    DEADLINE_CMD_CONFIRM = "cmd_confirm"
+    # Send the command again if the device has not replied in this time
+    CMD_CONFIRM_TIMEOUT_S = 10
+    # Set in devices that report their output state, commands are then confirmed with the supervisor
+    CMD_FEEDBACK = False
 
     def __init__(self, mqtt_publish: Callable[[str, str], None],
                  device_type: DeviceType,
-                 name: str = "Test mqtt device"):
+                 name: str = "Test mqtt device",
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
         """
         :param mqtt_publish: callback method to publish mqtt messages related to this device
         :param name: name of device
+        :param state_file_loc: folder the device state is saved in
         """
-        super().__init__(name=name, device_type=device_type)
+        # Set if checks are driven by a DeviceSupervisor instead of loop()
+        self.supervisor = None
+        super().__init__(name=name, device_type=device_type, state_file_loc=state_file_loc)
         self.mqtt_publish = mqtt_publish
+        # Used to check wether device is available
+        self.time_of_last_msg = 0
+        # Will be set to true if MQTT msg received recently
+        self.state_online = False
+        # To indicate to program that device state should not be checked until next msg received
+        self.cmd_sent_out = self.CMD_FEEDBACK
 
     @abstractmethod
     def process_received_mqtt_data(self, topic: str, data: str):
@@ -31,3 +68,59 @@ class MqttDevice(Device):
         :return:
         """
         pass
+
+    @abstractmethod
+    def check_status_online_offline(self):
+        """
+        Set state_online from the time of the last message
+        """
+        pass
+
+    def check_cmd_vs_actual_state(self):
+        """
+        Implement in devices with CMD_FEEDBACK. Send the command again if the reported state differs from it.
+        """
+        pass
+
+    def supervise(self, supervisor) -> bool:
+        """
+        Online and command checks are driven by supervisor deadlines instead of loop()
+        """
+        self.supervisor = supervisor
+        supervisor.schedule(self, self.DEADLINE_OFFLINE, self.TIME_SINCE_LAST_MSG_TO_CONSIDER_ONLINE_S)
+        return True
+
+    def on_deadline(self, deadline_name: str):
+        if deadline_name == self.DEADLINE_OFFLINE:
+            self.check_status_online_offline()
+            if self.state_online:
+                # Messages received meanwhile, check again when the last one gets too old
+                time_since_last_msg = time.perf_counter() - self.time_of_last_msg
+                self.supervisor.schedule(self, self.DEADLINE_OFFLINE,
+                                         self.TIME_SINCE_LAST_MSG_TO_CONSIDER_ONLINE_S - time_since_last_msg)
+        elif deadline_name == self.DEADLINE_CMD_CONFIRM:
+            logger.warning(f"{self.name} did not reply to command")
+            self.cmd_sent_out = False
+            self.check_cmd_vs_actual_state()
+
+    def on_msg_received(self):
+        """
+        Call after a message from the device has been handled
+        """
+        if not self.state_online:
+            self.check_status_online_offline()
+            if self.supervisor:
+                # Offline deadline is not kept while offline
+                self.supervisor.schedule(self, self.DEADLINE_OFFLINE, self.TIME_SINCE_LAST_MSG_TO_CONSIDER_ONLINE_S)
+        if self.CMD_FEEDBACK and self.supervisor and not self.cmd_sent_out:
+            # Device replied to the last command
+            self.supervisor.cancel(self, self.DEADLINE_CMD_CONFIRM)
+            self.check_cmd_vs_actual_state()
+
+    def on_cmd_sent(self):
+        """
+        Call after a command has been published, the device has CMD_CONFIRM_TIMEOUT_S to reply
+        """
+        self.cmd_sent_out = True
+        if self.supervisor:
+            self.supervisor.schedule(self, self.DEADLINE_CMD_CONFIRM, self.CMD_CONFIRM_TIMEOUT_S)
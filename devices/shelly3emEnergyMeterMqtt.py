@@ -5,12 +5,18 @@ import logging
 import os
 from dataclasses import dataclass
 from helpers.sensor import Sensor
+from helpers.ring_buffer import RingBuffer
 from devices.deviceTypes import DeviceType
 from devices.mqttDevice import MqttDevice
 from helpers.mqtt_client import MyMqttClient
 import settings
 import secrets
 from helpers.observer_pattern import Observer
+try:
+    # Faster JSON decoding if installed, same results as json.loads
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # Setup logging
 log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
@@ -80,6 +86,19 @@ class EnergyMeterData:
         ])
 
 
+@dataclass()
+class EnergyMeterMinuteSample:
+    """
+    Aggregated values of one phase over one period, from the em1data values arrays
+    """
+    phase: int
+    # Unix time of the start of the period, as given by the device
+    timestamp: float
+    period_s: int
+    # Field name from ShellyEnergyMeter3em.MINUTE_DATA_FIELDS: value
+    values: dict[str, float]
+
+
 class ShellyEnergyMeter3em(MqttDevice):
     """
 
@@ -96,19 +115,36 @@ class ShellyEnergyMeter3em(MqttDevice):
 
     TIME_SINCE_LAST_MSG_TO_CONSIDER_ONLINE_S = 60
     event_name_new_extra_data = "device_new_extra_data"
-
-    def __init__(self, device_id: str, mqtt_publish: Callable[[str, str], None], name: str = "Energy meter"):
+    # Aggregated minute data received, observers get the samples in the samples keyword argument
+    event_name_new_minute_data = "energy_meter_new_minute_data"
+    # Order of values in each row of the em1data values array
+    MINUTE_DATA_FIELDS = ("total_act_energy", "fund_act_energy", "total_act_ret_energy", "fund_act_ret_energy",
+                          "max_act_power", "min_act_power", "max_aprt_power", "min_aprt_power",
+                          "max_voltage", "min_voltage", "avg_voltage", "max_current", "min_current", "avg_current")
+    # Field in em1 data: EnergyMeterData attribute
+    REAL_TIME_FIELDS = {"voltage": "voltage", "act_power": "power", "current": "current", "freq": "freq",
+                        "pf": "pf"}
+    # Real time values kept in history for each phase
+    HISTORY_METRICS = ("power", "current", "voltage", "pf")
+    # Number of readings kept per phase and metric
+    HISTORY_SIZE = RingBuffer.CAPACITY
+
+    def __init__(self, device_id: str, mqtt_publish: Callable[[str, str], None], name: str = "Energy meter",
+                 history_size: int = HISTORY_SIZE,
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
         """
         :param device_id: must be set correct to read correct messages. See device web. Example "shellyplug-s-80646F840029"
         :param mqtt_publish: method to call when a mqtt message should be published
         :param name: device name - for logs and UI
+        :param history_size: number of real time readings kept per phase and metric
+        :param state_file_loc: folder the device state is saved in
         """
-        super().__init__(mqtt_publish, name=name, device_type=DeviceType.SHELLY_PRO_3EM)
+        super().__init__(mqtt_publish, name=name, device_type=DeviceType.SHELLY_PRO_3EM,
+                         state_file_loc=state_file_loc)
+        # Recent real time values, metric: {phase: RingBuffer}
+        self.history = {metric: {phase: RingBuffer(history_size) for phase in range(1, 4)}
+                        for metric in self.HISTORY_METRICS}
         self.device_id = device_id
-        # Used to check wether device is available
-        self.time_of_last_msg = 0
-        # Will be set to true if MQTT msg received recently
-        self.state_online = False
         self.base_mqtt_topic = f"{self.device_id}"
         # listen to all messages related to this MQTT device
         self.listen_topic = f"{self.base_mqtt_topic}/#"
@@ -117,8 +153,19 @@ class ShellyEnergyMeter3em(MqttDevice):
         # Received data is dictionaries with one of the following keys in them
         self.phase_mapping_real_time_data = {"em1:0": 1, "em1:1": 2, "em1:2": 3}
         self.phase_mapping_energy_data = {"em1data:0": 1, "em1data:1": 2, "em1data:2": 3}
+        # params key: (handler, phase)
+        self.params_dispatch = {key: (self.handle_real_time_values, phase)
+                                for key, phase in self.phase_mapping_real_time_data.items()}
+        self.params_dispatch.update({key: (self.handle_energy_data, phase)
+                                     for key, phase in self.phase_mapping_energy_data.items()})
+        self.params_dispatch["events"] = (self.handle_minute_data, None)
         # Values that will be read from MQTT
         self.sensor_data = self.setup_sensor_obj()
+        # Phase: (sensor, history buffer or None) in the order of REAL_TIME_FIELDS
+        self.real_time_targets = {phase: [(getattr(self.sensor_data, attribute)[phase],
+                                           self.history[attribute][phase] if attribute in self.history else None)
+                                          for attribute in self.REAL_TIME_FIELDS.values()]
+                                  for phase in range(1, 4)}
 
     def loop(self) -> None:
         """
@@ -166,6 +213,7 @@ class ShellyEnergyMeter3em(MqttDevice):
         if online != self.state_online:
             logger.debug(f"{self.name} went online" if online else f"{self.name} went offline")
             self.state_online = online
+            self.update_fleet_state()
             self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
 
     def process_received_mqtt_data(self, topic: str, data: str) -> None:
@@ -181,103 +229,170 @@ class ShellyEnergyMeter3em(MqttDevice):
             # Data looks like this: b'81.17' - remove the b''
             clean_data = data.strip("b'")
             self.extract_data_from_message(clean_data)
+            self.on_msg_received()
         else:
             logger.debug(f"Unhandled MQTT topic for energy meter {self.name}")
 
     def extract_data_from_message(self, data: str) -> None:
         """
         Update sensor class instance variable with read data
+        Each params key is looked up in the dispatch table, which gives the handler and phase in one step.
         :param data: receiving string message from MQTT
         :return:
         """
         new_data = False
+        minute_samples = []
         try:
             # Convert JSON string to dictionary
-            dict_data = json.loads(data)
-            # Access params
-            params = dict_data.get("params", {})
-            if not params:
-                logger.error(f"Message without params key {dict_data}")
-                return
-            # params exist
-            if any(key in params for key in self.phase_mapping_real_time_data.keys()):
-                # Check for keys that identify real time value data
-                new_data = self.handle_real_time_values(params)
-            elif any(key in params for key in self.phase_mapping_energy_data.keys()):
-                # Check for keys that identify energy value data
-                new_data = self.handle_energy_data(params)
-            else:
-                logger.debug(f"Unused data received {data}")
+            dict_data = json_loads(data)
         except json.JSONDecodeError as e:
             logger.error(f"JSON decoding error: {e}")
+            return
+        # Access params
+        params = dict_data.get("params", {})
+        if not params:
+            logger.error(f"Message without params key {dict_data}")
+            return
+        # params exist
+        timestamp = params.get("ts")
+        for key, value in params.items():
+            handler = self.params_dispatch.get(key)
+            if handler is None:
+                continue
+            handler_method, phase = handler
+            if phase is None:
+                # Only events have no phase, they carry the aggregated minute data
+                minute_samples.extend(handler_method(value))
+            elif handler_method(value, phase, timestamp):
+                new_data = True
         if new_data:
+            self.update_fleet_state()
             self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
+        if minute_samples:
+            self.notify_observers(self.event_name_new_minute_data, device_name=self.name,
+                                  device_type=self.device_type, samples=minute_samples)
+        if not new_data and not minute_samples:
+            logger.debug(f"Unused data received {data}")
 
-    def handle_energy_data(self, data: dict) -> bool:
+    def handle_minute_data(self, events: list) -> list[EnergyMeterMinuteSample]:
         """
-        :param data: dictionary holding energy data like this:
-        {"ts":1738256760.23,"em1data:0":{"id":0,"total_act_energy":6737.72,"total_act_ret_energy":1.78}
+        :param events: events of a NotifyEvent message like this:
+        [{"component":"em1data:0","id":0,"event":"data","ts":1738256700.00,
+        "data":{"ts": 1738256700,"period": 60,"values":[[0.0209,0.0000,0.0000,0.0000,1.6,1.0,19.0,17.3,
+        235.502,234.857,235.167,0.081,0.073,0.079]]}}]
+        Each row of values is one period, the first one starting at data ts
+        :return: one sample per row of each em1data event
+        """
+        samples = []
+        for event in events:
+            phase = self.phase_mapping_energy_data.get(event.get("component"))
+            if phase is None or event.get("event") != "data":
+                continue
+            try:
+                event_data = event["data"]
+                time_start = float(event_data["ts"])
+                period_s = int(event_data["period"])
+                for row_nr, row in enumerate(event_data["values"]):
+                    if len(row) != len(self.MINUTE_DATA_FIELDS):
+                        logger.error(f"Unexpected number of minute data values {len(row)}")
+                        continue
+                    samples.append(EnergyMeterMinuteSample(
+                        phase=phase, timestamp=time_start + row_nr * period_s, period_s=period_s,
+                        values=dict(zip(self.MINUTE_DATA_FIELDS, map(float, row)))))
+            except (KeyError, TypeError) as e:
+                logger.error(f"Key error when handling energy meter minute data: {e}")
+                logger.error(event)
+            except ValueError as e:
+                logger.error(f"Failed to cast data: {e}")
+        return samples
+
+    def handle_energy_data(self, inner_data: dict, phase: int, timestamp: float = None) -> bool:
+        """
+        :param inner_data: energy data of one phase like this:
+        {"id":0,"total_act_energy":6737.72,"total_act_ret_energy":1.78}
+        :param phase: 1 to 3
+        :param timestamp: ts of the message
         :return: True if sensor data read
         """
-        # return value
-        new_data = False
-        # Find the key and phase number of the data
-        key, phase = next(((k, v) for k, v in self.phase_mapping_energy_data.items() if k in data), (None, -1))
         try:
-            inner_data = data.get(key)
-            energy_wmin_str = inner_data.get("total_act_energy")
-            energy_wh = float(energy_wmin_str)
-            energy_kwh = energy_wh / 1000
-            self.sensor_data.energy[phase].value = energy_kwh
-            new_data = True
-        except KeyError as e:
+            energy_wh = float(inner_data["total_act_energy"])
+        except (KeyError, TypeError) as e:
             logger.error(f"Key error when handling energy meter energy data: {e}")
-            logger.error(data)
+            logger.error(inner_data)
+            return False
         except ValueError as e:
             logger.error(f"Failed to cast data: {e}")
-        return new_data
+            return False
+        self.sensor_data.energy[phase].value = energy_wh / 1000
+        return True
 
-    def handle_real_time_values(self, data: dict) -> bool:
+    def handle_real_time_values(self, inner_data: dict, phase: int, timestamp: float = None) -> bool:
         """
-        :param data: dictionary holding real time data like this:
-        {"ts":1738256744.19,"em1:0":{"id":0,"act_power":1.2,"aprt_power":19.0,
-        "current":0.081,"freq":50.0,"pf":0.07,"voltage":235.2}}
+        :param inner_data: real time data of one phase like this:
+        {"id":0,"act_power":1.2,"aprt_power":19.0,"current":0.081,"freq":50.0,"pf":0.07,"voltage":235.2}
+        :param phase: 1 to 3
+        :param timestamp: ts of the message, time of measurement
         :return: True if sensor data read
         """
-        # return value
-        new_data = False
-        # Find the key and phase number of the data
-        key, phase = next(((k, v) for k, v in self.phase_mapping_real_time_data.items() if k in data), (None, -1))
         try:
-            inner_data = data.get(key)
-            # Get voltage
-            voltage_str = inner_data.get("voltage")
-            voltage = float(voltage_str)
-            self.sensor_data.voltage[phase].value = voltage
-            # If at least one data point received return that data has been changed
-            new_data = True
-            # Get power
-            power_str = inner_data.get("act_power")
-            power = float(power_str)
-            self.sensor_data.power[phase].value = power
-            # Get current
-            current_str = inner_data.get("current")
-            current = float(current_str)
-            self.sensor_data.current[phase].value = current
-            # Get frequency
-            freq_str = inner_data.get("freq")
-            freq = float(freq_str)
-            self.sensor_data.freq[phase].value = freq
-            # Get power factor
-            pf_str = inner_data.get("pf")
-            pf = float(pf_str)
-            self.sensor_data.pf[phase].value = pf
-        except KeyError as e:
+            # All fields converted before any is stored, so a phase is never left partly updated
+            values = [float(inner_data[field]) for field in self.REAL_TIME_FIELDS]
+        except (KeyError, TypeError) as e:
             logger.error(f"Key error when handling energy meter real time data: {e}")
-            logger.error(data)
+            logger.error(inner_data)
+            return False
         except ValueError as e:
             logger.error(f"Failed to cast data: {e}")
-        return new_data
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        for (sensors, history), value in zip(self.real_time_targets[phase], values):
+            sensors.value = value
+            if history is not None:
+                # Keep in history with the time of measurement from the device
+                history.append(timestamp, value)
+        return True
+
+    def get_history(self, metric: str, phase: int) -> RingBuffer:
+        """
+        :param metric: one of HISTORY_METRICS
+        :param phase: 1 to 3
+        """
+        return self.history[metric][phase]
+
+    def get_demand_averages(self, interval_s: float = RingBuffer.DEMAND_INTERVAL_S,
+                            window_s: float = None) -> dict[int, list[tuple[float, float]]]:
+        """
+        :param interval_s: averaging interval, 15 min by default
+        :param window_s: only use readings of the last window_s seconds, all kept readings if None
+        :return: phase: list of (interval start unix time, average power W)
+        """
+        return {phase: buffer.demand_averages(interval_s, window_s) for phase, buffer in self.history["power"].items()}
+
+    def get_history_snapshot(self, window_s: float = None) -> dict:
+        """
+        :return: metric: {phase: {"timestamps": list, "values": list}}
+        """
+        return {metric: {phase: buffer.snapshot(window_s) for phase, buffer in phase_buffers.items()}
+                for metric, phase_buffers in self.history.items()}
+
+    def attach_fleet_state(self, fleet_state):
+        """
+        One slot for each phase, so phases can be summed with other devices
+        """
+        self.fleet_state = fleet_state
+        self.fleet_phase_slots = {phase: fleet_state.add_slot(f"{self.name} ph{phase}", self.device_type)
+                                  for phase in range(1, 4)}
+        self.update_fleet_state()
+
+    def update_fleet_state(self):
+        if self.fleet_state is None:
+            return
+        for phase, slot in self.fleet_phase_slots.items():
+            self.fleet_state.set_values(slot, {"online": self.state_online,
+                                               "power": self.sensor_data.power[phase].value,
+                                               "energy": self.sensor_data.energy[phase].value,
+                                               "voltage": self.sensor_data.voltage[phase].value,
+                                               "current": self.sensor_data.current[phase].value})
 
     def get_sensors_as_list(self) -> list[Sensor]:
         """
@@ -335,7 +450,7 @@ shellypro3em-34987a446e54/events/rpc b'{"src":"shellypro3em-34987a446e54","dst":
 shellypro3em-34987a446e54/events/rpc b'{"src":"shellypro3em-34987a446e54","dst":"shellypro3em-34987a446e54/events","method":"NotifyStatus","params":
 {"ts":1738256716.22,"em1:2":{"id":2,"act_power":28.7,"aprt_power":54.7,"current":0.233,"freq":50.0,"pf":0.52,"voltage":234.6}}}'
 
-List of values have messages like below, these will not be used:
+List of values have messages like below, one row of values per minute, see MINUTE_DATA_FIELDS:
 shellypro3em-34987a446e54/events/rpc b'{"src":"shellypro3em-34987a446e54","dst":"shellypro3em-34987a446e54/events","method":"NotifyEvent","params":
 {"ts":1738256760.23,"events":[{"component":"em1data:0","id":0,"event":"data","ts":1738256700.00,"data":{"ts": 1738256700,"period": 60,"values":
 [[0.0209,0.0000,0.0000,0.0000,1.6,1.0,19.0,17.3,235.502,234.857,235.167,0.081,0.073,0.079 ]]}}]}}'
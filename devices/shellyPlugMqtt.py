@@ -48,20 +48,18 @@ class ShellyPlug(MqttDevice):
     # Value that is received from MQTT when there is no overtemperature
     OVERTEMPERATURE_OK = 0
     event_name_new_extra_data = "device_new_extra_data"
+    CMD_FEEDBACK = True
 
-
-    def __init__(self, plug_id: str, mqtt_publish: Callable[[str, str], None], name: str = "Test shelly plug"):
+    def __init__(self, plug_id: str, mqtt_publish: Callable[[str, str], None], name: str = "Test shelly plug",
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
         """
         :param plug_id: must be set correct to read correct messages. See device web. Example "shellyplug-s-80646F840029"
         :param mqtt_publish: method to call when a mqtt message should be published
         :param name: device name - for logs and UI
+        :param state_file_loc: folder the device state is saved in
         """
-        super().__init__(mqtt_publish, name=name, device_type=DeviceType.SHELLY_PLUG)
+        super().__init__(mqtt_publish, name=name, device_type=DeviceType.SHELLY_PLUG, state_file_loc=state_file_loc)
         self.plug_id = plug_id
-        # Used to check wether device is available
-        self.time_of_last_msg = 0
-        # Will be set to true if MQTT msg received recently
-        self.state_online = False
         self.base_mqtt_topic = f"shellies/{self.plug_id}"
         # listen to all messages related to this socket
         self.listen_topic = f"{self.base_mqtt_topic}/#"
@@ -77,8 +75,6 @@ class ShellyPlug(MqttDevice):
         self.energy = self.NO_DATA_VALUE #kWh
         self.temperature = self.NO_DATA_VALUE
         self.state_off_on = False
-        # To indicate to program that device state should not be checked until next msg received
-        self.cmd_sent_out = True
         self.overtemperature = 0
         # use dictionarry to map variables to topics
         # Define a mapping of topics to data variables and their data types
@@ -100,7 +96,6 @@ class ShellyPlug(MqttDevice):
         self.check_status_online_offline()
         self.check_cmd_vs_actual_state()
 
-
     def check_status_online_offline(self):
         # Checks wether set device status equals set state
         time_since_last_msg = time.perf_counter() - self.time_of_last_msg
@@ -108,6 +103,7 @@ class ShellyPlug(MqttDevice):
         if online != self.state_online:
             logger.debug(f"{self.name} went online" if online else f"{self.name} went offline")
             self.state_online = online
+            self.update_fleet_state()
             self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
 
     def check_cmd_vs_actual_state(self):
@@ -164,12 +160,18 @@ class ShellyPlug(MqttDevice):
                 except ValueError:
                     # Handle conversion errors
                     logger.debug(f"Value error {data} in topic {topic}")
+            self.update_fleet_state()
             self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
+            self.on_msg_received()
         else:
             # Handle unrecognized topics if needed
             logger.debug("Unhandled MQTT msg:")
             logger.debug(f"{topic}\t{data}")
 
+    def get_fleet_values(self) -> dict:
+        return {"online": self.state_online, "state_off_on": self.state_off_on, "power": self.power,
+                "energy": self.energy, "temperature": self.temperature}
+
     def scale_data(self,target_variable: str, new_value):
         """
         @param target_variable: target variable name
@@ -204,7 +206,7 @@ class ShellyPlug(MqttDevice):
             return
         publish_payload = "on" if off_on else "off"
         self.mqtt_publish(self.publish_topic, publish_payload)
-        self.cmd_sent_out = True
+        self.on_cmd_sent()
 
 
 if __name__ == '__main__':
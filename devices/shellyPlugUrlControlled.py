@@ -1,10 +1,8 @@
 import logging
 import os
-import json
 import queue
 import time
-from urllib.request import urlopen
-from urllib.error import URLError
+import requests
 from devices.deviceTypes import DeviceType
 from devices.urlControlledDevice import URLControlledDev
 import settings
@@ -60,15 +58,17 @@ class URLControlledShellyPlug(URLControlledDev):
                  url_off: str,
                  url_on: str,
                  device_type: DeviceType = DeviceType.URL_CONTROLLED_SHELLY_PLUG,
-                 name: str = "Test URL controlled device"):
+                 name: str = "Test URL controlled device",
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
         """
         @param url_off: Example shelly http://172.31.0.246/relay/0?turn=off
         @param url_on: Example shelly http://172.31.0.246/relay/0?turn=on
+        @param state_file_loc: folder the device state is saved in
         """
         self.time_of_last_call = time.perf_counter()
         # On first URL call print error but not otherwise
         self.first_url_call = True
-        super().__init__(url_off, url_on, device_type, name)
+        super().__init__(url_off, url_on, device_type, name, state_file_loc)
 
     def loop(self):
         self.check_url_call_queue()
@@ -100,8 +100,12 @@ class URLControlledShellyPlug(URLControlledDev):
                     data_changed = True
                 self.state_off_on = is_on
         if data_changed:
+            self.update_fleet_state()
             self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
 
+    def get_fleet_values(self) -> dict:
+        return {"online": self.state_online, "state_off_on": self.state_off_on}
+
     def call_url_threaded(self, url: str, return_queue: queue.Queue):
         """
         For shelly plug, answers are:
@@ -114,14 +118,14 @@ class URLControlledShellyPlug(URLControlledDev):
                          "ison": False}
 
         try:
-            dev_reply = json.loads(urlopen(url, timeout=URLControlledDev.TIMEOUT_TIME_S).read())
+            dev_reply = self.http_pool.get_json(url, timeout=URLControlledDev.TIMEOUT_TIME_S)
             logger.debug(f"{self.name} URL call reply {dev_reply}")
             # consider success if shelly URL was reachable
             return_result["Success"] = True
             return_result["ison"] = dev_reply["ison"]
-        except TimeoutError:
+        except requests.Timeout:
             self.log_url_call_error(f"Timeout device name {self.name} url {url}")
-        except URLError:
+        except requests.RequestException:
             self.log_url_call_error(f"URL error device name: {self.name} url: {url}")
         except Exception as e:
             self.log_url_call_error(f"Other error when attempting to call URL device name {self.name} url {url}", e)
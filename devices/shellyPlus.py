@@ -66,22 +66,28 @@ class ShellyPlus(MqttDevice):
     event_name_new_extra_data = "device_new_extra_data"
     # Digital input state change
     event_name_input_state_change = "device_input_state_change"
+    CMD_FEEDBACK = True
+    # Name of deadline used with the DeviceSupervisor, in addition to the ones of MqttDevice
+    DEADLINE_STATUS_REQUEST = "status_request"
 
     def __init__(self, plug_id: str, mqtt_publish: Callable[[str, str], None],
                  name: str = "Test shelly plus",
-                 device_type: DeviceType = DeviceType.SHELLY_PLUS):
+                 device_type: DeviceType = DeviceType.SHELLY_PLUS,
+                 ip: str = "",
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
         """
         :param plug_id: must be set correct to read correct messages. See device web.
         :param mqtt_publish: method to call when a mqtt message should be published
         :param name: device name - for logs and UI
+        :param ip: address of the device for HTTP RPC calls, empty if not used
+        :param state_file_loc: folder the device state is saved in
         """
-        super().__init__(mqtt_publish, name=name, device_type=device_type)
+        self.ip = ip
+        # If set, commands are sent over HTTP RPC instead of MQTT. Set while MQTT is not available.
+        self.rpc_fallback = None
+        super().__init__(mqtt_publish, name=name, device_type=device_type, state_file_loc=state_file_loc)
         self.plug_id = plug_id
-        # Used to check wether device is available
-        self.time_of_last_msg = 0
         self.time_of_last_status_req = 0
-        # Will be set to true if MQTT msg received recently
-        self.state_online = False
         self.base_mqtt_topic = f"{self.plug_id}"
         # listen to all messages related to this socket
         self.listen_topic = f"{self.base_mqtt_topic}/#"
@@ -95,8 +101,6 @@ class ShellyPlus(MqttDevice):
         self.temperature = self.NO_DATA_VALUE
         # State of outpuut
         self.state_off_on = False
-        # To indicate to program that device state should not be checked until next msg received
-        self.cmd_sent_out = True
 
     def loop(self):
         """
@@ -109,10 +113,28 @@ class ShellyPlus(MqttDevice):
         self.check_cmd_vs_actual_state()
         self.request_status()
 
+    def supervise(self, supervisor) -> bool:
+        """
+        Status requests are driven by a supervisor deadline too
+        """
+        super().supervise(supervisor)
+        supervisor.schedule(self, self.DEADLINE_STATUS_REQUEST, 0)
+        return True
+
+    def on_deadline(self, deadline_name: str):
+        if deadline_name == self.DEADLINE_STATUS_REQUEST:
+            self.request_status()
+            self.supervisor.schedule(self, self.DEADLINE_STATUS_REQUEST, self.STATUS_REQ_FREQUENCY_S)
+        else:
+            super().on_deadline(deadline_name)
+
     def request_status(self):
         """
         Request status updates of device in regular intervals
         """
+        if self.rpc_fallback:
+            # Status is polled over HTTP while MQTT is not available
+            return
         time_since_last_status_req = time.perf_counter() - self.time_of_last_status_req
         if time_since_last_status_req >= self.STATUS_REQ_FREQUENCY_S:
             logger.debug("Requesting device status")
@@ -126,6 +148,7 @@ class ShellyPlus(MqttDevice):
         if online != self.state_online:
             logger.debug(f"{self.name} went online" if online else f"{self.name} went offline")
             self.state_online = online
+            self.update_fleet_state()
             self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
 
     def check_cmd_vs_actual_state(self):
@@ -151,20 +174,14 @@ class ShellyPlus(MqttDevice):
         clean_data = data.strip("b'")
         if topic == self.output_topic:
             relevant_msg_received = True
-            received_state, self.temperature = self.handle_output_json(clean_data)
-            if self.state_off_on != received_state:
-                # state changed
-                self.state_off_on = received_state
-                self.device_notify(self.event_name_actual_state_changed, self.name, self.device_type)
-            self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
-            self.cmd_sent_out = False
+            switch_status = self.parse_json(clean_data)
+            if switch_status is not None:
+                self.update_switch_status(switch_status)
         elif topic == self.input_topic:
             relevant_msg_received = True
-            input_off_on = self.handle_input_json(clean_data)
-            if input_off_on != self.di_off_on:
-                self.di_off_on = input_off_on
-                # Notify listening devices off input state change
-                self.device_notify(self.event_name_input_state_change, self.name, self.device_type)
+            input_status = self.parse_json(clean_data)
+            if input_status is not None:
+                self.update_input_status(input_status)
         else:
             # Handle unrecognized topics if needed
             pass
@@ -172,46 +189,73 @@ class ShellyPlus(MqttDevice):
             # logger.debug(f"Topic: {topic}\tData: {data}")
         if relevant_msg_received:
             self.time_of_last_msg = time.perf_counter()
+            self.on_msg_received()
             logger.debug(self.__str__())
 
-    def handle_output_json(self, data: str) -> (bool, float):
+    def process_rpc_status(self, status: dict):
+        """
+        Called with the result of a Shelly.GetStatus RPC call made over HTTP
+        Same state update as for MQTT messages
+        :param status: '{"input:0":{"id":0,"state":false},"switch:0":{"id":0, "source":"init", "output":false,
+        "temperature":{"tC":37.7, "tF":99.8}},"sys":{...}, ...}'
+        """
+        logger.debug(f"RPC status {status}")
+        if "switch:0" in status:
+            self.update_switch_status(status["switch:0"])
+        if "input:0" in status:
+            self.update_input_status(status["input:0"])
+        self.time_of_last_msg = time.perf_counter()
+        self.on_msg_received()
+
+    def parse_json(self, data: str) -> dict | None:
         """
-        Handle json data received from mqtt
-        @param data: String data holding data about devices relay output
-        '{"id":0, "source":"init", "output":false,"temperature":{"tC":37.7, "tF":99.8}}
-        @return: boolean representing if the output is on or off and devices temperature
+        @param data: JSON string received from mqtt
+        @return: decoded dictionary, None if data could not be decoded
         """
-        logger.debug("Handling JSON output data")
         try:
-            data_dict = json.loads(data)
-            logger.debug(f"Data dict = {data_dict}")
-            output_on_off = data_dict["output"]
-            t = data_dict["temperature"]["tC"]
-            logger.debug(f"Temperature is {t} output is {output_on_off}")
-            return output_on_off, t
+            return json.loads(data)
         except json.decoder.JSONDecodeError:
-            logger.error(f"Failed to parce output json data: {data}")
-        except Exception as e:
-            logger.error(f"Error reading json output data. Error: {e} Data:{data}")
-        return False, self.NO_DATA_VALUE
+            logger.error(f"Failed to parce json data: {data}")
+        return None
 
-    def handle_input_json(self, data: str) -> bool:
+    def update_switch_status(self, switch_status: dict):
         """
-        Handle json data received from mqtt
-        @param data: String data holding data about devices input
-        '{"id":0,"state":false}'
-        @return: boolean representing if the input is on or off
+        Update device state from the status of the relay output
+        @param switch_status: status of the relay output
+        {"id":0, "source":"init", "output":false,"temperature":{"tC":37.7, "tF":99.8}}
         """
-        logger.debug(f"Handling JSON input data {data}")
         try:
-            data_dict = json.loads(data)
-            input_off_on = data_dict["state"]
-            return input_off_on
-        except json.decoder.JSONDecodeError:
-            logger.error(f"Failed to parce input json data: {data}")
-        except Exception as e:
-            logger.error(f"Error reading json input data. Error: {e} Data:{data}")
-        return False
+            received_state = switch_status["output"]
+            self.temperature = switch_status["temperature"]["tC"]
+        except (KeyError, TypeError) as e:
+            logger.error(f"Error reading output data. Error: {e} Data:{switch_status}")
+            return
+        logger.debug(f"Temperature is {self.temperature} output is {received_state}")
+        if self.state_off_on != received_state:
+            # state changed
+            self.state_off_on = received_state
+            self.device_notify(self.event_name_actual_state_changed, self.name, self.device_type)
+        self.update_fleet_state()
+        self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
+        self.cmd_sent_out = False
+
+    def update_input_status(self, input_status: dict):
+        """
+        Update device state from the status of the digital input
+        @param input_status: status of the input '{"id":0,"state":false}'
+        """
+        try:
+            input_off_on = input_status["state"]
+        except (KeyError, TypeError) as e:
+            logger.error(f"Error reading input data. Error: {e} Data:{input_status}")
+            return
+        if input_off_on != self.di_off_on:
+            self.di_off_on = input_off_on
+            # Notify listening devices off input state change
+            self.device_notify(self.event_name_input_state_change, self.name, self.device_type)
+
+    def get_fleet_values(self) -> dict:
+        return {"online": self.state_online, "state_off_on": self.state_off_on, "temperature": self.temperature}
 
     def _turn_device_off_on(self, off_on: bool):
         """
@@ -223,9 +267,12 @@ class ShellyPlus(MqttDevice):
         if self.state_online and self.get_cmd_given() == self.state_off_on:
             # Device state equal to cmd, no need to send msg to mqtt
             return
-        publish_payload = "on" if off_on else "off"
-        self.mqtt_publish(self.sw_cntrl_topic, publish_payload)
-        self.cmd_sent_out = True
+        if self.rpc_fallback:
+            self.rpc_fallback.set_switch(self, off_on)
+        else:
+            publish_payload = "on" if off_on else "off"
+            self.mqtt_publish(self.sw_cntrl_topic, publish_payload)
+        self.on_cmd_sent()
 
     def __str__(self):
         return (f"Name: {self.name} Online: {self.state_online} Output: {self.state_off_on} Input: {self.di_off_on} "
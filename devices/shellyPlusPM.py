@@ -2,7 +2,6 @@ import time
 from typing import Callable
 import logging
 import os
-import json
 from devices.deviceTypes import DeviceType
 from devices.mqttDevice import MqttDevice
 from devices.device import Device
@@ -56,76 +55,38 @@ class ShellyPlusPM(ShellyPlus):
 
     def __init__(self, plug_id: str, mqtt_publish: Callable[[str, str], None],
                  name: str = "Shelly plus PM",
-                 device_type: DeviceType = DeviceType.SHELLY_PLUS_PM):
-        super().__init__(plug_id, mqtt_publish, name, device_type)
+                 device_type: DeviceType = DeviceType.SHELLY_PLUS_PM,
+                 ip: str = "",
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
+        super().__init__(plug_id, mqtt_publish, name, device_type, ip, state_file_loc)
         self.power = self.NO_DATA_VALUE # W
         self.voltage = self.NO_DATA_VALUE
         self.current = self.NO_DATA_VALUE
         self.energy = self.NO_DATA_VALUE #kWh
 
-    def process_received_mqtt_data(self, topic: str, data: str):
+    def update_switch_status(self, switch_status: dict):
         """
-        This will be called by the Mqtt client when a relevant message to this device is published
-        :param topic: mqtt topic
-        :param data: payload
-        :return:
-        """
-        logger.debug(f"Topic: {topic} Data: {data}")
-        relevant_msg_received = False
-        clean_data = data.strip("b'")
-        if topic == self.output_topic:
-            relevant_msg_received = True
-            received_state, self.temperature, self.power, self.voltage, self.current, self.energy = (
-                self.handle_output_json(clean_data))
-            if self.state_off_on != received_state:
-                # state changed
-                self.state_off_on = received_state
-                self.device_notify(self.event_name_actual_state_changed, self.name, self.device_type)
-            self.device_notify(self.event_name_new_extra_data, self.name, self.device_type)
-            self.cmd_sent_out = False
-        elif topic == self.input_topic:
-            relevant_msg_received = True
-            input_off_on = self.handle_input_json(clean_data)
-            if input_off_on != self.di_off_on:
-                self.di_off_on = input_off_on
-                # Notify listening devices off input state change
-                self.device_notify(self.event_name_input_state_change, self.name, self.device_type)
-        else:
-            # Handle unrecognized topics if needed
-            pass
-            # logger.debug("Unhandled MQTT msg:")
-            # logger.debug(f"Topic: {topic}\tData: {data}")
-        if relevant_msg_received:
-            self.time_of_last_msg = time.perf_counter()
-            logger.debug(self.__str__())
-
-    def handle_output_json(self, data: str) -> (bool, float, float, float, float, float):
-        """
-        Handle json data received from mqtt
-        @param data: String data holding data about devices relay output
+        Read power measurements, then update the state same as ShellyPlus
+        @param switch_status: status of the relay output
         '{"id":0, "source":"init", "output":false, "apower":0.0, "voltage":233.6, "current":0.000,
         "aenergy":{"total":0.000,"by_minute":[0.000,0.000,0.000],"minute_ts":1710094020},
         "temperature":{"tC":47.6, "tF":117.6}}
-        @return: boolean representing if the output is on or off and devices temperature
         """
-
-        logger.debug("Handling JSON output data")
         try:
-            data_dict = json.loads(data)
-            logger.debug(f"Data dict = {data_dict}")
-            output_on_off = data_dict["output"]
-            power = data_dict["apower"]
-            voltage = data_dict["voltage"]
-            current = data_dict["current"]
-            energy = data_dict["aenergy"]["total"] / 1000.0
-            t = data_dict["temperature"]["tC"]
-            logger.debug(f"Temperature is {t} output is {output_on_off}")
-            return output_on_off, t, power, voltage, current, energy
-        except json.decoder.JSONDecodeError:
-            logger.error(f"Failed to parce output json data: {data}")
-        except Exception as e:
-            logger.error(f"Error reading json output data. Error: {e} Data:{data}")
-        return False, self.NO_DATA_VALUE, self.NO_DATA_VALUE, self.NO_DATA_VALUE, self.NO_DATA_VALUE, self.NO_DATA_VALUE
+            self.power = switch_status["apower"]
+            self.voltage = switch_status["voltage"]
+            self.current = switch_status["current"]
+            self.energy = switch_status["aenergy"]["total"] / 1000.0
+        except (KeyError, TypeError) as e:
+            logger.error(f"Error reading power data. Error: {e} Data:{switch_status}")
+            self.power, self.voltage, self.current, self.energy = (self.NO_DATA_VALUE, self.NO_DATA_VALUE,
+                                                                   self.NO_DATA_VALUE, self.NO_DATA_VALUE)
+        super().update_switch_status(switch_status)
+
+    def get_fleet_values(self) -> dict:
+        values = super().get_fleet_values()
+        values.update({"power": self.power, "voltage": self.voltage, "current": self.current, "energy": self.energy})
+        return values
 
     def __str__(self):
         return (f"Name: {self.name} Online: {self.state_online} Output: {self.state_off_on} Input: {self.di_off_on} "
@@ -6,12 +6,12 @@ Example smart plugs
 
 import logging
 import os
-import threading
 import queue
 import time
 from abc import abstractmethod
 from devices.device import Device
 from devices.deviceTypes import DeviceType
+from helpers.http_client_pool import HttpClientPool
 import settings
 
 # Setup logging
@@ -38,7 +38,8 @@ class URLControlledDev(Device):
                  url_off: str,
                  url_on: str,
                  device_type: DeviceType,
-                 name: str = "Test URL controlled device"):
+                 name: str = "Test URL controlled device",
+                 state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state"):
         """
         @param url_off:
         URL to call to turn device off
@@ -46,6 +47,7 @@ class URLControlledDev(Device):
         @param url_on:
         URL to call to turn device on
         Example shelly http://172.31.0.246/relay/0?turn=on
+        @param state_file_loc: folder the device state is saved in
         """
         self.state_online = False
         self.state_off_on = False
@@ -53,9 +55,11 @@ class URLControlledDev(Device):
         self.url_on = url_on
         # Queue to transfer data between mani thread and URL call therad
         self.url_call_queue = queue.Queue()
-        self.url_thread = threading.Thread(target=self.call_url_threaded,
-                                           args=("www.fakeurl.com", self.url_call_queue,))
-        super().__init__(device_type, name)
+        # URL calls of all devices run on the same pool, reusing connections
+        self.http_pool = HttpClientPool.get_shared()
+        # Future of the URL call in progress
+        self.url_call_future = None
+        super().__init__(device_type, name, state_file_loc)
 
     def _turn_device_off_on(self, off_on: bool):
         """
@@ -63,24 +67,19 @@ class URLControlledDev(Device):
         @param off_on: command
         @return:
         """
-        if not self.url_thread.is_alive():
+        if self.url_call_future is None or self.url_call_future.done():
             # Only execute if previous call has ended
-            if off_on:
-                self.url_thread = threading.Thread(target=self.call_url_threaded,
-                                                   args=(self.url_on, self.url_call_queue,))
-            else:
-                self.url_thread = threading.Thread(target=self.call_url_threaded,
-                                                   args=(self.url_off, self.url_call_queue,))
-            self.url_thread.start()
+            url = self.url_on if off_on else self.url_off
+            self.url_call_future = self.http_pool.submit(self.call_url_threaded, url, self.url_call_queue)
             # save time of last call so it is known when to recheck
             self.time_of_last_call = time.perf_counter()
         else:
-            logger.warning(f"{self.name}: URL call thread is alive, cannot start another one")
+            logger.warning(f"{self.name}: URL call in progress, cannot start another one")
 
     @abstractmethod
     def call_url_threaded(self, url: str, return_queue: queue.Queue):
         """
-        Call the URL
+        Call the URL, executed on the shared HTTP pool. Use self.http_pool.get_json for the call.
         Implement depending on what device returns in its response.
         As bare minimum inform main thread if call was successful.
         @param url:
@@ -12,8 +12,10 @@ from helpers.observer_pattern import Observer
 from helpers.price_file_manager import PriceFileManager
 from devices.device import Device
 from devices.deviceTypes import DeviceType
+from devices.shelly3emEnergyMeterMqtt import ShellyEnergyMeter3em
 from helpers.sensor import Sensor
 from helpers.database_mngr import DbMngr
+from system_setup.device_registry import DeviceRegistry
 import secrets
 import settings
 from helpers.data_storage_interface import DataStoreInterface
@@ -50,19 +52,20 @@ class DataLogger(Observer):
         PRICE_LOG_GRAFANA = auto()
         SHELLY_LOG = auto()
         SENSOR_LOG = auto()
+        ENERGY_METER_MINUTE_LOG = auto()
         STOP_LOG = auto()
 
-    def __init__(self, get_prices_method: Callable[[], Tuple[Dict, Dict]], device_list: list[Device],
+    def __init__(self, get_prices_method: Callable[[], Tuple[Dict, Dict]], device_registry: DeviceRegistry,
                  sensor_list: list[Sensor], periodical_log_interval_s: float = 3600.0) -> None:
         """
         :param get_prices_method: Method to call for this class to get the prices of electricity
-        :param device_list: list of devices whose data is to be logged
+        :param device_registry: devices whose data is to be logged
         :param sensor_list: list of sensors to be logged
         :param periodical_log_interval_s: how often to periodically log device data
         """
         self.periodical_log_interval_s = periodical_log_interval_s
         self.get_prices_method = get_prices_method
-        self.device_list = device_list
+        self.device_registry = device_registry
         self.sensor_list = sensor_list
         self.data_queue = queue.Queue()
         # To periodically execute logging
@@ -128,7 +131,7 @@ class DataLogger(Observer):
         # log device data
         logger.debug("periodical_device_log")
         # Execute this function in regular intervals
-        for dev in self.device_list:
+        for dev in self.device_registry:
             if dev.get_cmd_given():
                 logger.debug(f"Device {dev.name} is on, executing periodical log")
                 self.log_device_data(dev)
@@ -146,6 +149,10 @@ class DataLogger(Observer):
                     logger.error(f"{key}: {value}")
                 return
             self.handle_device_event(device_name)
+        elif event_type == ShellyEnergyMeter3em.event_name_new_minute_data:
+            # Aggregated minute data of an energy meter, logged as one batch
+            self.data_queue.put({"log_type": self.LogType.ENERGY_METER_MINUTE_LOG,
+                                 "data": (kwargs.get('device_name'), kwargs.get('samples', []))})
 
     def handle_device_event(self, device_name: str) -> None:
         # Log data for different devices
@@ -168,10 +175,7 @@ class DataLogger(Observer):
 
     def get_device_by_name(self, device_name) -> Device:
         # get device object by name
-        for dev in self.device_list:
-            if dev.name == device_name:
-                return dev
-        return None
+        return self.device_registry.get_by_name(device_name)
 
     def get_and_store_prices(self) -> None:
         # get prices of today and tomorrow and insert them in the database
@@ -204,6 +208,8 @@ class DataLogger(Observer):
             # Store in sqlite database
             self.sql_lite_storage = DbMngr()
             storage_list.append(self.sql_lite_storage)
+            # Devices can be looked up by their database id
+            self.device_registry.set_db_ids(self.sql_lite_storage.get_device_ids())
         if settings.ENABLE_SQL_LITE_LOGGING:
             # Store in grafana cloud
             self.grafana_cloud = GrafanaCloud(endpoint=secrets.GRAFANA_ENDPOINT,
@@ -237,6 +243,10 @@ class DataLogger(Observer):
                         sensor_list = data["data"]
                         for storage in storage_list:
                             storage.insert_sensor_list_data(sensor_list)
+                    elif data["log_type"] == self.LogType.ENERGY_METER_MINUTE_LOG:
+                        device_name, samples = data["data"]
+                        for storage in storage_list:
+                            storage.insert_energy_meter_minute_data(device_name, samples)
                     elif data["log_type"] == self.LogType.STOP_LOG:
                         # Stopping data base thread
                         run = False
@@ -20,6 +20,15 @@ class DataStoreInterface(ABC):
     def insert_sensor_list_data(self, sensor_list: list[Sensor]):
         pass
 
+    @abstractmethod
+    def insert_energy_meter_minute_data(self, name: str, samples: list):
+        """
+        :param name: energy meter name
+        :param samples: list of EnergyMeterMinuteSample, each with its own timestamp
+        For aggregated minute data, inserted as one batch
+        """
+        pass
+
     @abstractmethod
     def insert_current_hour_price(self, current_price:float, timestamp:datetime):
         """
@@ -94,6 +94,7 @@ class DbMngr(DataStoreInterface):
     shelly_data - data containing shelly smartplug data - linked to the devices table
     sensors - list of sensors used in the project
     sensor_data - read sensor values - linked to sensors table
+    energy_meter_minute_data - aggregated minute values of energy meters - linked to the devices table
     TODO: Auto delete data older than
     """
     NO_DATA_VALUE = -0.99
@@ -153,6 +154,7 @@ class DbMngr(DataStoreInterface):
         self.create_table_for_shelly_data()
         self.create_table_of_sensors()
         self.create_table_of_sensor_data()
+        self.create_table_for_energy_meter_minute_data()
 
     def fix_id_for_shelly_table(self, start_id=224):
         """
@@ -263,6 +265,35 @@ class DbMngr(DataStoreInterface):
             # logging.error("An unexpected error occurred when inserting system data: %s", e)
             self.conn.rollback()
 
+    def insert_energy_meter_minute_data(self, name: str, samples: list):
+        """
+        :param name: energy meter name, must be in the devices table
+        :param samples: list of EnergyMeterMinuteSample
+        :return:
+        """
+        if not samples:
+            return
+        fields = list(samples[0].values)
+        rows = []
+        for sample in samples:
+            record_time = datetime.fromtimestamp(sample.timestamp, timezone.utc)
+            rows.append((name, record_time.strftime('%Y-%m-%d %H:%M:%S'), str(record_time.date()), sample.phase,
+                         sample.period_s, *(sample.values[field] for field in fields)))
+        try:
+            # All samples in one statement and one commit
+            self.cursor.executemany(f'INSERT INTO energy_meter_minute_data '
+                                    f'(device_id, record_time, date, phase, period, {", ".join(fields)}) '
+                                    f'VALUES ((SELECT device_id FROM devices WHERE name = ?), '
+                                    f'?, ?, ?, ?, {", ".join("?" * len(fields))})',
+                                    rows)
+            self.conn.commit()
+        except sqlite3.DatabaseError as db_error:
+            # logging.error("Database error occurred when inserting system data: %s", db_error)
+            self.conn.rollback()  # Roll back any changes if an error occurred
+        except Exception as e:
+            # logging.error("An unexpected error occurred when inserting system data: %s", e)
+            self.conn.rollback()
+
     def _do_sensor_cursor_statement(self, name: str, value: float, formatted_time: str, date_str: str):
         """
         :param name: Sensor name
@@ -325,6 +356,45 @@ class DbMngr(DataStoreInterface):
                           (dev_type, name, plug_id, active))
         self.conn.commit()
 
+    def get_device_ids(self) -> dict[str, int]:
+        """
+        :return: dictionary of device name: device_id from the devices table
+        """
+        self.cursor.execute("SELECT name, device_id FROM devices")
+        return {name: device_id for name, device_id in self.cursor.fetchall()}
+
+    def get_prices(self, start_date: datetime.date, end_date: datetime.date) -> dict:
+        """
+        Prices are stored in UTC hours, they are returned in local hours like they are given to insert_prices
+        :param start_date: first date of prices
+        :param end_date: last date of prices
+        :return: dictionary of date: {hour: price}
+        """
+        dif_from_utc = self.get_dif_from_utc()
+        self.cursor.execute("SELECT date, hour, price FROM prices WHERE date BETWEEN ? AND ? ORDER BY date, hour",
+                            (str(start_date - timedelta(days=1)), str(end_date + timedelta(days=1))))
+        prices = {}
+        for date_str, hour_utc, price in self.cursor.fetchall():
+            local_time = datetime.fromisoformat(date_str) + timedelta(hours=hour_utc + dif_from_utc)
+            if start_date <= local_time.date() <= end_date:
+                prices.setdefault(local_time.date(), {})[local_time.hour] = price
+        return prices
+
+    def get_shelly_power_data(self, name: str, start_date: datetime.date, end_date: datetime.date) -> list:
+        """
+        :param name: Shelly plug name
+        :param start_date: first UTC date of data
+        :param end_date: last UTC date of data
+        :return: list of (record time in local time, off_on, power), records without power left out
+        """
+        dif_from_utc = self.get_dif_from_utc()
+        self.cursor.execute("SELECT record_time, off_on, power FROM shelly_data "
+                            "WHERE device_id = (SELECT device_id FROM devices WHERE name = ?) "
+                            "AND date BETWEEN ? AND ? AND power != ? ORDER BY record_time",
+                            (name, str(start_date), str(end_date), self.NO_DATA_VALUE))
+        return [(datetime.fromisoformat(record_time) + timedelta(hours=dif_from_utc), bool(off_on), power)
+                for record_time, off_on, power in self.cursor.fetchall()]
+
     def insert_sensor(self, name: str, sensor_type: int = 0, active: bool = True):
         """
         @param name: name of sensor
@@ -419,6 +489,40 @@ class DbMngr(DataStoreInterface):
         self.cursor.execute("CREATE INDEX IF NOT EXISTS shelly_data_index ON shelly_data(device_id, date)")
         self.conn.commit()
 
+    def create_table_for_energy_meter_minute_data(self):
+        """
+        Create a table for aggregated minute data of energy meters, one row per phase and period
+        Device id connected to the device table
+        """
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS energy_meter_minute_data (
+                              id INTEGER PRIMARY KEY,
+                              device_id INTEGER,
+                              record_time DATETIME,
+                              date DATE,
+                              phase INTEGER,
+                              period INTEGER,
+                              total_act_energy FLOAT,
+                              fund_act_energy FLOAT,
+                              total_act_ret_energy FLOAT,
+                              fund_act_ret_energy FLOAT,
+                              max_act_power FLOAT,
+                              min_act_power FLOAT,
+                              max_aprt_power FLOAT,
+                              min_aprt_power FLOAT,
+                              max_voltage FLOAT,
+                              min_voltage FLOAT,
+                              avg_voltage FLOAT,
+                              max_current FLOAT,
+                              min_current FLOAT,
+                              avg_current FLOAT,
+                              UNIQUE(device_id, record_time, phase) ON CONFLICT IGNORE,
+                              FOREIGN KEY(device_id) REFERENCES devices(device_id)
+                           )''')
+        # Device id and date will be used to get data from the table so create index
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS energy_meter_minute_data_index "
+                            "ON energy_meter_minute_data(device_id, date)")
+        self.conn.commit()
+
     def create_correct_datetime_column_shelly_data(self):
         """
         Time in table was saved in GMT+2. Change so it is GMT.
@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+import time
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "device_supervisor.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    class TestDevice:
+        def __init__(self, name: str):
+            self.name = name
+
+        def on_deadline(self, deadline_name: str):
+            print(f"{time.perf_counter() - time_start:.1f}s {self.name} {deadline_name}")
+
+    time_start = time.perf_counter()
+    supervisor = DeviceSupervisor(tick_s=0.1, wheel_size=8)
+    devices = [TestDevice(f"dev_{i}") for i in range(3)]
+    supervisor.schedule(devices[0], "offline", 0.3)
+    supervisor.schedule(devices[1], "offline", 1.2)
+    supervisor.schedule(devices[2], "confirm", 0.5)
+    # Rescheduling replaces the earlier deadline
+    supervisor.schedule(devices[0], "offline", 0.6)
+    supervisor.cancel(devices[2], "confirm")
+    for i in range(15):
+        time.sleep(0.1)
+        supervisor.tick()
+    print(supervisor.get_stats())
+
+
+class DeviceSupervisor:
+    """
+    Timer wheel of per device deadlines, such as offline timeout, command confirmation timeout and status request
+    due time. A tick only visits the wheel slots that passed since the previous tick, so an idle tick does not touch
+    every device.
+    Rescheduling or cancelling a deadline does not search the wheel. Each scheduled (device, deadline name) holds the
+    generation number of its latest entry, old wheel entries with another generation are dropped when their slot is
+    reached.
+    Devices must implement on_deadline(deadline_name: str). It is called from the thread calling tick().
+    """
+    # Resolution of deadlines
+    TICK_S = 1.0
+    # Number of slots, deadlines further away than one turn of the wheel wait for more turns in their slot
+    WHEEL_SIZE = 256
+
+    def __init__(self, tick_s: float = TICK_S, wheel_size: int = WHEEL_SIZE):
+        """
+        :param tick_s: resolution of deadlines
+        :param wheel_size: number of slots in the wheel
+        """
+        self.tick_s = tick_s
+        self.wheel_size = wheel_size
+        self._lock = threading.Lock()
+        # Each slot is a list of (deadline tick, device, deadline name, generation)
+        self._wheel = [[] for _ in range(wheel_size)]
+        # (id(device), deadline name): generation of the valid wheel entry
+        self._generations = {}
+        self._next_generation = 0
+        self._time_start = time.perf_counter()
+        self._current_tick = 0
+        self._stats = {"scheduled": 0, "fired": 0, "stale_dropped": 0}
+
+    def _get_tick_now(self) -> int:
+        return int((time.perf_counter() - self._time_start) / self.tick_s)
+
+    def schedule(self, device, deadline_name: str, delay_s: float) -> None:
+        """
+        Set or replace a deadline of a device
+        :param device: device whose on_deadline will be called
+        :param deadline_name: deadline, one device can have several different ones
+        :param delay_s: time from now
+        """
+        # Round up so a deadline never fires early
+        deadline_tick = self._get_tick_now() + max(1, int(-(-delay_s // self.tick_s)))
+        key = (id(device), deadline_name)
+        with self._lock:
+            self._next_generation += 1
+            generation = self._next_generation
+            self._generations[key] = generation
+            self._wheel[deadline_tick % self.wheel_size].append((deadline_tick, device, deadline_name, generation))
+            self._stats["scheduled"] += 1
+
+    def cancel(self, device, deadline_name: str) -> None:
+        """
+        Remove a deadline if it is set
+        """
+        key = (id(device), deadline_name)
+        with self._lock:
+            self._generations.pop(key, None)
+
+    def tick(self) -> None:
+        """
+        Call periodically, at least once per tick_s. Fires all deadlines that have expired.
+        """
+        expired = []
+        tick_now = self._get_tick_now()
+        with self._lock:
+            # Visit each slot at most once even if tick was not called for longer than one turn of the wheel
+            first_tick = max(self._current_tick + 1, tick_now - self.wheel_size + 1)
+            for tick_nr in range(first_tick, tick_now + 1):
+                slot = self._wheel[tick_nr % self.wheel_size]
+                if not slot:
+                    continue
+                remaining = []
+                for entry in slot:
+                    deadline_tick, device, deadline_name, generation = entry
+                    key = (id(device), deadline_name)
+                    if self._generations.get(key) != generation:
+                        # Rescheduled or cancelled
+                        self._stats["stale_dropped"] += 1
+                    elif deadline_tick > tick_now:
+                        # Due on a later turn of the wheel
+                        remaining.append(entry)
+                    else:
+                        del self._generations[key]
+                        expired.append((device, deadline_name))
+                self._wheel[tick_nr % self.wheel_size] = remaining
+            self._current_tick = max(self._current_tick, tick_now)
+            self._stats["fired"] += len(expired)
+        # Call devices without holding the lock, they may schedule new deadlines
+        for device, deadline_name in expired:
+            try:
+                device.on_deadline(deadline_name)
+            except Exception as e:
+                logger.error(f"Error handling deadline {deadline_name} of {device.name}: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._generations)
+            stats["wheel_entries"] = sum(len(slot) for slot in self._wheel)
+        return stats
+
+
+if __name__ == '__main__':
+    test()
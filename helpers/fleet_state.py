@@ -0,0 +1,197 @@
+"""
+Live readings of all devices in one table
+Each reading is a column backed by an array of floats, each device has a slot (row) in every column. Every cell also
+has the time it was last written. Devices write their readings, UI, logger and controllers read consistent snapshots
+and aggregates without going through the device objects.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from global_var import NO_DATA_VALUE
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "fleet_state.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    test_column_sum()
+    from devices.deviceTypes import DeviceType
+    table = FleetStateTable()
+    plug_1 = table.add_slot("Plug 1", DeviceType.SHELLY_PLUG)
+    plug_2 = table.add_slot("Plug 2", DeviceType.SHELLY_PLUG)
+    relay = table.add_slot("Relay", DeviceType.SHELLY_PLUS_PM)
+    table.set_values(plug_1, {"online": True, "power": 120.5, "energy": 1.2})
+    table.set_values(plug_2, {"online": True, "power": NO_DATA_VALUE})
+    table.set_values(relay, {"online": False, "power": 30.0, "temperature": 45.1})
+    print(table.column_sum("power"))
+    print(table.column_sum("power", DeviceType.SHELLY_PLUG))
+    print(table.get_value(plug_2, "power"))
+    print(table.snapshot())
+
+
+def test_column_sum():
+    from devices.deviceTypes import DeviceType
+    table = FleetStateTable()
+    plug_1 = table.add_slot("Plug 1", DeviceType.SHELLY_PLUG)
+    plug_2 = table.add_slot("Plug 2", DeviceType.SHELLY_PLUG)
+    relay = table.add_slot("Relay", DeviceType.SHELLY_PLUS_PM)
+    assert table.column_sum("power") == 0.0
+    time_now = time.time()
+    table.set_values(plug_1, {"power": 100.0}, timestamp=time_now - 120)
+    table.set_values(plug_2, {"power": NO_DATA_VALUE}, timestamp=time_now)
+    table.set_values(relay, {"power": 30.0}, timestamp=time_now)
+    # Missing values skipped
+    assert table.column_sum("power") == 130.0
+    assert table.column_sum("power", DeviceType.SHELLY_PLUG) == 100.0
+    assert table.column_sum("power", DeviceType.SHELLY_PLUS_PM) == 30.0
+    assert table.column_sum("power", DeviceType.SHELLY_PLUS) == 0.0
+    # Readings older than max_age_s skipped
+    assert table.column_sum("power", max_age_s=60) == 30.0
+    assert table.column_sum("power", DeviceType.SHELLY_PLUG, max_age_s=60) == 0.0
+    assert table.column_sum("power", DeviceType.SHELLY_PLUG, max_age_s=300) == 100.0
+    # Overwritten and cleared values leave the sums
+    table.set_values(plug_2, {"power": 20.0})
+    table.set_values(plug_1, {"power": None})
+    assert table.column_sum("power") == 50.0
+    assert table.column_sum("power", DeviceType.SHELLY_PLUG) == 20.0
+    table.set_values(plug_2, {"power": math.nan})
+    table.set_values(relay, {"power": 0.1})
+    table.set_values(relay, {"power": 0.2})
+    assert table.column_sum("power", DeviceType.SHELLY_PLUG) == 0.0
+    # Running sum, may differ from the exact sum by rounding
+    assert math.isclose(table.column_sum("power"), 0.2)
+    logger.info("Column sums equal")
+
+
+class FleetStateTable:
+    """
+    Thread safe, devices write from MQTT and HTTP threads
+    Missing readings are stored as NaN and skipped by aggregates. Booleans are stored as 0.0/1.0.
+    """
+    COLUMNS = ("online", "state_off_on", "power", "energy", "voltage", "current", "temperature")
+    NO_DATA = math.nan
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = []
+        self._device_types = []
+        # Slot numbers of each device type
+        self._type_slots = {}
+        # Running sums of the values present in each column by device type: {column: {device type: [sum, count]}}
+        self._type_sums = {column: {} for column in self.COLUMNS}
+        # Running sums of the values present in each column over all devices: {column: [sum, count]}
+        self._totals = {column: [0.0, 0] for column in self.COLUMNS}
+        self._columns = {column: array("d") for column in self.COLUMNS}
+        # Unix time of last write to each cell, 0 if never written
+        self._timestamps = {column: array("d") for column in self.COLUMNS}
+
+    def add_slot(self, name: str, device_type) -> int:
+        """
+        :param name: device name, a device with several channels can add a slot per channel
+        :param device_type: DeviceType used for aggregates by type
+        :return: slot number to write values to
+        """
+        with self._lock:
+            slot = len(self._names)
+            self._names.append(name)
+            self._device_types.append(device_type)
+            self._type_slots.setdefault(device_type, []).append(slot)
+            for column in self.COLUMNS:
+                self._type_sums[column].setdefault(device_type, [0.0, 0])
+                self._columns[column].append(self.NO_DATA)
+                self._timestamps[column].append(0.0)
+        return slot
+
+    def set_values(self, slot: int, values: dict, timestamp: float = None) -> None:
+        """
+        :param slot: slot returned by add_slot
+        :param values: column: value, NO_DATA_VALUE and None are stored as missing
+        :param timestamp: unix time of the readings, now if not given
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for column, value in values.items():
+                if value is None or value == NO_DATA_VALUE:
+                    value = self.NO_DATA
+                value = float(value)
+                old_value = self._columns[column][slot]
+                self._columns[column][slot] = value
+                self._timestamps[column][slot] = timestamp
+                self._update_sum(self._totals[column], old_value, value)
+                self._update_sum(self._type_sums[column][self._device_types[slot]], old_value, value)
+
+    @staticmethod
+    def _update_sum(running_sum: list, old_value: float, new_value: float) -> None:
+        # NaN is the only value not equal to itself, missing values are not part of the sum
+        if old_value == old_value:
+            running_sum[0] -= old_value
+            running_sum[1] -= 1
+        if new_value == new_value:
+            running_sum[0] += new_value
+            running_sum[1] += 1
+        if running_sum[1] == 0:
+            # Drop the rounding errors left from earlier values
+            running_sum[0] = 0.0
+
+    def get_value(self, slot: int, column: str) -> float:
+        with self._lock:
+            return self._columns[column][slot]
+
+    def get_column(self, column: str) -> array:
+        """
+        :return: copy of the column, indexed by slot
+        """
+        with self._lock:
+            return array("d", self._columns[column])
+
+    def column_sum(self, column: str, device_type=None, max_age_s: float = None) -> float:
+        """
+        :param column: column to sum
+        :param device_type: only sum slots of this DeviceType, all if None
+        :param max_age_s: skip cells not written within this time. Walks the slots, without it the running sum kept
+        by set_values is returned.
+        :return: sum of the column, missing values skipped
+        """
+        with self._lock:
+            if max_age_s is None:
+                if device_type is None:
+                    return self._totals[column][0]
+                return self._type_sums[column].get(device_type, (0.0, 0))[0]
+            oldest_allowed = time.time() - max_age_s
+            values, timestamps = self._columns[column], self._timestamps[column]
+            slots = range(len(values)) if device_type is None else self._type_slots.get(device_type, [])
+            # NaN is the only value not equal to itself
+            return math.fsum(values[slot] for slot in slots
+                             if timestamps[slot] >= oldest_allowed and values[slot] == values[slot])
+
+    def snapshot(self) -> dict:
+        """
+        All columns copied under one lock, so values of different devices and columns belong together
+        :return: {"time", "names", "device_types", "columns": {column: list}, "timestamps": {column: list}}
+        """
+        with self._lock:
+            return {"time": time.time(),
+                    "names": list(self._names),
+                    "device_types": list(self._device_types),
+                    "columns": {column: self._columns[column].tolist() for column in self.COLUMNS},
+                    "timestamps": {column: self._timestamps[column].tolist() for column in self.COLUMNS}}
+
+
+if __name__ == '__main__':
+    test()
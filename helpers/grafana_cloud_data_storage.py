@@ -147,6 +147,28 @@ class GrafanaCloud(DataStoreInterface):
                 logger.error(f"Sensor{s}, value {s.value}")
         return payload
 
+    def insert_energy_meter_minute_data(self, name: str, samples: list):
+        logger.debug("Inserting energy meter minute data")
+        if not samples:
+            return
+        payload = self._get_payload_from_minute_data(name, samples)
+        logger.debug(f"Got minute data payload {payload}")
+        self._post_to_cloud(payload)
+        logger.debug("Inserting energy meter minute data done")
+
+    def _get_payload_from_minute_data(self, name: str, samples: list) -> str:
+        """
+        Return payload for posting to Grafana, all samples in one post
+        For minute data, create payload like this, one line per sample:
+        meter_name_ph1,source=source_tag max_act_power=1.6,min_act_power=1.0 timestamp_ns
+        """
+        lines = []
+        for sample in samples:
+            metrics = ",".join(f"{field}={value:.3f}" for field, value in sample.values.items())
+            line = f"{name.replace(' ', '_')}_ph{sample.phase},source={self._source_tag} {metrics}"
+            lines.append(self._add_timestamp_to_payload(line, datetime.fromtimestamp(sample.timestamp, timezone.utc)))
+        return "\n".join(lines)
+
     def insert_current_hour_price(self, current_price: float, timestamp: datetime):
         logger.debug("Inserting current hour price data")
         payload = self._get_payload_from_hourly_price(current_price,timestamp)
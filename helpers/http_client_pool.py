@@ -0,0 +1,142 @@
+"""
+Shared HTTP client for devices controlled over HTTP.
+One requests Session keeps connections to each host alive, a bounded thread pool caps how many calls run at once.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
+import requests
+from requests.adapters import HTTPAdapter
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "http_client_pool.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    pool = HttpClientPool.get_shared()
+    futures = [pool.submit(pool.get_json, "http://172.31.0.246/relay/0") for i in range(5)]
+    for future in futures:
+        try:
+            print(future.result())
+        except requests.RequestException as e:
+            print(f"Failed {e}")
+    print(pool.get_stats())
+    pool.stop()
+
+
+class HttpClientPool:
+    """
+    Bounded pool of worker threads sharing one connection pooled requests Session
+    Use get_shared() so all devices share the same connections and concurrency limit.
+    """
+    # Maximum number of HTTP calls in progress at the same time
+    MAX_CONCURRENT_CALLS = 8
+    # Number of hosts to keep connections to, one per device
+    MAX_HOSTS = 100
+    # Connect and read timeout
+    TIMEOUT_S = 1.0
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def get_shared(cls) -> "HttpClientPool":
+        """
+        :return: pool shared by all devices, created on first call
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __init__(self, max_concurrent_calls: int = MAX_CONCURRENT_CALLS, max_hosts: int = MAX_HOSTS):
+        """
+        :param max_concurrent_calls: number of worker threads
+        :param max_hosts: number of hosts to keep alive connections to
+        """
+        self.session = requests.Session()
+        # Devices are polled again on their own, so no retries here
+        adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_concurrent_calls, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_calls, thread_name_prefix="http_pool")
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "errors": 0, "total_time_s": 0.0, "max_time_s": 0.0}
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Run a function on the pool, usually a device method calling get_json or post_json
+        :return: future holding the result of the function
+        """
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def get_json(self, url: str, timeout: float = TIMEOUT_S):
+        """
+        Blocking GET, call from a function submitted to the pool
+        :raises requests.RequestException: on connection errors, timeouts and error status codes
+        :raises ValueError: if the reply is not JSON
+        :return: decoded JSON reply
+        """
+        return self._request("GET", url, timeout=timeout)
+
+    def post_json(self, url: str, payload: dict, timeout: float = TIMEOUT_S):
+        """
+        Blocking POST of a JSON payload, call from a function submitted to the pool
+        :raises requests.RequestException: on connection errors, timeouts and error status codes
+        :raises ValueError: if the reply is not JSON
+        :return: decoded JSON reply
+        """
+        return self._request("POST", url, timeout=timeout, json=payload)
+
+    def _request(self, method: str, url: str, timeout: float, **kwargs):
+        time_start = time.perf_counter()
+        error = True
+        try:
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+            response.raise_for_status()
+            reply = response.json()
+            error = False
+            return reply
+        finally:
+            self._update_stats(time.perf_counter() - time_start, error)
+
+    def _update_stats(self, call_time_s: float, error: bool):
+        with self._stats_lock:
+            self._stats["calls"] += 1
+            self._stats["errors"] += 1 if error else 0
+            self._stats["total_time_s"] += call_time_s
+            self._stats["max_time_s"] = max(self._stats["max_time_s"], call_time_s)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_time_s"] = stats["total_time_s"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+    def stop(self):
+        # Wait for calls in progress and close connections
+        self._executor.shutdown(wait=True)
+        self.session.close()
+        with self._shared_lock:
+            if HttpClientPool._shared is self:
+                HttpClientPool._shared = None
+
+
+if __name__ == '__main__':
+    test()
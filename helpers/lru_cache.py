@@ -0,0 +1,90 @@
+"""
+Small least recently used cache with statistics
+Used for results of calculations that are repeated with the same inputs, for example schedules created from the same
+prices and parameters.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Any
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "lru_cache.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    cache = LruCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    print(cache.get("a"))
+    # b is least recently used and removed
+    cache.put("c", 3)
+    print(cache.get("b"), cache.get("c"))
+    print(cache.get_stats())
+
+
+class LruCache:
+    """
+    Thread safe, results are calculated from UI and schedule threads
+    """
+    MAX_SIZE = 32
+
+    def __init__(self, max_size: int = MAX_SIZE):
+        """
+        :param max_size: number of results kept, least recently used removed first
+        """
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """
+        :return: cached value, None if not in cache
+        """
+        with self._lock:
+            if key not in self._items:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {"hits": self._hits, "misses": self._misses, "evictions": self._evictions,
+                    "size": len(self._items), "max_size": self.max_size,
+                    "hit_rate": self._hits / lookups if lookups else 0.0}
+
+
+if __name__ == '__main__':
+    test()
@@ -7,6 +7,11 @@ from queue import Queue
 from typing import Callable
 from enum import Enum, auto
 from helpers.observer_pattern import Subject
+from helpers.mqtt_shard_pool import MqttShardPool
+from helpers.mqtt_recorder import MqttRecorder
+from helpers.mqtt_stats import MqttStats
+from helpers.mqtt_publish_coalescer import MqttPublishCoalescer
+from helpers.mqtt_topic_index import MqttTopicIndex
 import secrets
 import settings
 
@@ -70,6 +75,37 @@ def test():
         client.stop()
 
 
+def test_publish_while_disconnected():
+    """
+    Publishes made while the broker connection is lost stay in the coalescer and are sent after reconnecting
+    Connection changes are simulated by calling the callbacks registered with paho, nothing is sent to a broker.
+    """
+    coalescer = MqttPublishCoalescer(min_publish_interval_s=0)
+    client_thread = MyMqttClient.MqttClientThread(broker_addr="localhost", port=1883, user="", psw="",
+                                                  queue_to_mqtt_thread=Queue(), queue_from_mqtt_thread=Queue(),
+                                                  publish_coalescer=coalescer)
+    published = []
+    client_thread.publish = lambda topic, payload: published.append((topic, payload))
+    paho_client = client_thread.mqtt_client
+    paho_client.on_connect(paho_client, None, {}, 0)
+    coalescer.add("shellyplus1-441793ab3fb4/command/switch:0", "on")
+    client_thread.publish_pending()
+    assert published == [("shellyplus1-441793ab3fb4/command/switch:0", "on")], published
+    # Broker drops the connection
+    paho_client.on_disconnect(paho_client, None, 1)
+    assert client_thread.status == client_thread.STATUS_DISCONNECTED
+    coalescer.add("shellyplus1-441793ab3fb4/command/switch:0", "off")
+    client_thread.publish_pending()
+    assert len(published) == 1, published
+    assert coalescer.get_pending_count() == 1
+    # Sent once connected again
+    paho_client.on_connect(paho_client, None, {}, 0)
+    client_thread.publish_pending()
+    assert published[-1] == ("shellyplus1-441793ab3fb4/command/switch:0", "off"), published
+    assert coalescer.get_pending_count() == 0
+    logger.info("Publishes kept while disconnected and sent after reconnect")
+
+
 def test_cb(topic: str, payload: str):
     print(f"Callback {topic} {payload}")
 
@@ -84,7 +120,13 @@ class MyMqttClient(Subject):
     # For the observer pattern
     event_name_status_change = "mqtt_status_changed"
 
-    def __init__(self):
+    def __init__(self, worker_threads: int = 0, stats_log_interval_s: float = 0):
+        """
+        :param worker_threads: if above 0, device callbacks are executed on a pool of worker threads sharded by device
+        listen topic, so messages of one device stay in order while different devices are handled in parallel.
+        If 0, callbacks are executed on the thread calling loop().
+        :param stats_log_interval_s: how often to log a line of message statistics, 0 - do not log
+        """
         Subject.__init__(self)
         self.status = self.MqttClientThread.STATUS_DISCONNECTED
         # Queues for data exchange with the mqtt client thread
@@ -93,12 +135,29 @@ class MyMqttClient(Subject):
         # A dictionary holding topics to listen to and corresponding callbacks when a message has been published to that
         # topic
         self.subscription_dict = {}
-
-    def start(self, broker_addr: str, port: int, user: str, psw: str):
+        # Listen topics by prefix, received messages are dispatched without comparing with every listen topic
+        self.topic_index = MqttTopicIndex()
+        # Records received traffic if set on start
+        self.recorder = None
+        self.shard_pool = MqttShardPool(worker_count=worker_threads) if worker_threads > 0 else None
+        # Publishes waiting to be sent, coalesced per topic
+        self.publish_coalescer = MqttPublishCoalescer()
+        # Message rate and latency statistics
+        self.stats = MqttStats()
+        self.stats_log_interval_s = stats_log_interval_s
+        self.time_of_last_stats_log = time.perf_counter()
+
+    def start(self, broker_addr: str, port: int, user: str, psw: str, recorder: MqttRecorder = None):
+        """
+        :param recorder: if given, every received message is recorded to it. Closed when the client is stopped.
+        """
+        self.recorder = recorder
         # Start the mqtt client thread
         self.mqtt_cl_thread = self.MqttClientThread(broker_addr=broker_addr, port=port, user=user, psw=psw,
                                                     queue_to_mqtt_thread=self.queue_to_mqtt_thread,
-                                                    queue_from_mqtt_thread=self.queue_from_mqtt_thread)
+                                                    queue_from_mqtt_thread=self.queue_from_mqtt_thread,
+                                                    publish_coalescer=self.publish_coalescer,
+                                                    recorder=recorder)
         self.mqtt_cl_thread.start()
 
     def loop(self):
@@ -106,46 +165,108 @@ class MyMqttClient(Subject):
         Has to be called periodically
         """
         self.handle_msgs_from_mqtt_client()
+        self.check_stats_log()
+
+    def check_stats_log(self):
+        # Log statistics line in set intervals if enabled
+        if not self.stats_log_interval_s:
+            return
+        if time.perf_counter() - self.time_of_last_stats_log >= self.stats_log_interval_s:
+            self.time_of_last_stats_log = time.perf_counter()
+            self.stats.log_summary(queue_depth=self.queue_from_mqtt_thread.qsize())
+
+    def get_stats_snapshot(self) -> dict:
+        """
+        :return: message rates, queue depth and latency histograms per topic prefix, see MqttStats.snapshot
+        """
+        return self.stats.snapshot(queue_depth=self.queue_from_mqtt_thread.qsize())
 
     def handle_msgs_from_mqtt_client(self):
         while not self.queue_from_mqtt_thread.empty():
             msg = self.queue_from_mqtt_thread.get()
             logger.debug(f"MSG from mqtt thread {msg}")
-            if msg["msg_type"] == self.mqtt_cl_thread.MsgType.MQTT_CLIENT_STATUS_CHANGE:
+            if msg["msg_type"] == self.MqttClientThread.MsgType.MQTT_CLIENT_STATUS_CHANGE:
                 # The mqtt client has connected to or disconnected from the broker
                 self.status = msg["data"]
                 self.notify_observers(self.event_name_status_change)
-            elif msg["msg_type"] == self.mqtt_cl_thread.MsgType.NEW_MQTT_MSG_RECEIVED:
+            elif msg["msg_type"] == self.MqttClientThread.MsgType.NEW_MQTT_MSG_RECEIVED:
                 # New Mqtt message received
-                self.forward_mqtt_msg(topic=msg["topic"], msg=msg["msg"])
+                self.forward_mqtt_msg(topic=msg["topic"], msg=msg["msg"], time_received=msg["time_received"],
+                                      payload_size=msg["payload_size"])
             else:
                 logger.error(f"Unknown message from mqtt thread {msg}")
 
+    def inject_received_msg(self, topic: str, payload: bytes):
+        """
+        Put a message in the received queue as if it came from the broker. Used for replaying recorded traffic, does
+        not need the client to be started. Handled on next loop() call.
+        :param topic: message topic
+        :param payload: raw message payload
+        """
+        self.queue_from_mqtt_thread.put({"msg_type": self.MqttClientThread.MsgType.NEW_MQTT_MSG_RECEIVED,
+                                         "topic": topic, "msg": str(payload), "time_received": time.perf_counter(),
+                                         "payload_size": len(payload)})
+
     def add_listen_topic(self, topic: str, callback: Callable[[str, str], None]):
         # Add a topic to listen to and the method that should be called when a message is published to that topic
         # Should be one for each MQTT device
         self.subscription_dict[topic] = callback
+        self.topic_index.add(topic, callback)
         # The client itself is only interested in the topic, the callback will be called from this class
         self.queue_to_mqtt_thread.put({"msg_type": self.MqttClientThread.MsgType.NEW_LISTEN_TOPIC,
                                        "data": topic})
 
-    def forward_mqtt_msg(self, topic: str, msg: str):
+    def forward_mqtt_msg(self, topic: str, msg: str, time_received: float = None, payload_size: int = None):
         """
         Check if the received MQTT message belongs to a topic being listened to by a device. If so, call the callback
         method
         :param topic: message topic
         :param msg: message payload
+        :param time_received: perf_counter time when the message was put in the received queue
+        :param payload_size: size of the raw payload in bytes, length of msg if None
         :return:
         """
-        for listen_topic, callback in self.subscription_dict.items():
-            listen_topic_beginning = self._get_listen_topic(listen_topic)
-            if topic.startswith(listen_topic_beginning):
-                callback(topic, msg)
+        queue_latency_s = time.perf_counter() - time_received if time_received is not None else 0.0
+        payload_size = len(msg) if payload_size is None else payload_size
+        # Commands this message is the reply to are no longer in flight
+        self.publish_coalescer.confirm(topic)
+        matches = self.topic_index.match(topic)
+        for listen_topic, callback in matches:
+            self.stats.record_received(listen_topic, payload_size, queue_latency_s)
+            if self.shard_pool:
+                # Listen topic used as shard key, one device is always handled by the same worker
+                self.shard_pool.submit(listen_topic, self._run_callback, listen_topic, callback, topic, msg)
+            else:
+                self._run_callback(listen_topic, callback, topic, msg)
+        if not matches:
+            # Count traffic nobody listens to by the first topic level
+            self.stats.record_received(f"unhandled:{topic.split('/')[0]}", payload_size, queue_latency_s)
+
+    def _run_callback(self, listen_topic: str, callback: Callable[[str, str], None], topic: str, msg: str):
+        # Call the device callback and record how long it took
+        time_start = time.perf_counter()
+        try:
+            callback(topic, msg)
+        finally:
+            self.stats.record_callback(listen_topic, time.perf_counter() - time_start)
+
+    def get_shard_metrics(self) -> list[dict]:
+        """
+        :return: queue and handling time metrics for each worker shard, empty list if workers not used
+        """
+        if not self.shard_pool:
+            return []
+        return self.shard_pool.get_metrics()
 
     def publish(self, topic: str, payload: str):
-        # Publish data to mqtt broker
-        self.queue_to_mqtt_thread.put({"msg_type": self.MqttClientThread.MsgType.PUBLISH_MSG,
-                                       "topic": topic, "msg": payload})
+        # Publish data to mqtt broker. Repeated publishes to the same topic are coalesced and rate limited.
+        self.publish_coalescer.add(topic, payload)
+
+    def get_in_flight_commands(self) -> dict:
+        """
+        :return: published messages the device has not replied to yet, see MqttPublishCoalescer.get_in_flight
+        """
+        return self.publish_coalescer.get_in_flight()
 
     def stop(self):
         # Stop mqtt client
@@ -153,19 +274,10 @@ class MyMqttClient(Subject):
         logger.debug("Join start")
         self.mqtt_cl_thread.join()
         logger.debug("Join end")
-
-    def _get_listen_topic(self, topic: str) -> str:
-        """
-        If a device topic was marked with a '#' at the end to listen to all subtopics, take that off so string
-        comparison can be executed
-        :param topic:
-        :return:
-        """
-        if topic.endswith("#"):
-            topic = topic[:-1]
-        else:
-            topic = topic
-        return topic
+        if self.shard_pool:
+            self.shard_pool.stop()
+        if self.recorder:
+            self.recorder.close()
 
     class MqttClientThread(threading.Thread):
         """
@@ -184,12 +296,14 @@ class MyMqttClient(Subject):
             MQTT_CLIENT_STATUS_CHANGE = auto()
             NEW_MQTT_MSG_RECEIVED = auto()
             STOP = auto()
-            PUBLISH_MSG = auto()
             NEW_LISTEN_TOPIC = auto()
 
         def __init__(self, broker_addr: str, port: int, user: str, psw: str, queue_to_mqtt_thread: Queue,
-                     queue_from_mqtt_thread: Queue):
+                     queue_from_mqtt_thread: Queue, publish_coalescer: MqttPublishCoalescer,
+                     recorder: MqttRecorder = None):
             super().__init__()
+            self.publish_coalescer = publish_coalescer
+            self.recorder = recorder
             self.mqtt_client = mqtt.Client()
             self.setup_mqtt_client(user, psw)
             self.queue_to_mqtt_thread = queue_to_mqtt_thread
@@ -204,6 +318,7 @@ class MyMqttClient(Subject):
 
         def setup_mqtt_client(self, user: str, psw: str):
             self.mqtt_client.on_connect = self.on_connect
+            self.mqtt_client.on_disconnect = self.on_disconnect
             self.mqtt_client.on_message = self.on_message
             self.mqtt_client.reconnect_delay_set(min_delay=10, max_delay=60)  # in seconds
             self.mqtt_client.username_pw_set(user, psw)
@@ -224,15 +339,20 @@ class MyMqttClient(Subject):
                     if data["msg_type"] == self.MsgType.NEW_LISTEN_TOPIC:
                         topic = data["data"]
                         self.subscription_list.append(topic)
-                    elif data["msg_type"] == self.MsgType.PUBLISH_MSG:
-                        topic = data["topic"]
-                        payload = data["msg"]
-                        self.publish(topic=topic, payload=payload)
                     elif data["msg_type"] == self.MsgType.STOP:
                         self.stop()
                         run = False
+                if run:
+                    self.publish_pending()
                 time.sleep(0.5)
 
+        def publish_pending(self):
+            # Publish waiting messages only when connected, while disconnected only the latest per topic is kept
+            if self.status != self.STATUS_CONNECTED:
+                return
+            for topic, payload in self.publish_coalescer.pop_ready():
+                self.publish(topic=topic, payload=payload)
+
         def start_mqtt_client(self):
             logger.info(f"Connecting to MQTT broker. {self.broker_addr}:{self.port}")
             # self.connect(host=self.broker_addr, port=self.port, keepalive=60, bind_address="")
@@ -269,9 +389,12 @@ class MyMqttClient(Subject):
         def on_message(self, client, userdata, msg):
             if self.DEBUG_LOG_EVERY_MSG:
                 logger.debug(f"Msg received {msg.topic} {str(msg.payload)}")
+            if self.recorder:
+                self.recorder.record(msg.topic, msg.payload)
             # Forward the message to the main mqtt class
             self.queue_from_mqtt_thread.put(
-                {"msg_type": self.MsgType.NEW_MQTT_MSG_RECEIVED, "topic": msg.topic, "msg": str(msg.payload)})
+                {"msg_type": self.MsgType.NEW_MQTT_MSG_RECEIVED, "topic": msg.topic, "msg": str(msg.payload),
+                 "time_received": time.perf_counter(), "payload_size": len(msg.payload)})
 
         def stop(self):
             logger.info(f"Stopping MQTT broker")
@@ -0,0 +1,347 @@
+"""
+asyncio implementation of the MQTT client with the same interface as MyMqttClient.
+The paho client is driven from the event loop through its socket callbacks, so no network thread, no
+MqttClientThread and no polling sleeps are needed. Received messages are dispatched to device callbacks from a
+coroutine, callbacks can be plain functions or coroutine functions.
+"""
+import paho.mqtt.client as mqtt
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Callable
+from helpers.observer_pattern import Subject
+from helpers.mqtt_client import MyMqttClient
+from helpers.mqtt_recorder import MqttRecorder
+from helpers.mqtt_stats import MqttStats
+from helpers.mqtt_topic_index import MqttTopicIndex
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "mqtt_client_async.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    asyncio.run(test_async())
+
+
+async def test_async():
+    client = AsyncMqttClient()
+    client.add_listen_topic("shellyplus1-441793ab3fb4/#", test_cb)
+    client.add_listen_topic("shellies/shellyplug-s-80646F840029/#", test_cb_async)
+    await client.start(settings.MQTT_SERVER, settings.MQTT_PORT, user="", psw="")
+    try:
+        for i in range(20):
+            await asyncio.sleep(0.5)
+            if i == 10:
+                print("Posting")
+                await client.publish_async("shellyplus1-441793ab3fb4/command", "status_update")
+    finally:
+        await client.stop()
+    print(client.get_stats_snapshot())
+
+
+def test_cb(topic: str, payload: str):
+    print(f"Callback {topic} {payload}")
+
+
+async def test_cb_async(topic: str, payload: str):
+    print(f"Async callback {topic} {payload}")
+
+
+class AsyncMqttClient(Subject):
+    """
+    Used to publish and subscribe to mqtt topics from an asyncio event loop.
+    All methods must be called from the thread running the event loop.
+    Publishes are queued in a bounded queue, publish_async waits while it is full. Reading from the socket is paused
+    while too many received messages wait for their callbacks.
+    """
+    # For the observer pattern
+    event_name_status_change = MyMqttClient.event_name_status_change
+
+    # Connection status constants, same values as MyMqttClient so both can be used by the UI
+    STATUS_DISCONNECTED = MyMqttClient.MqttClientThread.STATUS_DISCONNECTED
+    STATUS_CONNECTED = MyMqttClient.MqttClientThread.STATUS_CONNECTED
+    # Publishes waiting to be sent
+    PUBLISH_QUEUE_SIZE = 100
+    # Received messages waiting for dispatch. Reading is paused above the high and resumed below the low mark.
+    RECEIVE_QUEUE_HIGH_WATER = 1000
+    RECEIVE_QUEUE_LOW_WATER = 100
+    # paho housekeeping (keepalive pings, retries) interval
+    MISC_LOOP_INTERVAL_S = 1.0
+    # Delay between reconnection attempts
+    RECONNECT_DELAY_S = 10.0
+    KEEPALIVE_S = 60
+
+    def __init__(self):
+        Subject.__init__(self)
+        self.status = self.STATUS_DISCONNECTED
+        # A dictionary holding topics to listen to and corresponding callbacks when a message has been published to that
+        # topic
+        self.subscription_dict = {}
+        # Listen topics by prefix, received messages are dispatched without comparing with every listen topic
+        self.topic_index = MqttTopicIndex()
+        self.publish_queue = asyncio.Queue(maxsize=self.PUBLISH_QUEUE_SIZE)
+        self.receive_queue = asyncio.Queue()
+        self.stats = MqttStats()
+        self.recorder = None
+        self.broker_addr = ""
+        self.port = 0
+        self._loop = None
+        self._tasks = []
+        self._connected = asyncio.Event()
+        self._sock = None
+        self._reading_paused = False
+        # Set while paho connects on an executor thread, socket callbacks are handled after connect returns
+        self._connecting = False
+        self._stopping = False
+        self.mqtt_client = mqtt.Client()
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_disconnect = self.on_disconnect
+        self.mqtt_client.on_message = self.on_message
+        self.mqtt_client.on_socket_open = self.on_socket_open
+        self.mqtt_client.on_socket_close = self.on_socket_close
+        self.mqtt_client.on_socket_register_write = self.on_socket_register_write
+        self.mqtt_client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    async def start(self, broker_addr: str, port: int, user: str, psw: str, recorder: MqttRecorder = None):
+        """
+        Start connecting to the broker. Returns without waiting for the connection, failed attempts are retried.
+        :param recorder: if given, every received message is recorded to it. Closed when the client is stopped.
+        """
+        self._loop = asyncio.get_running_loop()
+        self.broker_addr = broker_addr
+        self.port = port
+        self.recorder = recorder
+        self.mqtt_client.username_pw_set(user, psw)
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._misc_loop(), name="mqtt_misc"),
+                       asyncio.create_task(self._publish_loop(), name="mqtt_publish"),
+                       asyncio.create_task(self._dispatch_loop(), name="mqtt_dispatch")]
+
+    def loop(self):
+        """
+        Everything is handled by the event loop. Kept so the client can replace MyMqttClient where loop() is called
+        periodically.
+        """
+        pass
+
+    def add_listen_topic(self, topic: str, callback: Callable):
+        """
+        Add a topic to listen to and the method that should be called when a message is published to that topic
+        Should be one for each MQTT device. If already connected the topic is subscribed to right away.
+        :param topic: topic, '#' at the end to listen to all subtopics
+        :param callback: function or coroutine function taking topic and payload
+        """
+        self.subscription_dict[topic] = callback
+        self.topic_index.add(topic, callback)
+        if self.status == self.STATUS_CONNECTED:
+            self.mqtt_client.subscribe(topic)
+            logger.debug(f"Subscribing to {topic}")
+
+    def publish(self, topic: str, payload: str) -> bool:
+        """
+        Queue a publish without waiting
+        :return: False if the publish queue is full and the message was dropped
+        """
+        try:
+            self.publish_queue.put_nowait((topic, payload))
+        except asyncio.QueueFull:
+            logger.warning(f"Publish queue full, dropping {topic} {payload}")
+            return False
+        return True
+
+    async def publish_async(self, topic: str, payload: str):
+        # Queue a publish, waits while the publish queue is full
+        await self.publish_queue.put((topic, payload))
+
+    def get_stats_snapshot(self) -> dict:
+        """
+        :return: message rates, queue depth and latency histograms per topic prefix, see MqttStats.snapshot
+        """
+        return self.stats.snapshot(queue_depth=self.receive_queue.qsize())
+
+    async def stop(self):
+        logger.info("Stopping MQTT client")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._sock is not None:
+            self.mqtt_client.disconnect()
+            # Send the disconnect packet and let paho close the socket
+            self.mqtt_client.loop_write()
+            self.mqtt_client.loop_read()
+        self._remove_socket_handlers()
+        if self.recorder:
+            self.recorder.close()
+        logger.info("Stopped MQTT client")
+
+    async def _connect(self):
+        logger.info(f"Connecting to MQTT broker. {self.broker_addr}:{self.port}")
+        self._remove_socket_handlers()
+        self._connecting = True
+        try:
+            # Name resolution and TCP connect are blocking
+            await self._loop.run_in_executor(None, self.mqtt_client.connect, self.broker_addr, self.port,
+                                             self.KEEPALIVE_S)
+        except (OSError, socket.timeout) as e:
+            logger.warning(f"Unable to connect to MQTT broker {e}")
+            return
+        finally:
+            self._connecting = False
+        # Socket callbacks during connect were ignored, register the new socket now
+        self._add_socket_handlers(self.mqtt_client.socket())
+
+    async def _misc_loop(self):
+        # Keepalive and reconnection
+        time_of_last_attempt = None
+        while True:
+            if self._sock is None:
+                if time_of_last_attempt is None or \
+                        time.perf_counter() - time_of_last_attempt >= self.RECONNECT_DELAY_S:
+                    time_of_last_attempt = time.perf_counter()
+                    await self._connect()
+            else:
+                self.mqtt_client.loop_misc()
+            await asyncio.sleep(self.MISC_LOOP_INTERVAL_S)
+
+    async def _publish_loop(self):
+        while True:
+            topic, payload = await self.publish_queue.get()
+            # Hold publishes while disconnected
+            await self._connected.wait()
+            self.mqtt_client.publish(topic, payload)
+
+    async def _dispatch_loop(self):
+        while True:
+            topic, msg, time_received, payload_size = await self.receive_queue.get()
+            await self.forward_mqtt_msg(topic, msg, time_received, payload_size)
+            if self._reading_paused and self.receive_queue.qsize() <= self.RECEIVE_QUEUE_LOW_WATER:
+                self._reading_paused = False
+                if self._sock is not None:
+                    self._loop.add_reader(self._sock, self._on_readable)
+
+    async def forward_mqtt_msg(self, topic: str, msg: str, time_received: float = None, payload_size: int = None):
+        """
+        Check if the received MQTT message belongs to a topic being listened to by a device. If so, call the callback
+        :param topic: message topic
+        :param msg: message payload
+        :param time_received: perf_counter time when the message was put in the received queue
+        :param payload_size: size of the raw payload in bytes, length of msg if None
+        """
+        queue_latency_s = time.perf_counter() - time_received if time_received is not None else 0.0
+        payload_size = len(msg) if payload_size is None else payload_size
+        # Matches are a new list, callbacks may add listen topics while awaited
+        matches = self.topic_index.match(topic)
+        for listen_topic, callback in matches:
+            self.stats.record_received(listen_topic, payload_size, queue_latency_s)
+            time_start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(callback):
+                    await callback(topic, msg)
+                else:
+                    callback(topic, msg)
+            except Exception as e:
+                # Do not let a faulty device callback stop the dispatch
+                logger.error(f"Error in MQTT callback for {listen_topic}: {e}")
+            finally:
+                self.stats.record_callback(listen_topic, time.perf_counter() - time_start)
+        if not matches:
+            # Count traffic nobody listens to by the first topic level
+            self.stats.record_received(f"unhandled:{topic.split('/')[0]}", payload_size, queue_latency_s)
+
+    def _on_readable(self):
+        self.mqtt_client.loop_read()
+        if self.receive_queue.qsize() >= self.RECEIVE_QUEUE_HIGH_WATER and not self._reading_paused:
+            # Back-pressure, callbacks are not keeping up. TCP flow control slows down the broker.
+            logger.warning(f"{self.receive_queue.qsize()} received messages waiting, pausing reading")
+            self._reading_paused = True
+            if self._sock is not None:
+                self._loop.remove_reader(self._sock)
+
+    def _on_writable(self):
+        self.mqtt_client.loop_write()
+
+    def _add_socket_handlers(self, sock):
+        if sock is None:
+            return
+        self._sock = sock
+        if not self._reading_paused:
+            self._loop.add_reader(sock, self._on_readable)
+        if self.mqtt_client.want_write():
+            self._loop.add_writer(sock, self._on_writable)
+
+    def _remove_socket_handlers(self):
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock)
+        self._loop.remove_writer(self._sock)
+        self._sock = None
+
+    def on_socket_open(self, client, userdata, sock):
+        if self._connecting:
+            return
+        self._add_socket_handlers(sock)
+
+    def on_socket_close(self, client, userdata, sock):
+        if self._connecting:
+            return
+        self._remove_socket_handlers()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        if self._connecting or self._sock is None:
+            return
+        self._loop.add_writer(sock, self._on_writable)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        if self._connecting or self._sock is None:
+            return
+        self._loop.remove_writer(sock)
+
+    def on_connect(self, client, userdata, flags, rc):
+        logger.info(f"On connect callback, code {rc}")
+        if rc == 0:
+            self.status = self.STATUS_CONNECTED
+            self._connected.set()
+            for topic in self.subscription_dict:
+                self.mqtt_client.subscribe(topic)
+                logger.debug(f"Subscribing to {topic}")
+            self.notify_observers(self.event_name_status_change)
+        else:
+            logger.warning(f"Unable to connect to MQTT broker")
+
+    def on_disconnect(self, client, userdata, rc):
+        logger.info(f"Disconnected from MQTT broker, code {rc}")
+        self.status = self.STATUS_DISCONNECTED
+        self._connected.clear()
+        self.notify_observers(self.event_name_status_change)
+
+    def on_message(self, client, userdata, msg):
+        if self.recorder:
+            self.recorder.record(msg.topic, msg.payload)
+        # Payload as string the same way as MyMqttClient so device callbacks work with both
+        self.receive_queue.put_nowait((msg.topic, str(msg.payload), time.perf_counter(), len(msg.payload)))
+
+    status_strings = {
+        STATUS_DISCONNECTED: "MQTT NOT CONNECTED",
+        STATUS_CONNECTED: "MQTT CONNECTED"
+    }
+
+
+if __name__ == '__main__':
+    test()
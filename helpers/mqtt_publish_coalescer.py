@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "mqtt_publish_coalescer.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    coalescer = MqttPublishCoalescer(min_publish_interval_s=1.0)
+    coalescer.add("shellyplus1-441793ab3fb4/command/switch:0", "on")
+    coalescer.add("shellyplus1-441793ab3fb4/command/switch:0", "off")
+    coalescer.add("shellyplus1-441793ab3fb4/command", "status_update")
+    print(coalescer.pop_ready())
+    # Same command again right away is dropped
+    coalescer.add("shellyplus1-441793ab3fb4/command/switch:0", "off")
+    print(coalescer.pop_ready())
+    print(coalescer.get_in_flight())
+    # Periodic reports do not confirm commands, the status of the commanded switch does
+    coalescer.confirm("shellyplus1-441793ab3fb4/status/input:0")
+    print(coalescer.get_in_flight())
+    coalescer.confirm("shellyplus1-441793ab3fb4/status/switch:0")
+    print(coalescer.get_in_flight())
+    print(coalescer.get_stats())
+
+
+class MqttPublishCoalescer:
+    """
+    Holds publishes waiting to be sent to the broker
+    Only the latest payload is kept for each topic, each topic is published at most once per
+    min_publish_interval_s, and a payload equal to one just sent is dropped.
+    Sent messages are tracked as in flight until the device reports on the state topic of the command or they time
+    out, see get_ack_topics.
+    Shared between MyMqttClient (adds) and MqttClientThread (sends).
+    """
+    # Each topic published at most this often
+    MIN_PUBLISH_INTERVAL_S = 1.0
+    # Sent commands without any reply from the device are forgotten after this time
+    IN_FLIGHT_TIMEOUT_S = 60.0
+
+    def __init__(self, min_publish_interval_s: float = MIN_PUBLISH_INTERVAL_S,
+                 in_flight_timeout_s: float = IN_FLIGHT_TIMEOUT_S):
+        """
+        :param min_publish_interval_s: minimum time between publishes to the same topic
+        :param in_flight_timeout_s: how long to track a sent message that got no reply
+        """
+        self.min_publish_interval_s = min_publish_interval_s
+        self.in_flight_timeout_s = in_flight_timeout_s
+        self._lock = threading.Lock()
+        # Topic: payload, dict keeps the order in which topics were first added
+        self._pending = {}
+        # Topic: {"payload", "time_sent", "send_count"}
+        self._in_flight = {}
+        # Topic: time of last publish
+        self._time_last_sent = {}
+        self._stats = {"added": 0, "coalesced": 0, "duplicates_dropped": 0, "sent": 0, "confirmed": 0,
+                       "timed_out": 0}
+
+    def add(self, topic: str, payload: str) -> None:
+        """
+        :param topic: topic to publish to
+        :param payload: payload, replaces any payload still waiting for the same topic
+        """
+        time_now = time.perf_counter()
+        with self._lock:
+            self._stats["added"] += 1
+            if topic in self._pending:
+                # Not yet sent, keep only the latest
+                self._stats["coalesced"] += 1
+                self._pending[topic] = payload
+                return
+            in_flight = self._in_flight.get(topic)
+            if in_flight and in_flight["payload"] == payload and \
+                    time_now - in_flight["time_sent"] < self.min_publish_interval_s:
+                # Exactly this was just sent
+                self._stats["duplicates_dropped"] += 1
+                return
+            self._pending[topic] = payload
+
+    def pop_ready(self) -> list[tuple[str, str]]:
+        """
+        Take the messages that are allowed to be published now and mark them in flight
+        Topics published too recently stay pending for the next call
+        :return: list of (topic, payload)
+        """
+        time_now = time.perf_counter()
+        ready = []
+        with self._lock:
+            self._remove_timed_out(time_now)
+            for topic, payload in list(self._pending.items()):
+                time_last_sent = self._time_last_sent.get(topic)
+                if time_last_sent is not None and time_now - time_last_sent < self.min_publish_interval_s:
+                    continue
+                del self._pending[topic]
+                ready.append((topic, payload))
+                self._time_last_sent[topic] = time_now
+                in_flight = self._in_flight.get(topic)
+                send_count = in_flight["send_count"] + 1 if in_flight and in_flight["payload"] == payload else 1
+                self._in_flight[topic] = {"payload": payload, "time_sent": time_now, "send_count": send_count,
+                                          "ack_topics": self.get_ack_topics(topic)}
+            self._stats["sent"] += len(ready)
+        return ready
+
+    @staticmethod
+    def get_ack_topics(command_topic: str) -> tuple[str, ...]:
+        """
+        Topics the device reports the result of a command on, topics ending with '/' match all topics under them
+        Gen1: shellies/<id>/relay/0/command is reported on shellies/<id>/relay/0
+        Gen2: <id>/command/switch:0 is reported on <id>/status/switch:0, status request <id>/command on <id>/status/...
+        :return: empty if not known, the command is in flight until it times out
+        """
+        if "/command/" in command_topic:
+            return (command_topic.replace("/command/", "/status/", 1),)
+        if command_topic.endswith("/command"):
+            base_topic = command_topic[:-len("/command")]
+            return base_topic, f"{base_topic}/status/"
+        return ()
+
+    def confirm(self, received_topic: str) -> None:
+        """
+        A message was received, commands it is the reply to are no longer in flight
+        :param received_topic: topic of the received message
+        """
+        with self._lock:
+            if not self._in_flight:
+                return
+            confirmed = [topic for topic, in_flight in self._in_flight.items()
+                         if any(received_topic == ack_topic or
+                                (ack_topic.endswith("/") and received_topic.startswith(ack_topic))
+                                for ack_topic in in_flight["ack_topics"])]
+            for topic in confirmed:
+                del self._in_flight[topic]
+            self._stats["confirmed"] += len(confirmed)
+
+    def get_in_flight(self) -> dict:
+        """
+        :return: dictionary of topic: {"payload", "age_s", "send_count"} for sent messages without reply
+        """
+        time_now = time.perf_counter()
+        with self._lock:
+            self._remove_timed_out(time_now)
+            return {topic: {"payload": in_flight["payload"],
+                            "age_s": time_now - in_flight["time_sent"],
+                            "send_count": in_flight["send_count"]}
+                    for topic, in_flight in self._in_flight.items()}
+
+    def get_pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _remove_timed_out(self, time_now: float) -> None:
+        # Must be called with lock held
+        timed_out = [topic for topic, in_flight in self._in_flight.items()
+                     if time_now - in_flight["time_sent"] > self.in_flight_timeout_s]
+        for topic in timed_out:
+            logger.warning(f"No reply to {topic} {self._in_flight[topic]['payload']}")
+            del self._in_flight[topic]
+        self._stats["timed_out"] += len(timed_out)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,178 @@
+"""
+Recording of received MQTT traffic and replaying it into MyMqttClient without a broker.
+Used to reproduce production load locally and to benchmark message dispatch, device parsing and logging.
+File format - a magic header followed by records:
+<timestamp float64><topic length uint16><payload length uint32><topic bytes><payload bytes>
+"""
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Tuple
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "mqtt_recorder.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    from helpers.mqtt_client import MyMqttClient
+    test_file = "test_recording.mqr"
+    recorder = MqttRecorder(test_file)
+    for i in range(1000):
+        recorder.record("shellies/shellyplug-s-80646F840029/relay/0/power", f"{i}.5".encode())
+    recorder.close()
+    client = MyMqttClient()
+    client.add_listen_topic("shellies/shellyplug-s-80646F840029/#", test_cb)
+    print(MqttReplayer(test_file).replay(client, speed=MqttReplayer.SPEED_MAX))
+    os.remove(test_file)
+
+
+def test_cb(topic: str, payload: str):
+    pass
+
+
+class MqttRecorder:
+    """
+    Appends received MQTT messages to a compact binary file
+    Thread safe, called from the paho network thread
+    Records are flushed to the file at least every FLUSH_INTERVAL_S while messages arrive, so a crash loses little.
+    """
+    FILE_MAGIC = b"MQTTREC1"
+    # timestamp, topic length, payload length
+    RECORD_HEADER = struct.Struct("<dHI")
+    # Flush the file buffer if this much time has passed since the last flush
+    FLUSH_INTERVAL_S = 1.0
+    # Or if this many records were written since the last flush
+    FLUSH_EVERY_N_RECORDS = 1000
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path: recording file, if it exists new records are appended to it
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        new_file = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+        self._file = open(file_path, "ab")
+        if new_file:
+            self._file.write(self.FILE_MAGIC)
+        self.records_written = 0
+        self._records_not_flushed = 0
+        self._time_of_last_flush = time.perf_counter()
+        logger.info(f"Recording MQTT traffic to {file_path}")
+
+    def record(self, topic: str, payload: bytes, timestamp: float = None) -> None:
+        """
+        :param topic: message topic
+        :param payload: raw message payload
+        :param timestamp: unix time of message, current time if not given
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        topic_bytes = topic.encode()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(self.RECORD_HEADER.pack(timestamp, len(topic_bytes), len(payload)))
+            self._file.write(topic_bytes)
+            self._file.write(payload)
+            self.records_written += 1
+            self._records_not_flushed += 1
+            time_now = time.perf_counter()
+            if self._records_not_flushed >= self.FLUSH_EVERY_N_RECORDS or \
+                    time_now - self._time_of_last_flush >= self.FLUSH_INTERVAL_S:
+                self._file.flush()
+                self._records_not_flushed = 0
+                self._time_of_last_flush = time_now
+
+    def close(self) -> None:
+        # Can be called more than once
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+                logger.info(f"Recording stopped, {self.records_written} messages written to {self.file_path}")
+
+
+class MqttReplayer:
+    """
+    Feeds recorded MQTT messages back into MyMqttClient, as if they were received from the broker
+    """
+    # Replay as fast as possible, ignoring the recorded timing
+    SPEED_MAX = 0
+    # At max speed dispatch the received queue after this many messages
+    LOOP_EVERY_N_MSGS = 100
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path: recording made by MqttRecorder
+        """
+        self.file_path = file_path
+
+    def read_records(self) -> Iterator[Tuple[float, str, bytes]]:
+        """
+        :return: generator of (timestamp, topic, payload) tuples
+        """
+        header_size = MqttRecorder.RECORD_HEADER.size
+        with open(self.file_path, "rb") as file:
+            if file.read(len(MqttRecorder.FILE_MAGIC)) != MqttRecorder.FILE_MAGIC:
+                raise ValueError(f"Not an MQTT recording: {self.file_path}")
+            while True:
+                header = file.read(header_size)
+                if len(header) < header_size:
+                    # End of file. Partially written last record is ignored.
+                    return
+                timestamp, topic_len, payload_len = MqttRecorder.RECORD_HEADER.unpack(header)
+                topic_bytes = file.read(topic_len)
+                payload = file.read(payload_len)
+                if len(topic_bytes) < topic_len or len(payload) < payload_len:
+                    logger.warning("Recording ends with an incomplete record")
+                    return
+                yield timestamp, topic_bytes.decode(), payload
+
+    def replay(self, client, speed: float = 1.0) -> dict:
+        """
+        Replay the recording into a client that does not need to be started
+        :param client: MyMqttClient with listen topics added
+        :param speed: 1.0 - real time, N - N times faster, SPEED_MAX - as fast as possible
+        :return: dictionary with replay statistics
+        """
+        logger.info(f"Replaying {self.file_path} at speed {speed if speed else 'max'}")
+        msg_count = 0
+        first_msg_ts = None
+        time_start = time.perf_counter()
+        for timestamp, topic, payload in self.read_records():
+            if speed:
+                if first_msg_ts is None:
+                    first_msg_ts = timestamp
+                # Wait until the message is due according to the recorded timing
+                time_due = time_start + (timestamp - first_msg_ts) / speed
+                time_to_wait = time_due - time.perf_counter()
+                if time_to_wait > 0:
+                    time.sleep(time_to_wait)
+            client.inject_received_msg(topic, payload)
+            msg_count += 1
+            if speed or msg_count % self.LOOP_EVERY_N_MSGS == 0:
+                client.loop()
+        client.loop()
+        time_taken = time.perf_counter() - time_start
+        result = {"messages": msg_count,
+                  "time_s": time_taken,
+                  "messages_per_s": msg_count / time_taken if time_taken > 0 else 0.0}
+        logger.info(f"Replay finished {result}")
+        return result
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from queue import Queue
+from typing import Callable
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "mqtt_shard_pool.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    pool = MqttShardPool(worker_count=3)
+    for i in range(30):
+        pool.submit(f"device_{i % 5}/#", test_cb, f"device_{i % 5}/status", f"msg {i}")
+    time.sleep(0.5)
+    for shard_metrics in pool.get_metrics():
+        print(shard_metrics)
+    pool.stop()
+
+
+def test_cb(topic: str, payload: str):
+    print(f"{threading.current_thread().name} {topic} {payload}")
+
+
+class MqttShardPool:
+    """
+    Pool of worker threads that execute MQTT message handlers.
+    Messages are sharded by a key (the listen topic of a device), so all messages of one device are handled in order
+    by the same worker, while messages of different devices are handled in parallel.
+    """
+    # Log a warning if this many messages are waiting in a single shard
+    QUEUE_DEPTH_WARNING = 100
+    # How long to wait for each worker to finish when stopping
+    STOP_TIMEOUT_S = 5.0
+
+    def __init__(self, worker_count: int = 4, name: str = "mqtt_shard"):
+        """
+        :param worker_count: number of worker threads, each one owns a shard
+        :param name: prefix for worker thread names
+        """
+        if worker_count < 1:
+            raise ValueError("Shard pool needs at least one worker")
+        self._shards = [self._Shard(shard_nr=i, name=f"{name}_{i}") for i in range(worker_count)]
+        for shard in self._shards:
+            shard.start()
+
+    def get_shard_nr(self, key: str) -> int:
+        """
+        crc32 used instead of hash() so the same device lands in the same shard on every run
+        :param key: shard key, listen topic of a device
+        :return: number of the shard the key belongs to
+        """
+        return zlib.crc32(key.encode()) % len(self._shards)
+
+    def submit(self, key: str, handler: Callable, *args) -> None:
+        """
+        Queue a handler call on the shard the key belongs to
+        :param key: shard key, messages with the same key are handled in order
+        :param handler: method to call
+        :param args: arguments for the handler
+        """
+        shard = self._shards[self.get_shard_nr(key)]
+        shard.put(handler, args)
+        depth = shard.queue.qsize()
+        if depth >= self.QUEUE_DEPTH_WARNING and depth % self.QUEUE_DEPTH_WARNING == 0:
+            logger.warning(f"Shard {shard.shard_nr} has {depth} messages waiting, last key {key}")
+
+    def get_metrics(self) -> list[dict]:
+        """
+        :return: list of dictionaries, one for each shard, holding queue and handling time metrics
+        """
+        return [shard.get_metrics() for shard in self._shards]
+
+    def stop(self) -> None:
+        logger.info("Stopping MQTT shard workers")
+        for shard in self._shards:
+            shard.put(None, ())
+        for shard in self._shards:
+            shard.join(timeout=self.STOP_TIMEOUT_S)
+        logger.info("MQTT shard workers stopped")
+
+    class _Shard(threading.Thread):
+        """
+        Single worker thread with its own queue and metrics
+        """
+
+        def __init__(self, shard_nr: int, name: str):
+            super().__init__(name=name, daemon=True)
+            self.shard_nr = shard_nr
+            self.queue = Queue()
+            self._metrics_lock = threading.Lock()
+            self._handled = 0
+            self._errors = 0
+            self._max_queue_depth = 0
+            self._total_wait_s = 0.0
+            self._max_wait_s = 0.0
+            self._total_handle_s = 0.0
+            self._max_handle_s = 0.0
+
+        def put(self, handler, args: tuple) -> None:
+            self.queue.put((handler, args, time.perf_counter()))
+            depth = self.queue.qsize()
+            with self._metrics_lock:
+                if depth > self._max_queue_depth:
+                    self._max_queue_depth = depth
+
+        def run(self) -> None:
+            while True:
+                handler, args, time_queued = self.queue.get()
+                if handler is None:
+                    # Stop request
+                    break
+                time_started = time.perf_counter()
+                error = False
+                try:
+                    handler(*args)
+                except Exception as e:
+                    # Do not let a faulty handler kill the worker
+                    error = True
+                    logger.error(f"Error in MQTT handler on shard {self.shard_nr}: {e}")
+                time_finished = time.perf_counter()
+                self._update_metrics(time_started - time_queued, time_finished - time_started, error)
+
+        def _update_metrics(self, wait_s: float, handle_s: float, error: bool) -> None:
+            with self._metrics_lock:
+                self._handled += 1
+                self._errors += 1 if error else 0
+                self._total_wait_s += wait_s
+                self._max_wait_s = max(self._max_wait_s, wait_s)
+                self._total_handle_s += handle_s
+                self._max_handle_s = max(self._max_handle_s, handle_s)
+
+        def get_metrics(self) -> dict:
+            with self._metrics_lock:
+                handled = self._handled
+                return {
+                    "shard": self.shard_nr,
+                    "queue_depth": self.queue.qsize(),
+                    "max_queue_depth": self._max_queue_depth,
+                    "handled": handled,
+                    "errors": self._errors,
+                    "avg_wait_s": self._total_wait_s / handled if handled else 0.0,
+                    "max_wait_s": self._max_wait_s,
+                    "avg_handle_s": self._total_handle_s / handled if handled else 0.0,
+                    "max_handle_s": self._max_handle_s,
+                }
+
+
+if __name__ == '__main__':
+    test()
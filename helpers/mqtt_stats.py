@@ -0,0 +1,156 @@
+import bisect
+import logging
+import os
+import threading
+import time
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "mqtt_stats.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    stats = MqttStats()
+    for i in range(100):
+        stats.record_received("shellies/shellyplug-s-80646F840029/#", 12, 0.002)
+        stats.record_callback("shellies/shellyplug-s-80646F840029/#", 0.0003)
+    stats.record_received("shellypro3em-34987a446e54/#", 300, 0.01)
+    stats.record_callback("shellypro3em-34987a446e54/#", 0.02)
+    time.sleep(0.1)
+    first_snapshot = stats.snapshot(queue_depth=3)
+    print(first_snapshot)
+    stats.record_received("shellypro3em-34987a446e54/#", 300, 0.01)
+    time.sleep(0.1)
+    # Rate of the last 0.1 s, the snapshot before does not change the summary logged
+    print(stats.snapshot(previous=first_snapshot)["prefixes"]["shellypro3em-34987a446e54/#"]["messages_per_s"])
+    stats.log_summary(queue_depth=3)
+
+
+class MqttStats:
+    """
+    Per topic prefix counters and latency histograms for received MQTT messages
+    Prefix is the listen topic of the device the message belongs to.
+    Thread safe, callbacks can be timed from shard worker threads.
+    """
+    # Upper bounds of histogram buckets in seconds, last bucket holds everything slower
+    HISTOGRAM_BOUNDS_S = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+    # How many prefixes to show in the log summary, busiest first
+    LOG_SUMMARY_TOP_N = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prefix_stats = {}
+        self._queue_latency_hist = self._new_histogram()
+        self._callback_time_hist = self._new_histogram()
+        self._max_queue_latency_s = 0.0
+        self._time_start = time.perf_counter()
+        # Rates in the log summary are calculated for the interval since the previous summary
+        self._last_summary_snapshot = None
+
+    def _new_histogram(self) -> list[int]:
+        return [0] * (len(self.HISTOGRAM_BOUNDS_S) + 1)
+
+    def _get_prefix_stats(self, prefix: str) -> dict:
+        prefix_stats = self._prefix_stats.get(prefix)
+        if prefix_stats is None:
+            prefix_stats = {"messages": 0, "bytes": 0, "callbacks": 0, "callback_time_s": 0.0, "max_callback_time_s": 0.0,
+                            "callback_time_hist": self._new_histogram()}
+            self._prefix_stats[prefix] = prefix_stats
+        return prefix_stats
+
+    def record_received(self, prefix: str, nr_of_bytes: int, queue_latency_s: float) -> None:
+        """
+        :param prefix: topic prefix the message belongs to
+        :param nr_of_bytes: payload size
+        :param queue_latency_s: time from putting the message in the queue to dispatching it
+        """
+        bucket = bisect.bisect_left(self.HISTOGRAM_BOUNDS_S, queue_latency_s)
+        with self._lock:
+            prefix_stats = self._get_prefix_stats(prefix)
+            prefix_stats["messages"] += 1
+            prefix_stats["bytes"] += nr_of_bytes
+            self._queue_latency_hist[bucket] += 1
+            if queue_latency_s > self._max_queue_latency_s:
+                self._max_queue_latency_s = queue_latency_s
+
+    def record_callback(self, prefix: str, callback_time_s: float) -> None:
+        """
+        :param prefix: topic prefix the message belongs to
+        :param callback_time_s: execution time of the device callback
+        """
+        bucket = bisect.bisect_left(self.HISTOGRAM_BOUNDS_S, callback_time_s)
+        with self._lock:
+            prefix_stats = self._get_prefix_stats(prefix)
+            prefix_stats["callbacks"] += 1
+            prefix_stats["callback_time_s"] += callback_time_s
+            prefix_stats["callback_time_hist"][bucket] += 1
+            if callback_time_s > prefix_stats["max_callback_time_s"]:
+                prefix_stats["max_callback_time_s"] = callback_time_s
+            self._callback_time_hist[bucket] += 1
+
+    def snapshot(self, queue_depth: int = 0, previous: dict = None) -> dict:
+        """
+        Does not change the statistics, any number of callers can take snapshots
+        :param queue_depth: current number of messages waiting in the received queue
+        :param previous: earlier snapshot of the caller, rates are calculated for the time since it. Since start if None
+        :return: dictionary holding totals, histograms and statistics of each prefix
+        """
+        time_now = time.perf_counter()
+        uptime_s = time_now - self._time_start
+        previous_uptime_s = previous["uptime_s"] if previous else 0.0
+        previous_prefixes = previous["prefixes"] if previous else {}
+        interval_s = max(uptime_s - previous_uptime_s, 1e-9)
+        with self._lock:
+            prefixes = {}
+            for prefix, prefix_stats in self._prefix_stats.items():
+                callbacks = prefix_stats["callbacks"]
+                previous_prefix = previous_prefixes.get(prefix, {"messages": 0, "bytes": 0})
+                prefixes[prefix] = {
+                    "messages": prefix_stats["messages"],
+                    "bytes": prefix_stats["bytes"],
+                    "messages_per_s": (prefix_stats["messages"] - previous_prefix["messages"]) / interval_s,
+                    "bytes_per_s": (prefix_stats["bytes"] - previous_prefix["bytes"]) / interval_s,
+                    "avg_callback_time_s": prefix_stats["callback_time_s"] / callbacks if callbacks else 0.0,
+                    "max_callback_time_s": prefix_stats["max_callback_time_s"],
+                    "callback_time_hist": list(prefix_stats["callback_time_hist"]),
+                }
+            return {
+                "uptime_s": uptime_s,
+                "interval_s": interval_s,
+                "queue_depth": queue_depth,
+                "max_queue_latency_s": self._max_queue_latency_s,
+                "histogram_bounds_s": self.HISTOGRAM_BOUNDS_S,
+                "queue_latency_hist": list(self._queue_latency_hist),
+                "callback_time_hist": list(self._callback_time_hist),
+                "prefixes": prefixes,
+            }
+
+    def log_summary(self, queue_depth: int = 0) -> None:
+        """
+        Log a single line with the busiest prefixes, rates since the previous summary
+        :param queue_depth: current number of messages waiting in the received queue
+        """
+        snapshot = self.snapshot(queue_depth, previous=self._last_summary_snapshot)
+        self._last_summary_snapshot = snapshot
+        busiest = sorted(snapshot["prefixes"].items(), key=lambda item: item[1]["messages_per_s"], reverse=True)
+        prefix_strings = [f"{prefix} {s['messages_per_s']:.1f}msg/s {s['bytes_per_s']:.0f}B/s "
+                          f"cb avg {s['avg_callback_time_s'] * 1000:.2f}ms max {s['max_callback_time_s'] * 1000:.2f}ms"
+                          for prefix, s in busiest[:self.LOG_SUMMARY_TOP_N]]
+        logger.info(f"MQTT stats: queue depth {queue_depth}, "
+                    f"max queue latency {snapshot['max_queue_latency_s'] * 1000:.1f}ms | " + " | ".join(prefix_strings))
+
+
+if __name__ == '__main__':
+    test()
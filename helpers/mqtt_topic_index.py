@@ -0,0 +1,78 @@
+"""
+Index of MQTT listen topics for dispatching received messages
+Listen topics are kept in a dictionary by their prefix. A received topic is matched by looking up each of its leading
+parts, so the cost depends on the depth of the topic and not on the number of devices listening.
+"""
+from typing import Callable, List, Tuple
+
+
+def test():
+    index = MqttTopicIndex()
+    index.add("shellies/shellyplug-s-80646F840029/#", print)
+    index.add("shellyplus1-441793ab3fb4/#", print)
+    index.add("exact/topic", print)
+    print(index.match("shellies/shellyplug-s-80646F840029/relay/0/power"))
+    print(index.match("shellyplus1-441793ab3fb4/status/switch:0"))
+    print(index.match("exact/topic"))
+    print(index.match("unknown/topic"))
+    index.remove("shellyplus1-441793ab3fb4/#")
+    print(index.match("shellyplus1-441793ab3fb4/status/switch:0"))
+
+
+class MqttTopicIndex:
+    """
+    A listen topic matches every topic starting with it, without the '#' at the end
+    Not thread safe, add and remove from the thread that matches or before messages are received.
+    """
+
+    def __init__(self):
+        # Prefix ending at a topic level: {listen topic: callback}
+        self._by_prefix = {}
+        # Listen topics whose prefix does not end with '/', compared with every received topic. Empty for devices.
+        self._other = {}
+
+    def add(self, listen_topic: str, callback: Callable) -> None:
+        """
+        :param listen_topic: topic, '#' at the end to listen to all subtopics. Replaces the callback if already added.
+        :param callback: called for received topics matching the listen topic
+        """
+        prefix = self.get_prefix(listen_topic)
+        if prefix.endswith("/"):
+            self._by_prefix.setdefault(prefix, {})[listen_topic] = callback
+        else:
+            self._other[listen_topic] = callback
+
+    def remove(self, listen_topic: str) -> None:
+        prefix = self.get_prefix(listen_topic)
+        listen_topics = self._by_prefix.get(prefix)
+        if listen_topics is not None:
+            listen_topics.pop(listen_topic, None)
+            if not listen_topics:
+                del self._by_prefix[prefix]
+        self._other.pop(listen_topic, None)
+
+    def match(self, topic: str) -> List[Tuple[str, Callable]]:
+        """
+        :param topic: topic of a received message
+        :return: (listen topic, callback) of all listen topics the message belongs to
+        """
+        matches = []
+        end = topic.find("/")
+        while end != -1:
+            listen_topics = self._by_prefix.get(topic[:end + 1])
+            if listen_topics:
+                matches.extend(listen_topics.items())
+            end = topic.find("/", end + 1)
+        if self._other:
+            matches.extend((listen_topic, callback) for listen_topic, callback in self._other.items()
+                           if topic.startswith(self.get_prefix(listen_topic)))
+        return matches
+
+    @staticmethod
+    def get_prefix(listen_topic: str) -> str:
+        # Take off the '#' at the end of the listen topic so string comparison can be executed
+        return listen_topic[:-1] if listen_topic.endswith("#") else listen_topic
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,194 @@
+"""
+Fixed size history of timestamped readings
+Values and timestamps are kept in preallocated arrays of floats, the oldest reading is overwritten when full, so memory
+use does not grow with uptime. Statistics work on array slices and builtins instead of per reading Python objects.
+"""
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "ring_buffer.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    buffer = RingBuffer(capacity=10)
+    time_start = 1738256400.0
+    for i in range(14):
+        # 100 W for the first 15 min, then 400 W
+        buffer.append(time_start + i * 120, 100.0 if i * 120 < 900 else 400.0)
+    print(len(buffer), buffer.snapshot())
+    print(buffer.mean(), buffer.max(), buffer.min())
+    print(buffer.mean(window_s=300, now=time_start + 13 * 120))
+    print(list(buffer.rolling_mean(3)))
+    print(buffer.demand_averages(interval_s=900, now=time_start + 14 * 120))
+
+
+class RingBuffer:
+    """
+    Thread safe, readings are appended from the MQTT thread and read from UI and analytics
+    Timestamps are unix time and expected to be non-decreasing. Statistics skip NaN values.
+    """
+    # 24 hours at one reading every 5 s
+    CAPACITY = 17280
+    # Demand is averaged over 15 minute intervals
+    DEMAND_INTERVAL_S = 900
+    # A reading counts for demand until the next one, but at most this long, so gaps are not filled
+    MAX_HOLD_S = 60
+
+    def __init__(self, capacity: int = CAPACITY):
+        """
+        :param capacity: number of readings kept
+        """
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._values = array("d", [math.nan]) * capacity
+        self._timestamps = array("d", [0.0]) * capacity
+        # Index the next reading is written to
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, timestamp: float, value: float) -> None:
+        with self._lock:
+            self._values[self._next] = value
+            self._timestamps[self._next] = timestamp
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def get_readings(self, window_s: float = None, now: float = None) -> tuple[array, array]:
+        """
+        :param window_s: only readings from the last window_s seconds, all if None
+        :param now: end of the window, current time if not given
+        :return: copies of timestamps and values, oldest first
+        """
+        with self._lock:
+            if self._count < self.capacity:
+                timestamps = self._timestamps[:self._count]
+                values = self._values[:self._count]
+            else:
+                # Buffer full, oldest reading is at the write index
+                timestamps = self._timestamps[self._next:] + self._timestamps[:self._next]
+                values = self._values[self._next:] + self._values[:self._next]
+        if window_s is not None:
+            time_from = (time.time() if now is None else now) - window_s
+            first = bisect_left(timestamps, time_from)
+            timestamps, values = timestamps[first:], values[first:]
+        return timestamps, values
+
+    def get_latest(self) -> tuple[float, float] | None:
+        """
+        :return: timestamp and value of the newest reading, None if empty
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            return self._timestamps[self._next - 1], self._values[self._next - 1]
+
+    def mean(self, window_s: float = None, now: float = None) -> float:
+        """
+        :return: mean of readings in the window, NaN if there are none
+        """
+        values = self._valid(self.get_readings(window_s, now)[1])
+        return math.fsum(values) / len(values) if values else math.nan
+
+    def max(self, window_s: float = None, now: float = None) -> float:
+        values = self._valid(self.get_readings(window_s, now)[1])
+        return max(values) if values else math.nan
+
+    def min(self, window_s: float = None, now: float = None) -> float:
+        values = self._valid(self.get_readings(window_s, now)[1])
+        return min(values) if values else math.nan
+
+    def rolling_mean(self, window_size: int, window_s: float = None, now: float = None) -> array:
+        """
+        Mean of each window_size consecutive readings, calculated from a running sum in one pass
+        :param window_size: number of readings averaged
+        :return: one value per reading starting from reading number window_size, oldest first
+        """
+        values = self._valid(self.get_readings(window_s, now)[1])
+        if window_size < 1 or len(values) < window_size:
+            return array("d")
+        sums = array("d", itertools.accumulate(values, initial=0.0))
+        return array("d", map(lambda end, start: (end - start) / window_size,
+                              sums[window_size:], sums[:-window_size]))
+
+    def demand_averages(self, interval_s: float = DEMAND_INTERVAL_S, window_s: float = None,
+                        now: float = None, max_hold_s: float = MAX_HOLD_S) -> list[tuple[float, float]]:
+        """
+        Time weighted average for each interval aligned to the clock, like the demand measured by a utility meter
+        Each reading is held until the next one or now, for at most max_hold_s.
+        :param interval_s: length of the averaging interval
+        :param max_hold_s: longest time a single reading is counted for
+        :return: list of (interval start unix time, average), oldest first, intervals without readings left out
+        """
+        now = time.time() if now is None else now
+        timestamps, values = self.get_readings(window_s, now)
+        averages = []
+        interval_start = None
+        weighted_sum = 0.0
+        weight = 0.0
+        # Each reading with the time of the reading after it
+        end_times = itertools.chain(itertools.islice(timestamps, 1, None), (max(now, timestamps[-1]),)) \
+            if timestamps else ()
+        for time_start, time_end, value in zip(timestamps, end_times, values):
+            if value != value:
+                # NaN, no reading
+                continue
+            time_end = min(time_end, time_start + max_hold_s)
+            while time_start < time_end:
+                start = time_start - time_start % interval_s
+                if interval_start is not None and start != interval_start and weight:
+                    averages.append((interval_start, weighted_sum / weight))
+                    weighted_sum = 0.0
+                    weight = 0.0
+                interval_start = start
+                # Part of the reading within this interval
+                part_end = min(time_end, start + interval_s)
+                weighted_sum += value * (part_end - time_start)
+                weight += part_end - time_start
+                time_start = part_end
+        if weight:
+            averages.append((interval_start, weighted_sum / weight))
+        return averages
+
+    def snapshot(self, window_s: float = None, now: float = None) -> dict:
+        """
+        :return: {"timestamps": list, "values": list}, oldest first
+        """
+        timestamps, values = self.get_readings(window_s, now)
+        return {"timestamps": timestamps.tolist(), "values": values.tolist()}
+
+    @staticmethod
+    def _valid(values: array) -> array:
+        # NaN is the only value not equal to itself
+        return array("d", filter(lambda value: value == value, values))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,294 @@
+"""
+Shelly Gen2 JSON-RPC over HTTP
+Used to read the status of all Gen2 devices at once on startup and to monitor and control them while MQTT is not
+available. Calls run on the shared HttpClientPool, results are applied to the devices on the thread calling loop().
+RPC request: POST http://<ip>/rpc {"id":1,"method":"Shelly.GetStatus"}
+RPC reply: {"id":1,"src":"shellyplus1-441793ab3fb4","result":{...}} or {"id":1,"error":{"code":-103,"message":"..."}}
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from helpers.http_client_pool import HttpClientPool
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "shelly_rpc_client.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    from devices.shellyPlus import ShellyPlus
+    from devices.shellyPlusPM import ShellyPlusPM
+    server = FakeShellyServer()
+    server.start()
+    devices = [ShellyPlus(plug_id="shellyplus1-441793ab3fb4", mqtt_publish=fake_mqtt_publish, name="Plus",
+                          ip=server.address),
+               ShellyPlusPM(plug_id="shellyplus1pm-d48afc417d58", mqtt_publish=fake_mqtt_publish, name="Plus PM",
+                            ip=server.address),
+               ShellyPlus(plug_id="shellyplus1-000000000000", mqtt_publish=fake_mqtt_publish, name="Offline",
+                          ip="127.0.0.1:1")]
+    poller = ShellyRpcFleetPoller(devices, max_jitter_s=0.2)
+    poller.poll_all()
+    poller.wait_idle()
+    poller.loop()
+    for device in devices:
+        print(device)
+    # Control over RPC
+    devices[1].rpc_fallback = poller
+    devices[1].set_mode(True)
+    devices[1].set_manual_run(True)
+    poller.wait_idle()
+    poller.loop()
+    print(devices[1])
+    server.stop()
+
+
+def fake_mqtt_publish(topic: str, payload: str):
+    pass
+
+
+class ShellyRpcError(Exception):
+    """
+    Device replied with an RPC error
+    """
+    pass
+
+
+class ShellyRpcClient:
+    """
+    Blocking Shelly Gen2 RPC calls, call from a function running on the HTTP pool
+    """
+    TIMEOUT_S = 2.0
+
+    def __init__(self, http_pool: HttpClientPool = None):
+        """
+        :param http_pool: pool to make calls with, shared pool if not given
+        """
+        self.http_pool = http_pool if http_pool else HttpClientPool.get_shared()
+        self._request_ids = itertools.count(1)
+
+    def call(self, ip: str, method: str, params: dict = None):
+        """
+        :param ip: address of the device, optionally with port
+        :param method: RPC method name
+        :param params: RPC parameters
+        :raises ShellyRpcError: if the device replied with an error
+        :raises requests.RequestException: on connection errors and timeouts
+        :return: result of the call
+        """
+        request = {"id": next(self._request_ids), "method": method}
+        if params:
+            request["params"] = params
+        reply = self.http_pool.post_json(f"http://{ip}/rpc", request, timeout=self.TIMEOUT_S)
+        if "error" in reply:
+            raise ShellyRpcError(f"{method} failed on {ip}: {reply['error']}")
+        return reply["result"]
+
+    def get_status(self, ip: str) -> dict:
+        """
+        :return: status of all device components, same content as the MQTT status_update reply
+        """
+        return self.call(ip, "Shelly.GetStatus")
+
+    def set_switch(self, ip: str, on: bool, switch_id: int = 0) -> dict:
+        """
+        :return: {"was_on": bool}
+        """
+        return self.call(ip, "Switch.Set", {"id": switch_id, "on": on})
+
+
+class ShellyRpcFleetPoller:
+    """
+    Polls the status of many Gen2 devices concurrently
+    Devices need an ip attribute and process_rpc_status(status: dict) method. Start of the calls is staggered with
+    random jitter so a fleet refresh does not hit the network all at the same moment. Calls wait for their start
+    time on one scheduler thread and are submitted to the HTTP pool only when due, pool threads are not kept waiting.
+    """
+    # Maximum random delay before each call
+    MAX_JITTER_S = 1.0
+
+    def __init__(self, devices: list, rpc_client: ShellyRpcClient = None, max_jitter_s: float = MAX_JITTER_S):
+        """
+        :param devices: devices to poll, devices without an ip are skipped
+        :param rpc_client: client to use, new one on the shared HTTP pool if not given
+        :param max_jitter_s: maximum random delay before each call
+        """
+        self.devices = [device for device in devices if device.ip]
+        self.rpc_client = rpc_client if rpc_client else ShellyRpcClient()
+        self.max_jitter_s = max_jitter_s
+        # Results from pool threads to the thread calling loop()
+        self.result_queue = queue.Queue()
+        self._futures = []
+        self.time_of_last_poll = 0
+        # Heap of (start time, sequence number, device) waiting to be submitted, guarded by the condition
+        self._condition = threading.Condition()
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self._scheduler_thread = None
+        self._stopped = False
+
+    def poll_all(self):
+        """
+        Start a status call for every device. Results are applied on the next loop() calls.
+        """
+        time_now = time.perf_counter()
+        with self._condition:
+            self._futures = [future for future in self._futures if not future.done()]
+            for device in self.devices:
+                heapq.heappush(self._scheduled, (time_now + random.uniform(0, self.max_jitter_s),
+                                                 next(self._sequence), device))
+            if self._scheduler_thread is None:
+                self._scheduler_thread = threading.Thread(target=self._run_scheduler, name="rpc_poll_scheduler",
+                                                          daemon=True)
+                self._scheduler_thread.start()
+            self._condition.notify_all()
+        self.time_of_last_poll = time_now
+
+    def set_switch(self, device, on: bool):
+        """
+        Switch the output of a device, then read its status
+        """
+        with self._condition:
+            self._futures.append(self.rpc_client.http_pool.submit(self._set_switch, device, on))
+
+    def loop(self):
+        """
+        Call periodically, applies received results to the devices
+        """
+        while not self.result_queue.empty():
+            device, status = self.result_queue.get()
+            device.process_rpc_status(status)
+
+    def wait_idle(self):
+        # Wait for all scheduled calls to be started and all started calls to finish
+        with self._condition:
+            while self._scheduled:
+                self._condition.wait()
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def stop(self):
+        # Drop calls not started yet and end the scheduler thread
+        with self._condition:
+            self._stopped = True
+            self._scheduled.clear()
+            self._condition.notify_all()
+        if self._scheduler_thread:
+            self._scheduler_thread.join()
+
+    def _run_scheduler(self):
+        # Submit each call to the HTTP pool when its start time has come
+        with self._condition:
+            while not self._stopped:
+                if not self._scheduled:
+                    self._condition.wait()
+                    continue
+                delay_s = self._scheduled[0][0] - time.perf_counter()
+                if delay_s > 0:
+                    self._condition.wait(delay_s)
+                    continue
+                _, _, device = heapq.heappop(self._scheduled)
+                try:
+                    self._futures.append(self.rpc_client.http_pool.submit(self._poll_device, device))
+                except RuntimeError as e:
+                    # Pool already shut down
+                    logger.warning(f"Status RPC for {device.name} not started: {e}")
+                # wait_idle waits for the schedule to empty
+                self._condition.notify_all()
+
+    def _poll_device(self, device):
+        try:
+            self.result_queue.put((device, self.rpc_client.get_status(device.ip)))
+        except (requests.RequestException, ValueError, ShellyRpcError) as e:
+            logger.warning(f"Status RPC failed for {device.name} {device.ip}: {e}")
+
+    def _set_switch(self, device, on: bool):
+        try:
+            self.rpc_client.set_switch(device.ip, on)
+            self.result_queue.put((device, self.rpc_client.get_status(device.ip)))
+        except (requests.RequestException, ValueError, ShellyRpcError) as e:
+            logger.warning(f"Switch RPC failed for {device.name} {device.ip}: {e}")
+
+
+class FakeShellyServer:
+    """
+    Local HTTP server answering Shelly Gen2 RPC calls like a ShellyPlus1PM, for tests
+    """
+
+    def __init__(self, port: int = 0):
+        """
+        :param port: port to listen on, 0 - any free port
+        """
+        self.switch_on = False
+        self.calls = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                reply = fake.handle_rpc(request)
+                body = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.address = f"127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle_rpc(self, request: dict) -> dict:
+        self.calls += 1
+        method = request.get("method")
+        if method == "Shelly.GetStatus":
+            result = {"input:0": {"id": 0, "state": False},
+                      "switch:0": {"id": 0, "source": "http", "output": self.switch_on,
+                                   "apower": 100.0 if self.switch_on else 0.0, "voltage": 233.6,
+                                   "current": 0.43 if self.switch_on else 0.0,
+                                   "aenergy": {"total": 1234.5, "by_minute": [0.0, 0.0, 0.0],
+                                               "minute_ts": 1710094020},
+                                   "temperature": {"tC": 47.6, "tF": 117.6}},
+                      "sys": {"mac": "D48AFC417D58", "uptime": 2401}}
+            return {"id": request.get("id"), "src": "shellyplus1pm-d48afc417d58", "result": result}
+        if method == "Switch.Set":
+            was_on = self.switch_on
+            self.switch_on = request["params"]["on"]
+            return {"id": request.get("id"), "src": "shellyplus1pm-d48afc417d58", "result": {"was_on": was_on}}
+        return {"id": request.get("id"), "error": {"code": -114, "message": f"Method {method} not found"}}
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,236 @@
+"""
+Background writing of saved state
+Objects saving their state mark it dirty with a snapshot of the state. Snapshots of the same object are coalesced and
+written by a background thread after a short debounce, each object at most once per interval. States due at the same
+time are passed to the write method as one batch, so a store can save them in one transaction. A batch that fails to
+be written is queued again. By default states are files, written to a temporary file first and then renamed over the old
+one, so a crash never leaves a half written file.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Hashable
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "state_persistence.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    import tempfile
+    base_path = tempfile.mkdtemp()
+    file_path = os.path.join(base_path, "test.st")
+    persistence = StatePersistence(debounce_s=0.2, min_write_interval_s=0.5)
+    persistence.start()
+    for hour in range(96):
+        # Full day schedule edit, one save per period
+        persistence.mark_dirty(file_path, {"period": hour})
+    print(persistence.get_pending(file_path))
+    time.sleep(0.4)
+    persistence.mark_dirty(file_path, {"period": "after first write"})
+    persistence.stop()
+    with open(file_path) as file:
+        print(file.read())
+    print(persistence.get_stats())
+
+
+class StatePersistence:
+    """
+    Thread safe, state is saved from UI, schedule and device threads
+    Snapshots are serialised when marked dirty, so later changes to the saved objects do not affect what is written.
+    """
+    # Time from the first change to writing, more changes in this time are written together
+    DEBOUNCE_S = 2.0
+    # Each file is written at most this often
+    MIN_WRITE_INTERVAL_S = 5.0
+    TEMP_FILE_EXTENSION = ".tmp"
+
+    def __init__(self, write_method: Callable[[list[tuple[Hashable, str]]], bool] = None,
+                 debounce_s: float = DEBOUNCE_S, min_write_interval_s: float = MIN_WRITE_INTERVAL_S):
+        """
+        :param write_method: writes a batch of (key, state json), returns True if written. Keys are file paths if None
+        :param debounce_s: time from the first change to writing
+        :param min_write_interval_s: minimum time between writes of the same object
+        """
+        self.write_method = write_files_atomic if write_method is None else write_method
+        self.debounce_s = debounce_s
+        self.min_write_interval_s = min_write_interval_s
+        self._condition = threading.Condition()
+        # Key: {"text", "due"}, dict keeps the order objects were marked dirty
+        self._pending = {}
+        # Key: state json being written, still returned by get_pending until written
+        self._in_flight = {}
+        # Key: perf_counter time of last write
+        self._time_last_written = {}
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name="state_persistence", daemon=True)
+        self._stats = {"marked": 0, "coalesced": 0, "written": 0, "failed": 0}
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Write all pending state and stop the thread
+        """
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+        with self._condition:
+            not_written = list(self._pending)
+        if not_written:
+            logger.error(f"State not written for {not_written}")
+
+    def mark_dirty(self, key: Hashable, data: dict) -> None:
+        """
+        :param key: identifies the saved object, file path by default
+        :param data: state to save, serialised immediately
+        """
+        self.mark_dirty_batch({key: data})
+
+    def mark_dirty_batch(self, states: dict) -> None:
+        """
+        Mark states of several objects with the same due time, so they are written in the same batch
+        :param states: key: state to save, serialised immediately
+        """
+        texts = {key: json.dumps(data) for key, data in states.items()}
+        time_now = time.perf_counter()
+        with self._condition:
+            self._stats["marked"] += len(texts)
+            due = time_now + self.debounce_s
+            for key in texts:
+                pending = self._pending.get(key)
+                if pending:
+                    # Already waiting to be written, only the latest state is kept
+                    due = max(due, pending["due"])
+                    self._stats["coalesced"] += 1
+                else:
+                    due = max(due, self._time_last_written.get(key, -self.min_write_interval_s) +
+                              self.min_write_interval_s)
+            for key, text in texts.items():
+                self._pending[key] = {"text": text, "due": due}
+            self._condition.notify()
+
+    def get_pending(self, key: Hashable) -> dict | None:
+        """
+        :return: state waiting to be written or being written, None if nothing pending
+        """
+        with self._condition:
+            pending = self._pending.get(key)
+            text = pending["text"] if pending else self._in_flight.get(key)
+            return json.loads(text) if text is not None else None
+
+    def flush(self) -> None:
+        """
+        Write all pending state now, on the calling thread
+        """
+        with self._condition:
+            to_write = self._take_pending(float("inf"))
+        if to_write:
+            self._write(to_write)
+
+    def get_stats(self) -> dict:
+        with self._condition:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if self._stop:
+                    return
+                time_now = time.perf_counter()
+                to_write = self._take_pending(time_now)
+                if not to_write:
+                    # Sleep until the next file is due or a new one is marked
+                    next_due = min((pending["due"] for pending in self._pending.values()), default=None)
+                    self._condition.wait(None if next_due is None else next_due - time_now)
+                    continue
+            # Write without holding the lock, so saving does not wait for the disk
+            self._write(to_write)
+
+    def _take_pending(self, time_now: float) -> list[tuple[Hashable, str]]:
+        """
+        Call holding the lock. Moves states due by time_now from pending to in flight.
+        :return: list of (key, state json) to write
+        """
+        to_write = [(key, pending["text"]) for key, pending in self._pending.items() if pending["due"] <= time_now]
+        for key, text in to_write:
+            del self._pending[key]
+            self._in_flight[key] = text
+        return to_write
+
+    def _write(self, to_write: list[tuple[Hashable, str]]) -> None:
+        try:
+            written = self.write_method(to_write)
+        except Exception as e:
+            logger.error(f"Unable to write state. Error: {e}")
+            written = False
+        with self._condition:
+            time_now = time.perf_counter()
+            for key, text in to_write:
+                if self._in_flight.get(key) == text:
+                    del self._in_flight[key]
+            if written:
+                for key, _ in to_write:
+                    self._time_last_written[key] = time_now
+                self._stats["written"] += len(to_write)
+            else:
+                self._stats["failed"] += len(to_write)
+                # Try again later, unless a newer state of the object is already waiting
+                due = time_now + self.min_write_interval_s
+                for key, text in to_write:
+                    if key not in self._pending:
+                        self._pending[key] = {"text": text, "due": due}
+                self._condition.notify()
+
+
+def write_files_atomic(to_write: list[tuple[str, str]]) -> bool:
+    """
+    :param to_write: list of (file path, text)
+    :return: True if all files written
+    """
+    # List, so all files are attempted even if one fails
+    return all([write_file_atomic(file_path, text) for file_path, text in to_write])
+
+
+def write_file_atomic(file_path: str, text: str) -> bool:
+    """
+    Write to a temporary file in the same folder, then replace the target with it
+    :return: True if written
+    """
+    temp_file_path = file_path + StatePersistence.TEMP_FILE_EXTENSION
+    try:
+        with open(temp_file_path, 'w') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file_path, file_path)
+        return True
+    except FileNotFoundError:
+        logger.error(f"Invalid file path when saving state: {file_path}")
+    except Exception as e:
+        logger.error(f"Unable to save state for file {file_path}. Error: {e}")
+    return False
+
+
+if __name__ == '__main__':
+    test()
@@ -1,7 +1,9 @@
-import json
 import logging
 import os
+import threading
 from abc import abstractmethod, ABC
+from helpers.state_persistence import StatePersistence
+from helpers.state_store import StateStore
 import settings
 
 # Setup logging
@@ -37,6 +39,12 @@ def test():
 
 class StateSaver(ABC):
     FILE_NAME_EXTENSION = ".st"
+    # When set, state is written in the background, debounced and coalesced. Written immediately if None.
+    persistence: StatePersistence | None = None
+    # Base path: store of the state folder
+    _stores = {}
+    _failed_paths = set()
+    _stores_lock = threading.Lock()
 
     @abstractmethod
     def save_state(self):
@@ -52,46 +60,99 @@ class StateSaver(ABC):
         """
         pass
 
+    @staticmethod
+    def get_store(base_path: str) -> StateStore | None:
+        """
+        Store of the state folder, opened on first use, which also imports old state files of the folder
+        @param base_path: location of state
+        @return: None if the store can not be opened
+        """
+        with StateSaver._stores_lock:
+            if base_path not in StateSaver._stores:
+                try:
+                    StateSaver._stores[base_path] = StateStore(base_path)
+                except Exception as e:
+                    if base_path not in StateSaver._failed_paths:
+                        # Retried on every save and load, logged once
+                        StateSaver._failed_paths.add(base_path)
+                        logger.error(f"Unable to open state store in {base_path}. Error: {e}")
+                    return None
+            return StateSaver._stores[base_path]
+
     @staticmethod
     def save_state_to_file(base_path: str, name: str, data: dict):
         """
-        Save some parameters to file so they can be restored on next program launch
-        @param base_path: location of state file
+        Save some parameters so they can be restored on next program launch
+        @param base_path: location of state
         @param name: name of Class instance
         @param data: dictionary of state to save
         @return:
         """
-        file_path = os.path.join(base_path, name + StateSaver.FILE_NAME_EXTENSION)
-        try:
-            with open(file_path, 'w') as file:
-                json.dump(data, file)
-        except FileNotFoundError:
-            logger.error(f"Invalid file path when saveing state: {file_path}")
-        except Exception as e:
-            logger.error(f"Unable to save state for file {file_path}. Error: {e}")
+        StateSaver.save_states(base_path, {name: data})
+
+    @staticmethod
+    def save_states(base_path: str, states: dict):
+        """
+        Save state of several objects together, in one transaction. With background writing they are marked as one
+        batch, so they are written together.
+        @param base_path: location of state
+        @param states: {name of Class instance: dictionary of state to save}
+        """
+        if StateSaver.persistence is not None:
+            StateSaver.persistence.mark_dirty_batch({(base_path, name): data for name, data in states.items()})
+            return
+        store = StateSaver.get_store(base_path)
+        if store is None:
+            logger.error(f"Unable to save state of {list(states)} in {base_path}")
+            return
+        store.save_states(states)
+
+    @staticmethod
+    def write_states(to_write: list[tuple[tuple[str, str], str]]) -> bool:
+        """
+        Write method of background state persistence, states of each folder saved in one transaction
+        @param to_write: list of ((base_path, name), state json)
+        @return: True if all saved
+        """
+        states_by_path = {}
+        for (base_path, name), text in to_write:
+            states_by_path.setdefault(base_path, {})[name] = text
+        saved = True
+        for base_path, states in states_by_path.items():
+            store = StateSaver.get_store(base_path)
+            saved = store is not None and store.save_states(states) and saved
+        return saved
 
     @staticmethod
     def load_state_from_file(base_path: str, name: str) -> dict:
         """
-        Load some parameters from file
-        @param base_path: location of state file
+        Load some parameters saved before
+        @param base_path: location of state
         @param name: name of Class instance
         @return:
         """
-        file_path = os.path.join(base_path, name + StateSaver.FILE_NAME_EXTENSION)
-        if not os.path.exists(file_path):
-            # State file does not exist, create one with default parameters
-            logger.info(f"State file does not exist for {file_path}.")
+        if StateSaver.persistence is not None:
+            # Not yet written state is newer than the store
+            pending = StateSaver.persistence.get_pending((base_path, name))
+            if pending is not None:
+                return pending
+        store = StateSaver.get_store(base_path)
+        if store is None:
             return None
-        try:
-            with open(file_path, 'r') as file:
-                data = json.load(file)
-                return data
-        except json.decoder.JSONDecodeError:
-            logger.error(f"Unable to parse state data from {file_path}.")
-        except Exception as e:
-            logger.error(f"Unable to load state {file_path}. Error {e}")
-        return None
+        data = store.load_state(name)
+        if data is None:
+            logger.info(f"No saved state for {name} in {base_path}.")
+        return data
+
+    @staticmethod
+    def stop():
+        """
+        Close stores, state persistence must be stopped before
+        """
+        with StateSaver._stores_lock:
+            for store in StateSaver._stores.values():
+                store.stop()
+            StateSaver._stores.clear()
 
 
 class TestClass(StateSaver):
@@ -0,0 +1,167 @@
+"""
+Single store of the saved state of all devices and schedules
+States of all objects in a state folder are kept in one SQLite table and loaded with one query when the store is
+opened. Several states can be saved in one transaction. State files of the old format, one .st file per object, found
+in the folder are imported on opening and renamed so they are not imported again.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "state_store.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    import tempfile
+    base_path = tempfile.mkdtemp()
+    # State file of the old format
+    with open(os.path.join(base_path, "Boiler" + StateStore.OLD_FILE_EXTENSION), "w") as file:
+        json.dump({"mode": 1, "manual_state": False}, file)
+    store = StateStore(base_path)
+    print(store.load_state("Boiler"))
+    store.save_states({"Boiler": {"mode": 0, "manual_state": True}, "Schedule 1": {"periods": [0, 1, 1]}})
+    store.stop()
+    store = StateStore(base_path)
+    print(store.load_state("Boiler"), store.load_state("Schedule 1"))
+    print(os.listdir(base_path))
+    store.stop()
+
+
+class StateStore:
+    """
+    Thread safe, states are saved from the state persistence thread and loaded from the UI thread
+    """
+    DB_FILE_NAME = "state.db"
+    # Extension of the per object state files used before the store
+    OLD_FILE_EXTENSION = ".st"
+    # Added to imported state files
+    MIGRATED_FILE_EXTENSION = ".migrated"
+
+    def __init__(self, base_path: str):
+        """
+        Opens or creates the store, imports old state files and loads all states
+        :param base_path: state folder
+        """
+        self.base_path = base_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(base_path, self.DB_FILE_NAME), check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.create_table_for_state()
+        self.migrate_old_state_files()
+        # Name: state, all states read at once
+        self._states = self.load_all_states()
+
+    def create_table_for_state(self) -> None:
+        self.cursor.execute('''CREATE TABLE IF NOT EXISTS object_state (
+                                name TEXT PRIMARY KEY,
+                                state TEXT NOT NULL,
+                                update_time REAL NOT NULL
+                              )''')
+        self.conn.commit()
+
+    def load_all_states(self) -> dict:
+        """
+        :return: {name: state dict} of all objects in the store
+        """
+        states = {}
+        with self._lock:
+            self.cursor.execute("SELECT name, state FROM object_state")
+            rows = self.cursor.fetchall()
+        for name, state in rows:
+            try:
+                states[name] = json.loads(state)
+            except json.decoder.JSONDecodeError:
+                logger.error(f"Unable to parse state data of {name}")
+        return states
+
+    def load_state(self, name: str) -> dict | None:
+        """
+        :return: saved state of the object, None if it has none
+        """
+        with self._lock:
+            return self._states.get(name)
+
+    def save_state(self, name: str, data: dict) -> bool:
+        return self.save_states({name: data})
+
+    def save_states(self, states: dict) -> bool:
+        """
+        Save several states in one transaction, either all or none of them are saved
+        :param states: {name: state dict}
+        :return: True if saved
+        """
+        try:
+            rows = [(name, data if isinstance(data, str) else json.dumps(data), time.time())
+                    for name, data in states.items()]
+        except Exception as e:
+            logger.error(f"Unable to serialise state. Error: {e}")
+            return False
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.executemany("INSERT OR REPLACE INTO object_state (name, state, update_time) "
+                                          "VALUES (?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                logger.error(f"Unable to save state in {self.base_path}. Error: {e}")
+                return False
+            for name, state, _ in rows:
+                self._states[name] = json.loads(state)
+        return True
+
+    def migrate_old_state_files(self) -> None:
+        """
+        Import .st files in the state folder, states already in the store are newer and kept
+        """
+        old_files = [file_name for file_name in os.listdir(self.base_path)
+                     if file_name.endswith(self.OLD_FILE_EXTENSION)]
+        if not old_files:
+            return
+        rows = []
+        for file_name in old_files:
+            file_path = os.path.join(self.base_path, file_name)
+            try:
+                with open(file_path, 'r') as file:
+                    # Parsed to check the file, stored as is
+                    state = json.dumps(json.load(file))
+            except Exception as e:
+                logger.error(f"Unable to import state file {file_path}. Error {e}")
+                continue
+            rows.append((file_name[:-len(self.OLD_FILE_EXTENSION)], state, os.path.getmtime(file_path)))
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.executemany("INSERT OR IGNORE INTO object_state (name, state, update_time) "
+                                          "VALUES (?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                logger.error(f"Unable to import state files in {self.base_path}. Error: {e}")
+                return
+        # Files kept for recovery, but not imported again
+        for name, _, _ in rows:
+            file_path = os.path.join(self.base_path, name + self.OLD_FILE_EXTENSION)
+            os.replace(file_path, file_path + self.MIGRATED_FILE_EXTENSION)
+        logger.info(f"Imported {len(rows)} state files in {self.base_path}")
+
+    def stop(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    test()
@@ -4,6 +4,7 @@ Application for controlling home automation:
 *Creating schedules according to electricity price
 """
 import os
+import time
 from threading import Timer
 import subprocess
 from tkinter import Tk, Label, Button, Frame
@@ -17,7 +18,14 @@ from devices.shellyPlugUrlControlled import URLControlledShellyPlug
 from devices.device import Device
 from devices.deviceTypes import DeviceType
 from helpers.mqtt_client import MyMqttClient
+from helpers.mqtt_recorder import MqttRecorder
+from helpers.http_client_pool import HttpClientPool
+from helpers.shelly_rpc_client import ShellyRpcFleetPoller
+from helpers.device_supervisor import DeviceSupervisor
+from helpers.fleet_state import FleetStateTable
 from helpers.price_file_manager import PriceFileManager
+from helpers.state_persistence import StatePersistence
+from helpers.state_saver import StateSaver
 from custom_tk_widgets.shelly_plug_widget import ShellyPlugWidget
 from custom_tk_widgets.shelly_plus_widget import ShellyPlusWidget
 from custom_tk_widgets.shelly_plug_url_widget import ShellyPlugUrlWidget
@@ -32,7 +40,7 @@ from custom_tk_widgets.ahu_widget import AhuWidget
 from custom_tk_widgets.shelly_3em_widget import ShellyEmWidget
 from helpers.observer_pattern import Observer
 from helpers.data_logger import DataLogger
-from system_setup.device_setup import get_device_list_from_file
+from system_setup.device_registry import DeviceRegistry
 from system_setup.schedule_setup import get_schedule_list_from_file
 import secrets
 import settings
@@ -72,6 +80,14 @@ class MainUIClass(Tk, Observer):
     LOOP_PRICE_MNGR_INTERVAL_S = 10.0
     # How often should the mqtt client loop be called
     LOOP_MQTT_INTERVAL_S = 0.3
+    # How often to poll Shelly Gen2 devices over HTTP while MQTT is not connected
+    RPC_FALLBACK_POLL_INTERVAL_S = 30.0
+    # How often to update total power in the UI
+    FLEET_POWER_UPDATE_INTERVAL_MS = 1000
+    # Power readings older than this are left out of the total, the device is offline
+    FLEET_POWER_MAX_AGE_S = 60
+    # Devices whose power is summed for the UI, energy meter is left out as it measures the same consumption
+    FLEET_POWER_DEVICE_TYPES = (DeviceType.SHELLY_PLUG, DeviceType.SHELLY_PLUS_PM)
     # UI constants
     BTN_WIDTH = 60
     # For determining if checkbox of today or tomorrow pressed
@@ -82,18 +98,28 @@ class MainUIClass(Tk, Observer):
     PRICE_FILE_LOCATION = settings.PRICE_FILE_LOCATION
     # display price per kWh, default is per MWh
     DISPLAY_PRICE_PER_KWH = True
+    # Devices that listen to MQTT topics
+    MQTT_DEVICE_TYPES = (DeviceType.SHELLY_PLUG, DeviceType.SHELLY_PLUS, DeviceType.SHELLY_PLUS_PM,
+                         DeviceType.SHELLY_PRO_3EM)
+    # Devices whose state changes are logged
+    LOGGED_DEVICE_TYPES = (DeviceType.SHELLY_PLUG, DeviceType.SHELLY_PLUS, DeviceType.SHELLY_PLUS_PM,
+                           DeviceType.URL_CONTROLLED_SHELLY_PLUG)
 
     def __init__(self) -> None:
         super().__init__()
         logger.info("Program started")
         # Threads for repeated tasks
         self.device_thread, self.schedule_thread, self.price_mngr_thread, self.mqtt_thread = None, None, None, None
-        self.mqtt_client = MyMqttClient()
+        self.mqtt_client = MyMqttClient(worker_threads=settings.MQTT_WORKER_THREADS,
+                                        stats_log_interval_s=settings.MQTT_STATS_LOG_INTERVAL_S)
         # UI displays MQTT status, subscribe to status changes
         self.mqtt_client.register(self, MyMqttClient.event_name_status_change)
         # Object responsible for getting and storing electricity prices
         self.price_mngr = PriceFileManager(self.PRICE_FILE_LOCATION)
         self.price_mngr.register(self, PriceFileManager.event_name_prices_changed)
+        # Device and schedule state is written in the background, so UI and schedule changes do not wait for the disk
+        StateSaver.persistence = StatePersistence(write_method=StateSaver.write_states)
+        StateSaver.persistence.start()
         # Setup devices of the system
         self.setup_devices()
         # Setup schedules that will control the devices
@@ -101,9 +127,12 @@ class MainUIClass(Tk, Observer):
         self.set_up_ui()
         self.setup_data_logger()
         # Start MQTT client only after all devices created, so the topics are listed
+        self.mqtt_recorder = MqttRecorder(settings.MQTT_RECORD_FILE) if settings.MQTT_RECORD_FILE else None
         self.mqtt_client.start(settings.MQTT_SERVER, settings.MQTT_PORT, user=secrets.MQTT_USER,
-                               psw=secrets.MQTT_PSW)
+                               psw=secrets.MQTT_PSW, recorder=self.mqtt_recorder)
         self.update_mqtt_status()
+        # Read state of all devices reachable over HTTP without waiting for MQTT
+        self.rpc_poller.poll_all()
         # Call repeated tasks after creation of UI
         self.price_mngr_threaded_loop()
         self.device_threaded_loop()
@@ -121,29 +150,27 @@ class MainUIClass(Tk, Observer):
             # If ahu enabled get all sensors from it
             ahu_sensors = self.ahu.get_sensor_list()
             all_sensors.extend(ahu_sensors)
-        for dev in self.dev_list:
-            # If device has Sensor object within it add to sensor list
-            if dev.device_type == DeviceType.SHELLY_PRO_3EM:
-                # Get sensors from energy meter
-                # noinspection PyUnresolvedReferences
-                all_sensors.extend(dev.get_sensors_as_list())
+        for dev in self.dev_registry.get_by_type(DeviceType.SHELLY_PRO_3EM):
+            # Get sensors from energy meter
+            # noinspection PyUnresolvedReferences
+            all_sensors.extend(dev.get_sensors_as_list())
         logger.info("Sensor registered in system")
         for sensor in all_sensors:
             logger.info(sensor)
         # noinspection PyAttributeOutsideInit
         self.data_logger = DataLogger(get_prices_method=self.price_mngr.get_prices_today_tomorrow,
-                                      device_list=self.dev_list,
+                                      device_registry=self.dev_registry,
                                       sensor_list=all_sensors,
                                       periodical_log_interval_s=self.PERIODICAL_LOG_INTERVAL_S)
         # Notify data loggger when new prices arrive
         self.price_mngr.register(self.data_logger, PriceFileManager.event_name_prices_changed)
-        for dev in self.dev_list:
-            if dev.device_type == DeviceType.SHELLY_PLUG or \
-                    dev.device_type == DeviceType.SHELLY_PLUS or \
-                    dev.device_type == DeviceType.SHELLY_PLUS_PM or \
-                    dev.device_type == DeviceType.URL_CONTROLLED_SHELLY_PLUG:
+        for dev in self.dev_registry:
+            if dev.device_type in self.LOGGED_DEVICE_TYPES:
                 # Register state changes for devices
                 dev.register(self.data_logger, Device.event_name_actual_state_changed)
+            elif dev.device_type == DeviceType.SHELLY_PRO_3EM:
+                # Energy meter minute data is logged in batches as it arrives
+                dev.register(self.data_logger, ShellyEnergyMeter3em.event_name_new_minute_data)
             else:
                 logger.error(f"Logging not implemented for {dev.device_type} in method setup_db_logger")
 
@@ -152,6 +179,13 @@ class MainUIClass(Tk, Observer):
         # Start the loop again after delay
         self.after(self.MAINLOOP_OTHER_INTERVAL_MS, self.mainloop_user)# type: ignore
 
+    def update_fleet_power(self) -> None:
+        # Total power of devices read from the fleet state table in one call per device type
+        total_power = sum(self.fleet_state.column_sum("power", device_type, max_age_s=self.FLEET_POWER_MAX_AGE_S)
+                          for device_type in self.FLEET_POWER_DEVICE_TYPES)
+        self.lbl_fleet_power.config(text=f"DEVICES {total_power:.0f} W")
+        self.after(self.FLEET_POWER_UPDATE_INTERVAL_MS, self.update_fleet_power)# type: ignore
+
     def mqtt_threaded_loop(self) -> None:
         # Periodically call mqtt_client loop
         self.mqtt_client.loop()
@@ -173,13 +207,24 @@ class MainUIClass(Tk, Observer):
 
     def device_threaded_loop(self) -> None:
         # Device related loops
-        for dev in self.dev_list:
+        self.rpc_poller.loop()
+        self.check_rpc_fallback_poll()
+        # Supervised devices are only handled when one of their deadlines expires
+        self.device_supervisor.tick()
+        for dev in self.unsupervised_devs:
             dev.loop()
         if settings.AHU_ENABLED:
             self.ahu.loop()
         self.device_thread = Timer(self.LOOP_DEVICES_INTERVAL_S, self.device_threaded_loop)
         self.device_thread.start()
 
+    def check_rpc_fallback_poll(self) -> None:
+        # While MQTT is not connected read device status over HTTP
+        if self.mqtt_client.status == MyMqttClient.MqttClientThread.STATUS_CONNECTED:
+            return
+        if time.perf_counter() - self.rpc_poller.time_of_last_poll >= self.RPC_FALLBACK_POLL_INTERVAL_S:
+            self.rpc_poller.poll_all()
+
     def handle_subject_event(self, event_type: str, *args, **kwargs) -> None:
         # Method for handling subject events. Observer pattern.
         logger.debug(f"Main received event: {event_type}")
@@ -193,27 +238,37 @@ class MainUIClass(Tk, Observer):
         txt_color = "green" if self.mqtt_client.status == MyMqttClient.MqttClientThread.STATUS_CONNECTED else "red"
         new_text = self.mqtt_client.status_strings.get(self.mqtt_client.status, "UNKNOWN")
         self.lbl_status.config(text=new_text, fg=txt_color)
+        # Control devices over HTTP while MQTT is not connected
+        mqtt_connected = self.mqtt_client.status == MyMqttClient.MqttClientThread.STATUS_CONNECTED
+        for dev in self.rpc_poller.devices:
+            dev.rpc_fallback = None if mqtt_connected else self.rpc_poller
 
     def setup_schedules(self) -> None:
         logger.debug("Setting schedules up from file")
         self.schedule_list = get_schedule_list_from_file(get_prices_method=self.price_mngr.get_prices_today_tomorrow,
-                                                         dev_list=self.dev_list,
+                                                         dev_list=self.dev_registry,
                                                          file_path=os.path.join(settings.SCH_CONFIG_FILE_LOCATION,# type: ignore
                                                                                 settings.SCH_CONFIG_FILE_NAME))# type: ignore
     # noinspection PyAttributeOutsideInit
     def setup_devices(self) -> None:
         # Setup automation devices
-        self.dev_list = get_device_list_from_file(mqtt_publish_method=self.mqtt_client.publish,
-                                                  file_path=os.path.join(settings.DEV_CONFIG_FILE_LOCATION,# type: ignore
-                                                                         settings.DEV_CONFIG_FILE_NAME))# type: ignore
-        for dev in self.dev_list:
-            if dev.device_type == DeviceType.SHELLY_PLUG or \
-                    dev.device_type == DeviceType.SHELLY_PLUS or \
-                    dev.device_type == DeviceType.SHELLY_PLUS_PM or \
-                    dev.device_type == DeviceType.SHELLY_PRO_3EM:
-                # if device is an MQTT device, register the topic that should be subscribed to and a callback
-                # for receiving messages from that topic
-                self.mqtt_client.add_listen_topic(dev.listen_topic, dev.process_received_mqtt_data)  # type: ignore
+        self.dev_registry = DeviceRegistry.from_file(mqtt_publish_method=self.mqtt_client.publish,
+                                                     file_path=os.path.join(settings.DEV_CONFIG_FILE_LOCATION,# type: ignore
+                                                                            settings.DEV_CONFIG_FILE_NAME))# type: ignore
+        for dev in self.dev_registry.get_by_type(*self.MQTT_DEVICE_TYPES):
+            # if device is an MQTT device, register the topic that should be subscribed to and a callback
+            # for receiving messages from that topic
+            self.mqtt_client.add_listen_topic(dev.listen_topic, dev.process_received_mqtt_data)  # type: ignore
+        # Live readings of all devices in one table
+        self.fleet_state = FleetStateTable()
+        for dev in self.dev_registry:
+            dev.attach_fleet_state(self.fleet_state)
+        # Devices that support it are checked on deadlines, others need their loop called
+        self.device_supervisor = DeviceSupervisor(tick_s=self.LOOP_DEVICES_INTERVAL_S)
+        self.unsupervised_devs = [dev for dev in self.dev_registry if not dev.supervise(self.device_supervisor)]
+        # Shelly Gen2 devices with an ip can also be monitored and controlled over HTTP RPC
+        self.rpc_poller = ShellyRpcFleetPoller(self.dev_registry.get_by_type(DeviceType.SHELLY_PLUS,
+                                                                             DeviceType.SHELLY_PLUS_PM))
         if settings.AHU_ENABLED:
             self.ahu = ValloxAhu(ip="http://192.168.94.118/")
 
@@ -225,6 +280,7 @@ class MainUIClass(Tk, Observer):
         self.place_ui_elements()
         # Start TKinter inherited inbuilt loop
         self.after(self.MAINLOOP_OTHER_INTERVAL_MS, self.mainloop_user)# type: ignore
+        self.after(self.FLEET_POWER_UPDATE_INTERVAL_MS, self.update_fleet_power)# type: ignore
 
     def populate_ui_with_el_prices(self) -> None:
         # Set electrical price data in the user interface
@@ -241,6 +297,7 @@ class MainUIClass(Tk, Observer):
     def prepare_ui_elements(self) -> None:
         # Create UI elements
         self.lbl_status = Label(self, text='MQTT STATUS')
+        self.lbl_fleet_power = Label(self, text='DEVICES - W')
         # Buttons for debuggin or extra features
         self.frame_extra_btns = Frame(self)
         self.btn_1 = Button(self.frame_extra_btns, text='OPEN PRICE FILE FOLDER',
@@ -258,7 +315,7 @@ class MainUIClass(Tk, Observer):
         self.frame_devices = Frame(self)
         # Store all widgets in a list to place in one TKinter frame
         self.dev_widgets = []
-        for dev in self.dev_list:
+        for dev in self.dev_registry:
             # For each device type create the apropriate widget and register listeners to those widgets
             if dev.device_type == DeviceType.SHELLY_PLUG:
                 shelly_widget = ShellyPlugWidget(parent=self.frame_devices, device=dev)  # type: ignore
@@ -322,6 +379,7 @@ class MainUIClass(Tk, Observer):
         # Place created UI elements
         # Main grid  - label
         self.lbl_status.grid(row=0, column=0)
+        self.lbl_fleet_power.grid(row=0, column=1)
         # Buttons grid
         self.frame_extra_btns.grid(row=1, column=0)
         self.btn_1.grid(row=0, column=0)
@@ -367,10 +425,21 @@ class MainUIClass(Tk, Observer):
         # Stop DB manager
         self.data_logger.stop()
         # Stpo MQTT client
-        self.mqtt_client.stop()
+        try:
+            self.mqtt_client.stop()
+        finally:
+            # Already closed by the client when it stops, closed here too so the recording is complete if stop fails
+            if self.mqtt_recorder:
+                self.mqtt_recorder.close()
+        # Close connections of URL controlled devices
+        self.rpc_poller.stop()
+        HttpClientPool.get_shared().stop()
         if settings.AHU_ENABLED:
             # Stop AHU data read
             self.ahu.stop()
+        # Write state changes not yet saved
+        StateSaver.persistence.stop()
+        StateSaver.stop()
         # Close tkinter UI
         if hasattr(self, 'winfo_exists') and self.winfo_exists():
             self.destroy()
@@ -5,6 +5,7 @@ import os
 from helpers.price_objects import DayPrices
 from schedules.hourly_schedule import HourlySchedule2days
 from schedules.schedule_creator import ScheduleCreator
+from schedules.rolling_horizon import RollingHorizonPlanner
 from typing import Callable, Dict, Tuple
 from helpers.state_saver import StateSaver
 import settings
@@ -62,14 +63,26 @@ class AutoScheduleCreator(StateSaver):
         self._calculation_time_h = calculation_time_h
         self._calculation_time_min = calculation_time_min
         self._period_split = period_split
+        # Plan the remaining horizon again at every period boundary instead of once a day
+        self._rolling_horizon_enabled = False
+        # Daily schedule generation job, not registered while rolling horizon is enabled
+        self._schedule_job = None
         # Set default values initially, then attempt to load saved state
         self.load_state()
+        self._rolling_planner = RollingHorizonPlanner(get_prices_method=get_prices_method,
+                                                      hourly_schedule=hourly_schedule,
+                                                      period_split=self._period_split,
+                                                      max_total_cost=self._max_total_cost,
+                                                      max_periods_to_run=self._max_periods_to_run,
+                                                      min_periods_to_run=self._min_periods_to_run)
         # Activate auto create
         self.set_auto_create_enabled(self._auto_create_enabled)
 
     def loop(self):
         # Call periodically to execute auto schedule creation
-        if self._auto_create_enabled:
+        if self._auto_create_enabled and self._rolling_horizon_enabled:
+            self._rolling_planner.loop()
+        elif self._auto_create_enabled:
             schedule.run_pending()
         else:
             logger.debug("Auto create disabled")
@@ -89,6 +102,10 @@ class AutoScheduleCreator(StateSaver):
         self._calculation_time_min = calculation_time_min
         if self._auto_create_enabled:
             self.set_up_scheduling()
+        self._rolling_planner.set_parameters(period_split=self._period_split,
+                                             max_total_cost=self._max_total_cost,
+                                             max_periods_to_run=self._max_periods_to_run,
+                                             min_periods_to_run=self._min_periods_to_run)
         self.save_state()
 
     def get_schedule_name(self):
@@ -103,21 +120,46 @@ class AutoScheduleCreator(StateSaver):
         self.save_state()
         if self._auto_create_enabled:
             self.set_up_scheduling()
+        else:
+            self.cancel_scheduling()
 
     def get_auto_create_enabled(self):
         return self._auto_create_enabled
 
+    def set_rolling_horizon_enabled(self, off_on: bool):
+        self._rolling_horizon_enabled = off_on
+        # Plan the full horizon when enabled again
+        self._rolling_planner.reset()
+        # The rolling planner replaces the daily generation, it must not overwrite the rolling plan
+        if self._rolling_horizon_enabled:
+            self.cancel_scheduling()
+        elif self._auto_create_enabled:
+            self.set_up_scheduling()
+        self.save_state()
+
+    def get_rolling_horizon_enabled(self):
+        return self._rolling_horizon_enabled
+
+    def get_rolling_horizon_stats(self):
+        return self._rolling_planner.get_stats()
+
     def set_up_scheduling(self):
-        # delete all schedules already setup
-        schedule.clear()
+        # delete the schedule already setup
+        self.cancel_scheduling()
         self.check_period()
-        self.set_scheduled_times()
+        if not self._rolling_horizon_enabled:
+            self.set_scheduled_times()
+
+    def cancel_scheduling(self):
+        if self._schedule_job is not None:
+            schedule.cancel_job(self._schedule_job)
+            self._schedule_job = None
 
     def set_scheduled_times(self):
         logger.info("Setting schedule times")
         schedule_time_str = f"{self._calculation_time_h:02}:{self._calculation_time_min:02}"
         logger.info(f"Adding time {schedule_time_str}")
-        schedule.every().day.at(f"{schedule_time_str}").do(self.execute_schedule_generation)
+        self._schedule_job = schedule.every().day.at(f"{schedule_time_str}").do(self.execute_schedule_generation)
 
     def execute_schedule_generation(self):
         # get prices using the available method
@@ -131,6 +173,7 @@ class AutoScheduleCreator(StateSaver):
             periods_ahead_to_calculate=self._auto_create_period,
             max_periods_to_run=self._max_periods_to_run,
             min_periods_to_run=self._min_periods_to_run)
+        logger.info(f"Schedule cache {ScheduleCreator.get_cache_stats()}")
         if self._hourly_schedule:
             self._hourly_schedule.set_schedule_full_day(today_tomorrow=False, schedule=schedule_today)
             self._hourly_schedule.set_schedule_full_day(today_tomorrow=True, schedule=schedule_tomorrow)
@@ -155,6 +198,7 @@ class AutoScheduleCreator(StateSaver):
             "calculation_time_min": self._calculation_time_min,
             "_auto_create_enabled": self._auto_create_enabled,
             "_auto_create_period": self._auto_create_period,
+            "_rolling_horizon_enabled": self._rolling_horizon_enabled,
         }
         StateSaver.save_state_to_file(base_path=self.state_file_loc, data=state_to_save, name=self.name)
         logger.info(f"State saved successfully for {self.name}")
@@ -174,6 +218,10 @@ class AutoScheduleCreator(StateSaver):
             self._calculation_time_min = loaded_state["calculation_time_min"]
             self._auto_create_period = loaded_state["_auto_create_period"]
             self._auto_create_enabled = loaded_state["_auto_create_enabled"]
+            # Not present in states saved before rolling horizon was added
+            self._rolling_horizon_enabled = loaded_state.get("_rolling_horizon_enabled", False)
+            if self._rolling_horizon_enabled:
+                self.cancel_scheduling()
             logger.info(f"State retrieved successfully for {self.name}")
             logger.info(f"State {loaded_state}")
         except KeyError as e:
@@ -0,0 +1,295 @@
+"""
+Joint scheduling of several devices sharing a power limit
+Devices scheduled on their own all pick the same cheapest periods, which together can exceed the main fuse. The joint
+scheduler first prices in the limit: every device is optimized on its own with ScheduleCreator's block optimizer, and
+periods where the devices together exceed the limit get a growing penalty added to their price (Lagrangian relaxation),
+until the devices spread out. If the limit is still exceeded after that, devices are placed one after another, each
+only in periods with enough power left.
+"""
+import logging
+import math
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+from helpers.price_objects import DayPrices
+from schedules.hourly_schedule import HourlySchedule2days
+from schedules.schedule_creator import ScheduleCreator
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "joint_scheduler.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    rng = random.Random(1)
+    prices = [round(rng.uniform(20.0, 200.0), 2) for _ in range(96)]
+    # Cheap night, everybody wants it
+    for period in range(8, 24):
+        prices[period] = round(rng.uniform(0.0, 10.0), 2)
+    devices = [JointScheduleDevice("Boiler", power_w=2000, max_periods_to_run=16, min_periods_to_run=8, phases=(0,),
+                                   max_blocks=2, min_block_length=4),
+               JointScheduleDevice("Heat pump", power_w=3000, max_periods_to_run=24, min_periods_to_run=16,
+                                   max_blocks=4, min_block_length=4),
+               JointScheduleDevice("Car charger", power_w=7400, max_periods_to_run=16, min_periods_to_run=12,
+                                   max_blocks=1)]
+    joint_scheduler = JointScheduler(devices, power_limit_w=11000, phase_power_limit_w=[4000, 4000, 4000])
+    run_lists = joint_scheduler.find_joint_run_lists(prices)
+    for name, run_list in run_lists.items():
+        print(f"{name:12} {''.join('1' if on else '0' for on in run_list)}")
+    print(f"Max load {max(joint_scheduler.last_load_w)} W, iterations {joint_scheduler.last_iterations}, "
+          f"cost {joint_scheduler.get_energy_cost(prices, run_lists):.1f}, unmet {joint_scheduler.last_unmet}")
+
+
+@dataclass
+class JointScheduleDevice:
+    """
+    Device scheduled by the joint scheduler with its run time requirements and block constraints
+    """
+    name: str
+    # Power when on
+    power_w: float
+    max_periods_to_run: int
+    # Has higher priority than max_total_cost, but not than the power limit
+    min_periods_to_run: int
+    # Limit on the sum of prices of on periods, like for AutoScheduleCreator
+    max_total_cost: float = float("inf")
+    max_blocks: int = 2
+    min_block_length: int = 1
+    min_gap: int = 2
+    # Phases the device is connected to, power is split evenly
+    phases: Tuple[int, ...] = (0, 1, 2)
+    # Schedule the result is written to
+    hourly_schedule: HourlySchedule2days = None
+    # For each upcoming period whether the device may run, all if None
+    available: List[bool] = field(default=None, repr=False)
+
+
+class JointScheduler:
+    """
+    Creates schedules for several devices together, so their total power stays under a limit in every period
+    """
+    # Price penalty rounds before placing devices one by one
+    MAX_ITERATIONS = 30
+    # Allowed rounding error of power sums
+    POWER_TOLERANCE_W = 1e-6
+
+    def __init__(self,
+                 devices: List[JointScheduleDevice],
+                 power_limit_w: float | List[float],
+                 phase_power_limit_w: List[float] = None,
+                 get_prices_method: Callable[[], Tuple[DayPrices, DayPrices]] = None,
+                 periods_ahead_to_calculate: int = 96):
+        """
+        :param devices: devices to schedule
+        :param power_limit_w: total power limit, same for all periods or one value for each upcoming period
+        :param phase_power_limit_w: power limit of each phase, no phase limits if None
+        :param get_prices_method: used by execute_schedule_generation
+        :param periods_ahead_to_calculate: for how many periods to create the schedules
+        """
+        self.devices = devices
+        self.power_limit_w = power_limit_w
+        self.phase_power_limit_w = phase_power_limit_w
+        self._get_prices_method = get_prices_method
+        self.periods_ahead_to_calculate = periods_ahead_to_calculate
+        # Results of the last calculation
+        self.last_load_w = []
+        self.last_iterations = 0
+        # Names of devices that could not get min_periods_to_run under the power limit
+        self.last_unmet = []
+
+    def execute_schedule_generation(self) -> None:
+        """
+        Create schedules from current prices and write them to the hourly schedules of the devices
+        """
+        logger.info("Executing joint schedule creation")
+        prices_today, prices_tomorrow = self._get_prices_method()
+        schedules = self.get_schedules_from_prices(prices_today, prices_tomorrow)
+        for device in self.devices:
+            schedule_today, schedule_tomorrow = schedules[device.name]
+            if device.hourly_schedule:
+                device.hourly_schedule.set_schedule_full_day(today_tomorrow=False, schedule=schedule_today)
+                device.hourly_schedule.set_schedule_full_day(today_tomorrow=True, schedule=schedule_tomorrow)
+            else:
+                logger.warning(f"No schedule assigned to {device.name}, printing results")
+                logger.warning(f"Today {schedule_today} Tomorrow {schedule_tomorrow}")
+
+    def get_schedules_from_prices(self, prices_today: DayPrices,
+                                  prices_tomorrow: DayPrices) -> Dict[str, Tuple[dict, dict]]:
+        """
+        :return: {device name: (schedule today, schedule tomorrow)}, same format as
+        ScheduleCreator.get_schedule_from_prices_v2
+        """
+        if not prices_today or not prices_tomorrow:
+            logger.warning("Price list does not exist")
+            return {device.name: ({i: False for i in range(96)}, {i: False for i in range(96)})
+                    for device in self.devices}
+        start_period, future_prices_list = ScheduleCreator.get_list_of_upcoming_prices(
+            prices_today, prices_tomorrow, self.periods_ahead_to_calculate)
+        run_lists = self.find_joint_run_lists(future_prices_list)
+        return {name: ScheduleCreator.create_schedule_dicts_from_run_list(run_list, start_period)
+                for name, run_list in run_lists.items()}
+
+    def find_joint_run_lists(self, prices: List[float]) -> Dict[str, List[bool]]:
+        """
+        :param prices: upcoming prices, each value meaning one period
+        :return: {device name: list of bools, whether the device is on in each period}
+        """
+        length = len(prices)
+        total_limits = self.power_limit_w if isinstance(self.power_limit_w, list) else [self.power_limit_w] * length
+        phase_limits = self.phase_power_limit_w or []
+        # Price penalty of each period for total and phase overload
+        penalties = [0.0] * length
+        phase_penalties = [[0.0] * length for _ in phase_limits]
+        # Step of penalty per relative overload, prices move in this range
+        step = (max(prices) - min(prices)) if length and max(prices) != min(prices) else 1.0
+        indices_by_device = {}
+        for iteration in range(1, self.MAX_ITERATIONS + 1):
+            self.last_iterations = iteration
+            for device in self.devices:
+                adjusted_prices = [price + penalty for price, penalty in zip(prices, penalties)]
+                for phase in device.phases:
+                    if phase < len(phase_limits):
+                        share = 1 / len(device.phases)
+                        adjusted_prices = [price + penalty * share
+                                           for price, penalty in zip(adjusted_prices, phase_penalties[phase])]
+                indices_by_device[device.name] = self.plan_device(device, prices, adjusted_prices, device.available)
+            load, phase_loads = self.get_loads(indices_by_device, length)
+            overloads = [self.get_overload(power, limit) for power, limit in zip(load, total_limits)]
+            phase_overloads = [[self.get_overload(power, limit) for power in phase_load]
+                               for phase_load, limit in zip(phase_loads, phase_limits)]
+            # Overloads are relative, the limits are checked in watts
+            if all(power <= limit + self.POWER_TOLERANCE_W for power, limit in zip(load, total_limits)) and \
+                    all(power <= limit + self.POWER_TOLERANCE_W for phase_load, limit in zip(phase_loads, phase_limits)
+                        for power in phase_load):
+                break
+            # Penalty grows where the limit is exceeded, and slowly falls where there is power left
+            step_now = step / iteration
+            penalties = [max(0.0, penalty + step_now * overload) for penalty, overload in zip(penalties, overloads)]
+            phase_penalties = [[max(0.0, penalty + step_now * overload)
+                                for penalty, overload in zip(penalties_of_phase, overloads_of_phase)]
+                               for penalties_of_phase, overloads_of_phase in zip(phase_penalties, phase_overloads)]
+        else:
+            logger.info(f"Power limit still exceeded after {self.MAX_ITERATIONS} iterations, placing devices in turn")
+            indices_by_device = self.place_devices_in_turn(prices, penalties, total_limits, phase_limits)
+        self.last_load_w, _ = self.get_loads(indices_by_device, length)
+        self.last_unmet = [device.name for device in self.devices
+                           if len(indices_by_device[device.name]) < min(device.min_periods_to_run, length)]
+        if self.last_unmet:
+            logger.warning(f"Not possible to run minimum periods under power limit for {self.last_unmet}")
+        run_lists = {}
+        for device in self.devices:
+            on_periods = set(indices_by_device[device.name])
+            run_lists[device.name] = [x in on_periods for x in range(length)]
+        return run_lists
+
+    def place_devices_in_turn(self, prices: List[float], penalties: List[float], total_limits: List[float],
+                              phase_limits: List[float]) -> Dict[str, List[int]]:
+        """
+        Devices with the most power first, each only in periods where it fits besides the other devices
+        All devices are placed with min_periods_to_run first, then each is extended to max_periods_to_run if it fits,
+        so the first devices do not take the power needed by the minimum run time of the others.
+        :return: {device name: on period indices}
+        """
+        length = len(prices)
+        load = [0.0] * length
+        phase_loads = [[0.0] * length for _ in phase_limits]
+        adjusted_prices = [price + penalty for price, penalty in zip(prices, penalties)]
+        indices_by_device = {}
+
+        def add_load(device: JointScheduleDevice, sign: int) -> None:
+            phase_power = sign * device.power_w / len(device.phases)
+            for period in indices_by_device[device.name]:
+                load[period] += sign * device.power_w
+                for phase in device.phases:
+                    if phase < len(phase_limits):
+                        phase_loads[phase][period] += phase_power
+
+        devices = sorted(self.devices, key=lambda dev: dev.power_w, reverse=True)
+        for extend in (False, True):
+            for device in devices:
+                if extend:
+                    # Placed again with its own load removed, the plan from the first pass still fits
+                    add_load(device, -1)
+                phase_power = device.power_w / len(device.phases)
+                available = [(device.available is None or device.available[period]) and
+                             load[period] + device.power_w <= total_limits[period] + self.POWER_TOLERANCE_W and
+                             all(phase_loads[phase][period] + phase_power <= phase_limits[phase] +
+                                 self.POWER_TOLERANCE_W for phase in device.phases if phase < len(phase_limits))
+                             for period in range(length)]
+                max_periods_to_run = device.max_periods_to_run if extend else \
+                    min(device.min_periods_to_run, device.max_periods_to_run)
+                indices_by_device[device.name] = self.plan_device(device, prices, adjusted_prices, available,
+                                                                  max_periods_to_run)
+                add_load(device, 1)
+        return indices_by_device
+
+    @staticmethod
+    def plan_device(device: JointScheduleDevice, prices: List[float], adjusted_prices: List[float],
+                    available: List[bool] | None, max_periods_to_run: int = None) -> List[int]:
+        """
+        Most on periods with the sum of prices under max_total_cost, at least min_periods_to_run if possible
+        Cheapest periods are chosen by adjusted prices, the cost limit is checked with actual prices.
+        :param max_periods_to_run: used instead of the device setting if given
+        :return: on period indices
+        """
+        if max_periods_to_run is None:
+            max_periods_to_run = device.max_periods_to_run
+        plans = ScheduleCreator.find_cheapest_blocks_for_each_n(adjusted_prices, max_periods_to_run,
+                                                                device.max_blocks, device.min_block_length,
+                                                                device.min_gap, available)
+        for n in sorted(plans.costs, reverse=True):
+            indices = plans.get_indices(n)
+            if n <= device.min_periods_to_run or sum(prices[i] for i in indices) <= device.max_total_cost:
+                return indices
+        return []
+
+    def get_loads(self, indices_by_device: Dict[str, List[int]], length: int) -> Tuple[List[float], List[List[float]]]:
+        """
+        :return: total power of each period, power of each phase in each period
+        """
+        load = [0.0] * length
+        phase_loads = [[0.0] * length for _ in (self.phase_power_limit_w or [])]
+        for device in self.devices:
+            phase_power = device.power_w / len(device.phases)
+            for period in indices_by_device[device.name]:
+                load[period] += device.power_w
+                for phase in device.phases:
+                    if phase < len(phase_loads):
+                        phase_loads[phase][period] += phase_power
+        return load, phase_loads
+
+    @staticmethod
+    def get_overload(power: float, limit: float) -> float:
+        """
+        :return: power over the limit relative to the limit, negative if under it
+        """
+        if limit == math.inf:
+            return -1.0
+        if limit <= 0:
+            return float(power > 0)
+        return (power - limit) / limit
+
+    def get_energy_cost(self, prices: List[float], run_lists: Dict[str, List[bool]]) -> float:
+        """
+        :return: sum of price times power in kW of all on periods
+        """
+        return sum(price * device.power_w / 1000
+                   for device in self.devices
+                   for price, on in zip(prices, run_lists[device.name]) if on)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,251 @@
+"""
+Rolling horizon schedule planning
+Instead of creating the schedule once a day, the remaining horizon is planned again at every 15 minute period boundary.
+The horizon is split in windows of period_split periods, each with the min/max periods and cost limit of the auto
+schedule creator. Windows are planned once when their prices are available, so prices arriving late are used as soon
+as they come. After that only the current window is planned again, and only if the devices ran differently than
+planned, with the periods already run and their cost subtracted from the window requirements.
+"""
+import datetime
+import logging
+import os
+import time
+from typing import Callable, Dict, Tuple
+from helpers.price_objects import DayPrices
+from schedules.hourly_schedule import HourlySchedule2days
+from schedules.schedule_creator import ScheduleCreator
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "rolling_horizon.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+PERIODS_PER_DAY = 96
+
+
+def test():
+    import random
+    rng = random.Random(1)
+    date_today = datetime.date.today()
+    prices_today = DayPrices(date_today)
+    prices_today.load_from_flat_list([round(rng.uniform(0, 200), 2) for _ in range(PERIODS_PER_DAY)])
+    prices_tomorrow = DayPrices(date_today + datetime.timedelta(days=1))
+    prices_tomorrow.load_from_flat_list([round(rng.uniform(0, 200), 2) for _ in range(PERIODS_PER_DAY)])
+    # Tomorrow's prices arrive at 14:00
+    time_now = datetime.datetime.combine(date_today, datetime.time(10, 0))
+    planner = RollingHorizonPlanner(
+        get_prices_method=lambda: (prices_today, prices_tomorrow if time_now.hour >= 14 else None),
+        hourly_schedule=None, period_split=24, max_total_cost=1500.0, max_periods_to_run=8, min_periods_to_run=4)
+    # Device never runs, so every window in progress is planned again
+    planner.get_device_on = lambda: False
+    while time_now.date() == date_today:
+        planner.loop(time_now)
+        time_now += datetime.timedelta(minutes=15)
+    print(planner.get_stats())
+
+
+def get_absolute_period(date: datetime.date, period: int) -> int:
+    """
+    :return: number of the 15 min period counted from the start of the calendar, continues over day changes
+    """
+    return date.toordinal() * PERIODS_PER_DAY + period
+
+
+def get_date_and_period(absolute_period: int) -> Tuple[datetime.date, int]:
+    return datetime.date.fromordinal(absolute_period // PERIODS_PER_DAY), absolute_period % PERIODS_PER_DAY
+
+
+class RollingHorizonPlanner:
+    """
+    Plans the schedule of an auto schedule creator again at every period boundary
+    Call loop often, at least a few times per period, device state is sampled in loop.
+    """
+
+    def __init__(self,
+                 get_prices_method: Callable[[], Tuple[DayPrices, DayPrices]],
+                 hourly_schedule: HourlySchedule2days,
+                 period_split: int,
+                 max_total_cost: float,
+                 max_periods_to_run: int,
+                 min_periods_to_run: int):
+        """
+        :param get_prices_method: prices today and tomorrow, tomorrow None if not known yet
+        :param hourly_schedule: schedule the plan is written to, its devices are checked for periods run
+        :param period_split: length of a planning window
+        :param max_total_cost: maximum sum of prices of on periods in a window
+        :param max_periods_to_run: maximum on periods in a window
+        :param min_periods_to_run: minimum on periods in a window, higher priority than max_total_cost
+        """
+        self._get_prices_method = get_prices_method
+        self._hourly_schedule = hourly_schedule
+        self._period_split = period_split
+        self._max_total_cost = max_total_cost
+        self._max_periods_to_run = max_periods_to_run
+        self._min_periods_to_run = min_periods_to_run
+        # Planning windows, oldest first: {"start", "end" absolute periods, "on_periods": set of absolute periods}
+        self._windows = []
+        # Absolute period: [samples with device on, samples]
+        self._device_samples = {}
+        self._current_period = None
+        self._stats = {"replans": 0, "windows_planned": 0, "skipped": 0, "last_replan_ms": 0.0,
+                       "max_replan_ms": 0.0}
+
+    def set_parameters(self, period_split: int, max_total_cost: float, max_periods_to_run: int,
+                       min_periods_to_run: int) -> None:
+        self._period_split = period_split
+        self._max_total_cost = max_total_cost
+        self._max_periods_to_run = max_periods_to_run
+        self._min_periods_to_run = min_periods_to_run
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget the plan, the full horizon is planned on the next loop
+        """
+        self._windows = []
+        self._current_period = None
+
+    def get_stats(self) -> dict:
+        return dict(self._stats)
+
+    def loop(self, now: datetime.datetime = None) -> None:
+        now = datetime.datetime.now() if now is None else now
+        period = get_absolute_period(now.date(), now.hour * 4 + now.minute // 15)
+        if period != self._current_period:
+            self._current_period = period
+            self.replan(period)
+        samples = self._device_samples.setdefault(period, [0, 0])
+        samples[0] += self.get_device_on()
+        samples[1] += 1
+
+    def get_device_on(self) -> bool:
+        if not self._hourly_schedule or not self._hourly_schedule.device_list:
+            return False
+        return any(self.get_reported_on(dev) for dev in self._hourly_schedule.device_list)
+
+    @staticmethod
+    def get_reported_on(dev) -> bool:
+        """
+        :return: output state reported by the device, the command if the device reports no state or is offline
+        """
+        if getattr(dev, "state_online", False) and hasattr(dev, "state_off_on"):
+            return dev.state_off_on
+        return dev.get_cmd_given()
+
+    def has_run(self, period: int) -> bool:
+        """
+        :return: True if the device was on for most of the period
+        """
+        on_samples, samples = self._device_samples.get(period, (0, 0))
+        return on_samples * 2 > samples
+
+    def replan(self, period: int) -> None:
+        """
+        Add windows for new prices and plan the current window again if it was not run as planned
+        :param period: absolute period starting now
+        """
+        time_start = time.perf_counter()
+        prices = self.get_prices_by_period()
+        # Finished windows and their device samples are not needed
+        self._windows = [window for window in self._windows if window["end"] > period]
+        horizon_start = self._windows[0]["start"] if self._windows else period
+        self._device_samples = {sample_period: samples for sample_period, samples in self._device_samples.items()
+                                if sample_period >= horizon_start}
+        changed_windows = []
+        # Windows for all full split periods with known prices
+        window_start = self._windows[-1]["end"] if self._windows else period
+        while all(window_period in prices for window_period in range(window_start, window_start + self._period_split)):
+            window = {"start": window_start, "end": window_start + self._period_split, "on_periods": set()}
+            self.plan_window(window, period, prices)
+            self._windows.append(window)
+            changed_windows.append(window)
+            window_start = window["end"]
+        for window in self._windows:
+            if window in changed_windows or window["start"] >= period:
+                continue
+            # Window in progress, plan again if the periods run differ from the plan
+            ran = {past for past in range(window["start"], period) if self.has_run(past)}
+            planned = {past for past in window["on_periods"] if past < period}
+            if ran == planned:
+                self._stats["skipped"] += 1
+                continue
+            logger.debug(f"Periods run {sorted(ran)} differ from planned {sorted(planned)}, planning again")
+            self.plan_window(window, period, prices)
+            changed_windows.append(window)
+        if changed_windows:
+            self.write_schedule(changed_windows, period)
+        time_taken_ms = (time.perf_counter() - time_start) * 1000
+        self._stats["replans"] += 1
+        self._stats["last_replan_ms"] = time_taken_ms
+        self._stats["max_replan_ms"] = max(self._stats["max_replan_ms"], time_taken_ms)
+
+    def plan_window(self, window: dict, period: int, prices: Dict[int, float]) -> None:
+        """
+        Plan the rest of the window, periods already run count towards the requirements of the window
+        :param window: window to plan
+        :param period: absolute period starting now
+        :param prices: {absolute period: price}
+        """
+        plan_start = max(window["start"], period)
+        ran = [past for past in range(window["start"], plan_start) if self.has_run(past)]
+        cost_spent = sum(prices.get(past, 0.0) for past in ran)
+        upcoming_prices = [prices[future] for future in range(plan_start, window["end"])]
+        run_list = ScheduleCreator.find_cheapest_periods_to_run_in(self._max_total_cost - cost_spent,
+                                                                   max(0, self._max_periods_to_run - len(ran)),
+                                                                   max(0, self._min_periods_to_run - len(ran)),
+                                                                   upcoming_prices)
+        window["on_periods"] = set(ran) | {plan_start + i for i, on in enumerate(run_list) if on}
+        self._stats["windows_planned"] += 1
+
+    def get_prices_by_period(self) -> Dict[int, float]:
+        """
+        :return: {absolute period: price} of today and tomorrow, if known
+        """
+        prices = {}
+        for day_prices in self._get_prices_method():
+            if not day_prices:
+                continue
+            for period in range(PERIODS_PER_DAY):
+                price = day_prices.get_price_by_period_number(period)
+                if price is not None:
+                    prices[get_absolute_period(day_prices.date, period)] = price
+        return prices
+
+    def write_schedule(self, windows: list, period: int) -> None:
+        """
+        Write the upcoming periods of the windows to the hourly schedule
+        """
+        if not self._hourly_schedule:
+            logger.warning("No schedule assigned to rolling horizon planner")
+            return
+        schedule_date = self._hourly_schedule.datetime_now
+        schedules = {schedule_date: dict(self._hourly_schedule.schedule_today),
+                     schedule_date + datetime.timedelta(days=1): dict(self._hourly_schedule.schedule_tomorrow)}
+        changed_dates = set()
+        for window in windows:
+            for future in range(max(window["start"], period), window["end"]):
+                date, day_period = get_date_and_period(future)
+                if date not in schedules:
+                    continue
+                on = future in window["on_periods"]
+                if schedules[date][day_period] != on:
+                    schedules[date][day_period] = on
+                    changed_dates.add(date)
+        for date in changed_dates:
+            self._hourly_schedule.set_schedule_full_day(today_tomorrow=date != schedule_date,
+                                                        schedule=schedules[date])
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,318 @@
+"""
+Backtesting of schedule strategies over historical prices
+A strategy is a set of AutoScheduleCreator parameters. For every day of the price history the daily schedule creation is
+repeated like AutoScheduleCreator does it: at the calculation time the next 96 periods are planned with
+ScheduleCreator from today's and tomorrow's prices. Each run replaces the rest of the previous one, so the runs follow
+each other and together are the schedule that would have been executed.
+Prices of all days are kept in one flat array, each run only takes a slice of it. Strategies are run in parallel in a
+process pool.
+"""
+import datetime
+import logging
+import math
+import os
+import random
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Tuple
+from helpers.database_mngr import DbMngr
+from helpers.price_file_manager import PriceFileManager
+from schedules.auto_schedule_creator import AutoScheduleCreator
+from schedules.schedule_creator import ScheduleCreator
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "schedule_backtest.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+PERIODS_PER_DAY = 96
+# Period the daily schedule starts at with the default AutoScheduleCreator calculation time of 16:50
+DEFAULT_START_PERIOD = 16 * 4 + 50 // 15 + 1
+
+# Where main_fc reads historical prices from, synthetic prices are used if the source has none
+PRICE_SOURCE_DB = "db"
+PRICE_SOURCE_FILES = "files"
+PRICE_SOURCE_SYNTHETIC = "synthetic"
+PRICE_SOURCE = PRICE_SOURCE_FILES
+# Days of prices read from the database, counted back from today
+DB_PRICE_DAYS = 365
+# AutoScheduleCreator parameters to backtest, every combination is a strategy
+STRATEGY_GRID = {
+    "period_split": AutoScheduleCreator.ALLOWED_PERIODS,
+    "max_total_cost": [300.0, 600.0, 1e9],
+    # (min_periods_to_run, max_periods_to_run)
+    "run_periods": [(4, 8), (8, 20)],
+}
+
+
+def main_fc():
+    history = get_price_history(PRICE_SOURCE)
+    print(f"Prices of {history.get_days_with_prices()} days from {history.first_date}")
+    time_start = time.perf_counter()
+    results = run_backtest(history, get_strategies(STRATEGY_GRID))
+    print_report(results)
+    print(f"Backtest took {time.perf_counter() - time_start:.1f} s")
+
+
+def get_price_history(price_source: str = PRICE_SOURCE) -> 'PriceHistory':
+    """
+    :param price_source: PRICE_SOURCE_DB, PRICE_SOURCE_FILES or PRICE_SOURCE_SYNTHETIC
+    :return: prices of the source, a synthetic year of prices if it has none
+    """
+    daily_prices = {}
+    if price_source == PRICE_SOURCE_DB:
+        end_date = datetime.date.today()
+        try:
+            db_mngr = DbMngr()
+        except sqlite3.Error as e:
+            logger.error(f"Unable to open the database. Error: {e}")
+        else:
+            daily_prices = get_prices_from_db(db_mngr, end_date - datetime.timedelta(days=DB_PRICE_DAYS), end_date)
+            db_mngr.stop()
+    elif price_source == PRICE_SOURCE_FILES and os.path.isdir(settings.PRICE_FILE_LOCATION):
+        daily_prices = get_prices_from_files(settings.PRICE_FILE_LOCATION)
+    if not daily_prices:
+        if price_source != PRICE_SOURCE_SYNTHETIC:
+            logger.warning(f"No prices from {price_source}, using a synthetic year of prices")
+        daily_prices = get_synthetic_prices()
+    return PriceHistory(daily_prices)
+
+
+class PriceHistory:
+    """
+    Prices of consecutive days in one flat array of 15 min periods
+    """
+
+    def __init__(self, daily_prices: Dict[datetime.date, List[float]]):
+        """
+        :param daily_prices: date: 96 prices, days without prices are allowed
+        """
+        self.first_date = min(daily_prices) if daily_prices else datetime.date.today()
+        last_date = max(daily_prices) if daily_prices else self.first_date
+        self.days = (last_date - self.first_date).days + 1
+        self.prices = array('d', bytes(8 * PERIODS_PER_DAY * self.days))
+        self.has_prices = bytearray(self.days)
+        for date, prices in daily_prices.items():
+            day = (date - self.first_date).days
+            self.prices[day * PERIODS_PER_DAY:(day + 1) * PERIODS_PER_DAY] = array('d', prices)
+            self.has_prices[day] = 1
+
+    def get_days_with_prices(self) -> int:
+        return sum(self.has_prices)
+
+
+def get_prices_from_db(db_mngr: DbMngr, start_date: datetime.date, end_date: datetime.date) \
+        -> Dict[datetime.date, List[float]]:
+    """
+    The prices table holds hourly prices, each hour price is used for its 4 periods
+    :return: date: 96 prices, only days with prices for all hours
+    """
+    daily_prices = {}
+    for date, hour_prices in db_mngr.get_prices(start_date, end_date).items():
+        if len(hour_prices) != 24:
+            logger.warning(f"Prices of {len(hour_prices)} hours on {date}, day not used")
+            continue
+        daily_prices[date] = [hour_prices[period // 4] for period in range(PERIODS_PER_DAY)]
+    return daily_prices
+
+
+def get_prices_from_files(file_loc: str, start_date: datetime.date = None, end_date: datetime.date = None) \
+        -> Dict[datetime.date, List[float]]:
+    """
+    :param file_loc: folder of price files
+    :return: date: 96 prices, only days with all prices
+    """
+    price_file_manager = PriceFileManager(file_loc)
+    daily_prices = {}
+    for file_name in os.listdir(file_loc):
+        try:
+            date = datetime.datetime.strptime(file_name, "%Y_%m_%d" + PriceFileManager.PRICE_FILE_EXTENSION).date()
+        except ValueError:
+            continue
+        if (start_date and date < start_date) or (end_date and date > end_date):
+            continue
+        try:
+            day_prices = price_file_manager.get_prices_from_file(price_file_manager.create_date_file_path(date), date)
+        except ValueError as e:
+            logger.warning(f"Skipping price file of {date}: {e}")
+            continue
+        prices = [day_prices.get_price_by_period_number(period) for period in range(PERIODS_PER_DAY)]
+        if None in prices:
+            logger.warning(f"Missing prices in file of {date}, day not used")
+            continue
+        daily_prices[date] = prices
+    return daily_prices
+
+
+def get_synthetic_prices(days: int = 365, seed: int = 1) -> Dict[datetime.date, List[float]]:
+    """
+    :return: date: 96 prices with a cheap night, morning and evening peaks, changing over the year
+    """
+    rng = random.Random(seed)
+    first_date = datetime.date(2025, 1, 1)
+    daily_prices = {}
+    for day in range(days):
+        level = 80 + 50 * math.cos(day * 2 * math.pi / 365) + rng.gauss(0, 20)
+        daily_prices[first_date + datetime.timedelta(days=day)] = \
+            [level + 40 * math.sin((period - 28) * math.pi / 48) + 30 * math.exp(-((period - 76) / 8) ** 2) +
+             rng.gauss(0, 10) for period in range(PERIODS_PER_DAY)]
+    return daily_prices
+
+
+def get_strategies(grid: dict) -> Dict[str, dict]:
+    """
+    :return: strategy name: get_run_list_from_prices parameters, one for each combination of the grid
+    """
+    strategies = {}
+    for split in grid["period_split"]:
+        for max_total_cost in grid["max_total_cost"]:
+            for min_periods, max_periods in grid["run_periods"]:
+                name = f"split {split} cost {max_total_cost:g} run {min_periods}-{max_periods}"
+                strategies[name] = {"period_split": split, "max_total_cost": max_total_cost,
+                                    "max_periods_to_run": max_periods, "min_periods_to_run": min_periods}
+    return strategies
+
+
+def backtest_strategy(history: PriceHistory,
+                      strategy: dict,
+                      start_period: int = DEFAULT_START_PERIOD,
+                      device_power_kw: float = 1.0,
+                      on_power_kw: List[float] = None) -> dict:
+    """
+    :param history: prices to run the strategy over
+    :param strategy: get_run_list_from_prices parameters
+    :param start_period: first period of each daily run, the period after the calculation time
+    :param device_power_kw: power of the device when on, used for the energy cost
+    :param on_power_kw: measured power of the device for each period of the day when on, overrides device_power_kw
+    :return: summary dictionary, costs are sums of period prices like max_total_cost, energy_cost with the power
+    """
+    time_start = time.perf_counter()
+    period_split = strategy["period_split"]
+    max_total_cost = strategy["max_total_cost"]
+    max_periods_to_run = strategy["max_periods_to_run"]
+    min_periods_to_run = strategy["min_periods_to_run"]
+    on_power_kw = on_power_kw if on_power_kw else [device_power_kw] * PERIODS_PER_DAY
+    result = {"runs": 0, "missing_runs": 0, "on_periods": 0, "total_cost": 0.0, "energy_cost": 0.0,
+              "average_price_cost": 0.0, "min_periods_violations": 0, "max_periods_violations": 0,
+              "max_total_cost_violations": 0}
+    daily_on_periods = [0] * history.days
+    run_made = [False] * history.days
+    # A run needs prices of its day and the next day
+    for day in range(history.days - 1):
+        if not (history.has_prices[day] and history.has_prices[day + 1]):
+            result["missing_runs"] += 1
+            continue
+        result["runs"] += 1
+        run_made[day] = True
+        run_start = day * PERIODS_PER_DAY + start_period
+        prices = history.prices[run_start:run_start + PERIODS_PER_DAY].tolist()
+        run_list = ScheduleCreator.get_run_list_from_prices(prices, **strategy)
+        for window_start in range(0, len(run_list), period_split):
+            window_prices = prices[window_start:window_start + period_split]
+            window_on = run_list[window_start:window_start + period_split]
+            on_periods = sum(window_on)
+            cost = sum(price for price, on in zip(window_prices, window_on) if on)
+            result["on_periods"] += on_periods
+            result["total_cost"] += cost
+            # Cost of running the same number of periods at random times of the window
+            result["average_price_cost"] += on_periods * sum(window_prices) / len(window_prices)
+            result["min_periods_violations"] += on_periods < min(min_periods_to_run, period_split)
+            result["max_periods_violations"] += on_periods > max_periods_to_run
+            # Going over the cost limit is allowed only to run the minimum periods
+            result["max_total_cost_violations"] += cost > max_total_cost and on_periods > min_periods_to_run
+        for i, on in enumerate(run_list):
+            if on:
+                period = run_start + i
+                daily_on_periods[period // PERIODS_PER_DAY] += 1
+                # Prices per MWh, periods of 15 min
+                result["energy_cost"] += prices[i] / 1000 * on_power_kw[period % PERIODS_PER_DAY] * 0.25
+    # Days fully covered by the runs of the day before and of the day itself
+    run_days = [daily_on_periods[day] for day in range(1, history.days) if run_made[day - 1] and run_made[day]]
+    result["runtime_h"] = result["on_periods"] / 4
+    result["savings"] = result["average_price_cost"] - result["total_cost"]
+    result["min_daily_runtime_h"] = min(run_days) / 4 if run_days else 0.0
+    result["wall_time_s"] = time.perf_counter() - time_start
+    return result
+
+
+# Price history of a worker process, set once when the worker starts instead of sending it with every strategy
+_worker_history = None
+
+
+def _set_worker_history(history: PriceHistory) -> None:
+    global _worker_history
+    _worker_history = history
+
+
+def _backtest_strategy_in_worker(strategy: dict, start_period: int, device_power_kw: float,
+                                 on_power_kw: List[float]) -> dict:
+    return backtest_strategy(_worker_history, strategy, start_period, device_power_kw, on_power_kw)
+
+
+def run_backtest(history: PriceHistory,
+                 strategies: Dict[str, dict],
+                 start_period: int = DEFAULT_START_PERIOD,
+                 device_power_kw: float = 1.0,
+                 on_power_kw: List[float] = None,
+                 max_workers: int = None) -> Dict[str, dict]:
+    """
+    Parameters as in iterate_backtest
+    :return: strategy name: summary dictionary of backtest_strategy, in the order of strategies
+    """
+    results = dict(iterate_backtest(history, strategies, start_period, device_power_kw, on_power_kw, max_workers))
+    return {name: results[name] for name in strategies}
+
+
+def iterate_backtest(history: PriceHistory,
+                     strategies: Dict[str, dict],
+                     start_period: int = DEFAULT_START_PERIOD,
+                     device_power_kw: float = 1.0,
+                     on_power_kw: List[float] = None,
+                     max_workers: int = None) -> Iterator[Tuple[str, dict]]:
+    """
+    :param history: prices to run the strategies over
+    :param strategies: strategy name: get_run_list_from_prices parameters
+    :param start_period: first period of each daily run
+    :param device_power_kw: power of the device when on
+    :param on_power_kw: measured power for each period of the day when on, overrides device_power_kw
+    :param max_workers: processes to use, all cores if None, 1 to run in this process
+    :return: strategy name and summary dictionary of backtest_strategy, as soon as each strategy is finished
+    """
+    if max_workers == 1 or len(strategies) <= 1:
+        for name, strategy in strategies.items():
+            yield name, backtest_strategy(history, strategy, start_period, device_power_kw, on_power_kw)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_set_worker_history,
+                             initargs=(history,)) as executor:
+        futures = {executor.submit(_backtest_strategy_in_worker, strategy, start_period, device_power_kw,
+                                   on_power_kw): name
+                   for name, strategy in strategies.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def print_report(results: Dict[str, dict]) -> None:
+    print(f"{'strategy':32}{'runs':>6}{'runtime h':>11}{'min day h':>11}{'total cost':>13}{'savings':>11}"
+          f"{'energy cost':>13}{'min viol':>10}{'max viol':>10}{'cost viol':>11}")
+    for name, result in results.items():
+        print(f"{name:32}{result['runs']:>6}{result['runtime_h']:>11.1f}{result['min_daily_runtime_h']:>11.2f}"
+              f"{result['total_cost']:>13.1f}{result['savings']:>11.1f}{result['energy_cost']:>13.2f}"
+              f"{result['min_periods_violations']:>10}{result['max_periods_violations']:>10}"
+              f"{result['max_total_cost_violations']:>11}")
+
+
+if __name__ == '__main__':
+    main_fc()
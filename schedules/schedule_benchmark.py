@@ -0,0 +1,270 @@
+"""
+Benchmark and regression check of schedule optimizers
+Runs schedule solvers over a corpus of price pairs for today and tomorrow and a grid of AutoScheduleCreator parameters.
+Reports wall time and cost of the schedules of each solver and how they differ from a reference solver, so a faster
+optimizer can be shown not to change schedules. The corpus is synthetic price days: normal, negative, spiking, flat and
+hourly stepped prices, and optionally real price files.
+"""
+import datetime
+import itertools
+import logging
+import math
+import os
+import random
+import time
+from typing import Callable, Dict, List, Tuple
+from helpers.price_file_manager import PriceFileManager
+from helpers.price_objects import DayPrices
+from schedules.auto_schedule_creator import AutoScheduleCreator
+from schedules.joint_scheduler import JointScheduler, JointScheduleDevice
+from schedules.schedule_creator import ScheduleCreator
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "schedule_benchmark.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+# Price pair name, prices today, prices tomorrow
+PricePair = Tuple[str, DayPrices, DayPrices]
+# Creates schedules today and tomorrow from a price pair and get_schedule_from_prices_v2 parameters
+ScheduleSolver = Callable[[DayPrices, DayPrices, dict], Tuple[dict, dict]]
+
+# Parameters of get_schedule_from_prices_v2 to check, every combination is run
+PARAMETER_GRID = {
+    "period_split": AutoScheduleCreator.ALLOWED_PERIODS,
+    "max_total_cost": [150.0, 1e9],
+    # (min_periods_to_run, max_periods_to_run)
+    "run_periods": [(0, 4), (4, 8), (8, 20)],
+    # First period of today scheduled, early morning and afternoon
+    "start_period": [1, 57],
+}
+
+
+def main_fc():
+    corpus = get_synthetic_price_corpus()
+    if os.path.isdir(settings.PRICE_FILE_LOCATION):
+        corpus.extend(get_price_file_corpus(settings.PRICE_FILE_LOCATION))
+    print_report(run_benchmark(corpus))
+
+
+def get_reference_periods_to_run_in(max_total_cost: float,
+                                    max_periods_to_run: int,
+                                    min_periods_to_run: int,
+                                    upcoming_prices: List[float]) -> List[bool]:
+    """
+    Same rules as ScheduleCreator.find_cheapest_periods_to_run_in, with the best one or two chunks for each number of
+    periods found with find_n_smallest_items_in_list_v2
+    """
+    periods_ahead_to_calculate = len(upcoming_prices)
+    nr_of_on_periods = min(max_periods_to_run, periods_ahead_to_calculate)
+    while nr_of_on_periods > 0:
+        indices, values = ScheduleCreator.find_n_smallest_items_in_list_v2(upcoming_prices, nr_of_on_periods)
+        if sum(values) <= max_total_cost or nr_of_on_periods == min_periods_to_run:
+            return [x in indices for x in range(periods_ahead_to_calculate)]
+        nr_of_on_periods -= 1
+    return [False] * periods_ahead_to_calculate
+
+
+def get_joint_single_device_periods_to_run_in(max_total_cost: float,
+                                              max_periods_to_run: int,
+                                              min_periods_to_run: int,
+                                              upcoming_prices: List[float]) -> List[bool]:
+    """
+    JointScheduler with one device and no power limit, should give the same costs as the reference
+    """
+    device = JointScheduleDevice("benchmark", power_w=1000, max_periods_to_run=max_periods_to_run,
+                                 min_periods_to_run=min_periods_to_run, max_total_cost=max_total_cost,
+                                 max_blocks=ScheduleCreator.MAX_CHUNKS, min_gap=ScheduleCreator.MIN_CHUNK_GAP)
+    return JointScheduler([device], power_limit_w=math.inf).find_joint_run_lists(upcoming_prices)[device.name]
+
+
+# Solver name: solver, compared with the reference solver
+SOLVERS: Dict[str, ScheduleSolver] = {
+    "reference": lambda today, tomorrow, params: ScheduleCreator.get_schedule_from_prices_v2(
+        today, tomorrow, find_periods_method=get_reference_periods_to_run_in, **params),
+    # Without cache, so repeated runs measure the optimizer
+    "v2": lambda today, tomorrow, params: ScheduleCreator.get_schedule_from_prices_v2(today, tomorrow,
+                                                                                      use_cache=False, **params),
+    "v2_blocks": lambda today, tomorrow, params: ScheduleCreator.get_schedule_from_prices_v2(
+        today, tomorrow, max_blocks=ScheduleCreator.MAX_CHUNKS, min_gap=ScheduleCreator.MIN_CHUNK_GAP,
+        use_cache=False, **params),
+    "joint_single_device": lambda today, tomorrow, params: ScheduleCreator.get_schedule_from_prices_v2(
+        today, tomorrow, find_periods_method=get_joint_single_device_periods_to_run_in, **params),
+}
+
+
+def get_day_prices(price_date: datetime.date, prices: List[float]) -> DayPrices:
+    day_prices = DayPrices(price_date)
+    day_prices.load_from_flat_list([round(price, 3) for price in prices])
+    return day_prices
+
+
+def get_synthetic_price_corpus(seed: int = 1) -> List[PricePair]:
+    """
+    :return: price pairs with typical, negative, spiking, flat and hourly stepped prices
+    """
+    rng = random.Random(seed)
+    date_today = datetime.date(2025, 1, 1)
+    date_tomorrow = date_today + datetime.timedelta(days=1)
+
+    def typical_day() -> List[float]:
+        # Cheap night, morning and evening peaks
+        return [60 + 40 * math.sin((period - 28) * math.pi / 48) + 30 * math.exp(-((period - 76) / 8) ** 2) +
+                rng.gauss(0, 8) for period in range(96)]
+
+    def negative_day() -> List[float]:
+        # Solar surplus, prices below zero around noon
+        return [40 - 70 * math.exp(-((period - 52) / 10) ** 2) + rng.gauss(0, 5) for period in range(96)]
+
+    def spike_day() -> List[float]:
+        prices = typical_day()
+        for period in rng.sample(range(96), 6):
+            prices[period] += rng.uniform(300, 1500)
+        return prices
+
+    def hourly_day() -> List[float]:
+        # Same price for all quarters of an hour, many equal cost combinations
+        return [price for price in typical_day()[::4] for _ in range(4)]
+
+    return [("typical", get_day_prices(date_today, typical_day()), get_day_prices(date_tomorrow, typical_day())),
+            ("negative", get_day_prices(date_today, negative_day()), get_day_prices(date_tomorrow, negative_day())),
+            ("spikes", get_day_prices(date_today, spike_day()), get_day_prices(date_tomorrow, spike_day())),
+            ("flat", get_day_prices(date_today, [50.0] * 96), get_day_prices(date_tomorrow, [50.0] * 96)),
+            ("hourly", get_day_prices(date_today, hourly_day()), get_day_prices(date_tomorrow, hourly_day())),
+            ("random", get_day_prices(date_today, [rng.uniform(-20, 300) for _ in range(96)]),
+             get_day_prices(date_tomorrow, [rng.uniform(-20, 300) for _ in range(96)]))]
+
+
+def get_price_file_corpus(file_loc: str, max_pairs: int = 30) -> List[PricePair]:
+    """
+    :param file_loc: folder of price files
+    :param max_pairs: newest number of consecutive day pairs to use
+    :return: price pairs of consecutive days that both have a price file
+    """
+    price_file_manager = PriceFileManager(file_loc)
+    dates = []
+    for file_name in os.listdir(file_loc):
+        try:
+            dates.append(datetime.datetime.strptime(file_name, "%Y_%m_%d" + PriceFileManager.PRICE_FILE_EXTENSION).date())
+        except ValueError:
+            continue
+    dates = set(dates)
+    corpus = []
+    for price_date in sorted(dates, reverse=True):
+        next_date = price_date + datetime.timedelta(days=1)
+        if next_date not in dates:
+            continue
+        try:
+            prices_today = price_file_manager.get_prices_from_file(
+                price_file_manager.create_date_file_path(price_date), price_date)
+            prices_tomorrow = price_file_manager.get_prices_from_file(
+                price_file_manager.create_date_file_path(next_date), next_date)
+        except ValueError as e:
+            logger.warning(f"Skipping price file of {price_date}: {e}")
+            continue
+        if prices_today and prices_tomorrow:
+            corpus.append((f"file {price_date}", prices_today, prices_tomorrow))
+        if len(corpus) >= max_pairs:
+            break
+    return corpus
+
+
+def get_schedule_cost(prices_today: DayPrices, prices_tomorrow: DayPrices,
+                      schedule_today: dict, schedule_tomorrow: dict) -> float:
+    """
+    :return: sum of prices of on periods
+    """
+    return sum(prices_today.get_price_by_period_number(period) for period, on in schedule_today.items() if on) + \
+        sum(prices_tomorrow.get_price_by_period_number(period) for period, on in schedule_tomorrow.items() if on)
+
+
+def get_parameter_combinations(grid: dict) -> List[dict]:
+    """
+    :return: list of get_schedule_from_prices_v2 parameters, one for each combination of the grid
+    """
+    combinations = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid.keys(), values))
+        params["min_periods_to_run"], params["max_periods_to_run"] = params.pop("run_periods")
+        combinations.append(params)
+    return combinations
+
+
+def run_benchmark(corpus: List[PricePair],
+                  solvers: Dict[str, ScheduleSolver] = None,
+                  grid: dict = None,
+                  reference: str = "reference",
+                  cost_tolerance: float = 1e-6) -> dict:
+    """
+    :param corpus: price pairs to create schedules for
+    :param solvers: solvers to run, SOLVERS if None
+    :param grid: parameters to run, PARAMETER_GRID if None
+    :param reference: name of the solver the others are compared with
+    :param cost_tolerance: cost differences up to this are rounding
+    :return: {solver name: summary dictionary}
+    """
+    solvers = SOLVERS if solvers is None else solvers
+    combinations = get_parameter_combinations(PARAMETER_GRID if grid is None else grid)
+    results = {name: {"cases": 0, "wall_time_s": 0.0, "max_time_ms": 0.0, "total_cost": 0.0, "on_periods": 0,
+                      "cost_differences": 0, "cheaper": 0, "schedule_differences": 0, "max_cost_difference": 0.0,
+                      "first_cost_difference": None}
+               for name in solvers}
+    for (pair_name, prices_today, prices_tomorrow), params in itertools.product(corpus, combinations):
+        schedules = {}
+        for name, solver in solvers.items():
+            time_start = time.perf_counter()
+            schedules[name] = solver(prices_today, prices_tomorrow, params)
+            time_taken = time.perf_counter() - time_start
+            result = results[name]
+            result["cases"] += 1
+            result["wall_time_s"] += time_taken
+            result["max_time_ms"] = max(result["max_time_ms"], time_taken * 1000)
+        if reference not in schedules:
+            continue
+        reference_cost = get_schedule_cost(prices_today, prices_tomorrow, *schedules[reference])
+        reference_on = [on for schedule in schedules[reference] for on in schedule.values()]
+        for name, (schedule_today, schedule_tomorrow) in schedules.items():
+            result = results[name]
+            cost = get_schedule_cost(prices_today, prices_tomorrow, schedule_today, schedule_tomorrow)
+            on = list(schedule_today.values()) + list(schedule_tomorrow.values())
+            result["total_cost"] += cost
+            result["on_periods"] += sum(on)
+            if on != reference_on:
+                # Equal cost but other periods are ties
+                result["schedule_differences"] += 1
+            if abs(cost - reference_cost) > cost_tolerance:
+                result["cost_differences"] += 1
+                result["cheaper"] += cost < reference_cost
+                result["max_cost_difference"] = max(result["max_cost_difference"], abs(cost - reference_cost))
+                if result["first_cost_difference"] is None:
+                    result["first_cost_difference"] = {"prices": pair_name, **params, "cost": cost,
+                                                       "reference_cost": reference_cost}
+    for result in results.values():
+        result["mean_time_ms"] = result["wall_time_s"] * 1000 / result["cases"] if result["cases"] else 0.0
+    return results
+
+
+def print_report(results: dict) -> None:
+    print(f"{'solver':22}{'cases':>7}{'mean ms':>9}{'max ms':>9}{'total cost':>13}{'on periods':>12}"
+          f"{'cost diff':>11}{'cheaper':>9}{'sched diff':>12}")
+    for name, result in results.items():
+        print(f"{name:22}{result['cases']:>7}{result['mean_time_ms']:>9.2f}{result['max_time_ms']:>9.2f}"
+              f"{result['total_cost']:>13.1f}{result['on_periods']:>12}{result['cost_differences']:>11}"
+              f"{result['cheaper']:>9}{result['schedule_differences']:>12}")
+        if result["first_cost_difference"]:
+            print(f"    first cost difference: {result['first_cost_difference']}")
+
+
+if __name__ == '__main__':
+    main_fc()
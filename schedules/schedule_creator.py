@@ -1,10 +1,13 @@
 import datetime
-from typing import List, Tuple
+import random
+from typing import Callable, List, Tuple, Dict
 import heapq
+import itertools
 import logging
 import os
 import time
 import settings
+from helpers.lru_cache import LruCache
 from helpers.price_objects import DayPrices
 
 # Setup logging
@@ -25,6 +28,8 @@ logger.addHandler(file_handler)
 
 
 def test():
+    test_find_n_smallest_items_equivalence()
+    test_find_cheapest_blocks()
     start_time = time.perf_counter()
     # schedule_today, schedule_tomorrow = ScheduleCreator.get_schedule_from_prices_v2(prices_today=fake_prices_today,
     #                                                                                 prices_tomorrow=fake_prices_tomorrow,
@@ -40,10 +45,80 @@ def test():
     logger.debug(f"Calculations took {time_taken}s")
 
 
+def test_find_n_smallest_items_equivalence(runs: int = 300, seed: int = 1):
+    """
+    Compare the fast two chunk search with the brute force search on random price vectors
+    Rounded prices and narrow ranges give many equal cost combinations, so tie breaking is checked too.
+    """
+    rng = random.Random(seed)
+    time_fast, time_brute_force = 0.0, 0.0
+    for run in range(runs):
+        length = rng.choice([1, 2, 5, 8, 24, 32, 48, 96])
+        price_range = rng.choice([(0.0, 1.0), (-5.0, 5.0), (0.0, 300.0)])
+        decimals = rng.choice([0, 1, 4])
+        items = [round(rng.uniform(*price_range), decimals) for _ in range(length)]
+        n = rng.randint(0, length + 1)
+        time_start = time.perf_counter()
+        result_fast = ScheduleCreator.find_n_smallest_items_in_list_v2(items, n)
+        time_fast += time.perf_counter() - time_start
+        time_start = time.perf_counter()
+        result_brute_force = ScheduleCreator.find_n_smallest_items_in_list_v2_brute_force(items, n)
+        time_brute_force += time.perf_counter() - time_start
+        assert result_fast == result_brute_force, f"Different result for n={n} items={items}: " \
+                                                  f"{result_fast} != {result_brute_force}"
+    logger.info(f"{runs} random price vectors equal, fast {time_fast:.3f}s, brute force {time_brute_force:.3f}s")
+
+
+def test_find_cheapest_blocks(runs: int = 200, seed: int = 1):
+    """
+    Compare the block optimizer with checking every on off combination of short random price vectors
+    """
+    rng = random.Random(seed)
+    for run in range(runs):
+        length = rng.randint(1, 12)
+        prices = [round(rng.uniform(-2.0, 10.0), rng.choice([0, 2])) for _ in range(length)]
+        available = [rng.random() > 0.15 for _ in range(length)]
+        max_blocks, min_block_length, min_gap = rng.randint(0, 3), rng.randint(1, 3), rng.randint(0, 3)
+        plans = ScheduleCreator.find_cheapest_blocks_for_each_n(prices, length, max_blocks, min_block_length,
+                                                                min_gap, available)
+        best_costs = {}
+        for combination in range(2 ** length):
+            on = [bool(combination >> i & 1) for i in range(length)]
+            if not all(available[i] for i in range(length) if on[i]):
+                continue
+            # Lengths of on blocks and off gaps between them
+            blocks = [len(list(group)) for on_off, group in itertools.groupby(on) if on_off]
+            gaps = [len(list(group)) for on_off, group in itertools.groupby(on) if not on_off]
+            gaps = gaps[1:] if on and not on[0] else gaps
+            gaps = gaps[:len(blocks) - 1]
+            if len(blocks) > max_blocks or any(block < min_block_length for block in blocks) or \
+                    any(gap < min_gap for gap in gaps):
+                continue
+            n = sum(on)
+            cost = sum(price for price, on_off in zip(prices, on) if on_off)
+            best_costs[n] = min(best_costs.get(n, float("inf")), cost)
+        assert set(plans.costs) == set(best_costs), f"Different feasible counts {sorted(plans.costs)} " \
+                                                     f"{sorted(best_costs)}"
+        for n, cost in plans.costs.items():
+            indices = plans.get_indices(n)
+            assert len(indices) == n and abs(cost - best_costs[n]) < 1e-9, f"n={n} {cost} != {best_costs[n]}"
+            assert abs(sum(prices[i] for i in indices) - cost) < 1e-9
+    logger.info(f"{runs} random block optimizations equal to checking all combinations")
+
+
 class ScheduleCreator:
     """
     Class for creating on off schedules for devices according to electricity prices.
     """
+    # On periods of find_cheapest_periods_to_run_in are one chunk or two chunks separated by at least 2 periods
+    MAX_CHUNKS = 2
+    MIN_CHUNK_GAP = 2
+    # Schedules of recent prices and parameters, shared by all schedule creators
+    schedule_cache = LruCache(max_size=32)
+
+    @staticmethod
+    def get_cache_stats() -> dict:
+        return ScheduleCreator.schedule_cache.get_stats()
 
     @staticmethod
     def get_schedule_from_prices_v2(prices_today: DayPrices,
@@ -52,7 +127,13 @@ class ScheduleCreator:
                                     periods_ahead_to_calculate=96,
                                     period_split: int = 32,
                                     max_periods_to_run: int = 7,
-                                    min_periods_to_run: int = 6) -> [dict, dict]:
+                                    min_periods_to_run: int = 6,
+                                    max_blocks: int = None,
+                                    min_block_length: int = 1,
+                                    min_gap: int = 2,
+                                    start_period: int = None,
+                                    find_periods_method: Callable[[float, int, int, List[float]], List[bool]] = None,
+                                    use_cache: bool = True) -> [dict, dict]:
         """
         Calculate best times to turn on an appliance in set time, full period split in smaller periods
         :param prices_today: DayPrices object electricity prices for each 15 min period today
@@ -63,6 +144,14 @@ class ScheduleCreator:
         :param max_periods_to_run: what is the maximum number of on hours for the device to be on
         :param min_periods_to_run: what is the minimum number of hours for the device to be on, This has higher priority
         than max_total_cost.
+        :param max_blocks: maximum number of contiguous on blocks in each split period, one or two blocks if None
+        :param min_block_length: minimum number of periods in a block, used if max_blocks set
+        :param min_gap: minimum number of off periods between blocks, used if max_blocks set
+        :param start_period: period of today the schedule starts from, the next period if None
+        :param find_periods_method: used for each split period instead of the built in search, same arguments as
+        find_cheapest_periods_to_run_in
+        :param use_cache: return the earlier result if prices from the start period and parameters are the same, not
+        used with find_periods_method
         :return: 2 dictionaries, one holding todays schedule, the other tomorrows. Each key in dict represents the hour
         in the day, each value True or False wether the device should be on or not
         """
@@ -76,27 +165,76 @@ class ScheduleCreator:
             return {i: False for i in range(96)}, {i: False for i in range(96)}
         logger.debug(f"Periods ahead to calculate {periods_ahead_to_calculate}")
         start_period, future_prices_list = ScheduleCreator.get_list_of_upcoming_prices(prices_today, prices_tomorrow,
-                                                                                     periods_ahead_to_calculate)
+                                                                                     periods_ahead_to_calculate,
+                                                                                     start_period)
         logger.debug(f"Future prices {future_prices_list}")
         logger.debug(f"period_split {period_split}")
-        # Split hours ahead in periods and calculate best hours to run for each period
-        nr_of_periods = min(periods_ahead_to_calculate, len(future_prices_list)) // period_split
-        logger.debug(f"nr_of_periods {nr_of_periods}")
-        run_list = []
-        for x in range(nr_of_periods):
-            future_prices_to_use = future_prices_list[(period_split * x):(period_split * x + period_split)]
-            temp_list = ScheduleCreator.find_cheapest_periods_to_run_in(max_total_cost, max_periods_to_run,
-                                                                        min_periods_to_run,
-                                                                        future_prices_to_use)
-            run_list.extend(temp_list)
-
+        cache_key = None
+        if use_cache and find_periods_method is None:
+            cache_key = (start_period, tuple(future_prices_list), periods_ahead_to_calculate, period_split,
+                         max_total_cost, max_periods_to_run, min_periods_to_run, max_blocks, min_block_length, min_gap)
+            cached_schedules = ScheduleCreator.schedule_cache.get(cache_key)
+            if cached_schedules is not None:
+                logger.info(f"Schedule from cache, {ScheduleCreator.schedule_cache.get_stats()}")
+                # Copies, schedules may be changed by the caller
+                return dict(cached_schedules[0]), dict(cached_schedules[1])
+        run_list = ScheduleCreator.get_run_list_from_prices(future_prices_list[:periods_ahead_to_calculate],
+                                                            period_split=period_split,
+                                                            max_total_cost=max_total_cost,
+                                                            max_periods_to_run=max_periods_to_run,
+                                                            min_periods_to_run=min_periods_to_run,
+                                                            max_blocks=max_blocks,
+                                                            min_block_length=min_block_length,
+                                                            min_gap=min_gap,
+                                                            find_periods_method=find_periods_method)
         schedule_today, schedule_tomorrow = ScheduleCreator.create_schedule_dicts_from_run_list(run_list, start_period)
+        if cache_key is not None:
+            ScheduleCreator.schedule_cache.put(cache_key, (dict(schedule_today), dict(schedule_tomorrow)))
         logger.info(f"Prices today {prices_today}")
         logger.info(f"Schedule today {schedule_today}")
         logger.info(f"Prices tomorrow {prices_tomorrow}")
         logger.info(f"Schedule tomorrow {schedule_tomorrow}")
         return schedule_today, schedule_tomorrow
 
+    @staticmethod
+    def get_run_list_from_prices(future_prices_list: List[float],
+                                 period_split: int,
+                                 max_total_cost: float,
+                                 max_periods_to_run: int,
+                                 min_periods_to_run: int,
+                                 max_blocks: int = None,
+                                 min_block_length: int = 1,
+                                 min_gap: int = 2,
+                                 find_periods_method: Callable[[float, int, int, List[float]], List[bool]] = None) \
+            -> List[bool]:
+        """
+        Split upcoming prices in periods of period_split and find the best periods to run in each of them
+        Parameters as in get_schedule_from_prices_v2
+        :param future_prices_list: prices of the upcoming periods, periods after the last full split are not run
+        :return: list of True or False for each period of the full splits
+        """
+        nr_of_periods = len(future_prices_list) // period_split
+        logger.debug(f"nr_of_periods {nr_of_periods}")
+        run_list = []
+        for x in range(nr_of_periods):
+            future_prices_to_use = future_prices_list[(period_split * x):(period_split * x + period_split)]
+            if find_periods_method is not None:
+                temp_list = find_periods_method(max_total_cost, max_periods_to_run, min_periods_to_run,
+                                                future_prices_to_use)
+            elif max_blocks is None:
+                temp_list = ScheduleCreator.find_cheapest_periods_to_run_in(max_total_cost, max_periods_to_run,
+                                                                            min_periods_to_run,
+                                                                            future_prices_to_use)
+            else:
+                temp_list = ScheduleCreator.find_cheapest_blocks_to_run_in(max_total_cost, max_periods_to_run,
+                                                                           min_periods_to_run,
+                                                                           future_prices_to_use,
+                                                                           max_blocks=max_blocks,
+                                                                           min_block_length=min_block_length,
+                                                                           min_gap=min_gap)
+            run_list.extend(temp_list)
+        return run_list
+
     @staticmethod
     def create_schedule_dicts_from_run_list(run_list, run_list_start_period):
         """
@@ -138,6 +276,9 @@ class ScheduleCreator:
                                         min_periods_to_run: int,
                                         upcoming_prices: list) -> [list]:
         """
+        Most on periods not costing more than max_total_cost, in one or two chunks
+        The cheapest combination for every number of on periods is found in one pass, so the best combination with
+        fewer periods is used when the cost is too high, not the best one with the most expensive period removed.
         :param max_total_cost: maximum total cost the device is allowed to use
         :param max_periods_to_run: what is the maximum number of on periods for the device to be on
         :param min_periods_to_run: what is the minimum number of periods for the device to be on, This has higher priority
@@ -150,11 +291,13 @@ class ScheduleCreator:
         # How many on hours to consider
         nr_of_on_hours = min(max_periods_to_run, periods_ahead_to_calculate)
         logger.debug(f"Finding lowest price combo for prices: {upcoming_prices}")
-        # Get the indicies and values for the cheapest prices in the list
-        indices, values = ScheduleCreator.find_n_smallest_items_in_list_v2(upcoming_prices, nr_of_on_hours)
+        # Cheapest one or two chunks for every number of on periods, in one pass
+        plans = ScheduleCreator.find_cheapest_blocks_for_each_n(upcoming_prices, nr_of_on_hours,
+                                                                max_blocks=ScheduleCreator.MAX_CHUNKS,
+                                                                min_gap=ScheduleCreator.MIN_CHUNK_GAP)
         while nr_of_on_hours > 0:
             # Get the total cost of running the lowest hours
-            total_cost = sum(values)
+            total_cost = plans.get_cost(nr_of_on_hours)
             logger.debug(f"Lowest cost of running {nr_of_on_hours} hours is {total_cost}")
             if total_cost <= max_total_cost or nr_of_on_hours == min_periods_to_run:
                 # Found best combination of hours to run in
@@ -162,18 +305,132 @@ class ScheduleCreator:
                 # min_hours_to_run
                 # Return a list representing future hours, where each bool represents whether a device should be on or
                 # off
-                return [True if x in indices else False for x in range(periods_ahead_to_calculate)]
+                on_periods = set(plans.get_indices(nr_of_on_hours))
+                return [x in on_periods for x in range(periods_ahead_to_calculate)]
             # The cost was too high, run for one hour less.
-            # remove the largest value of the list and try again
-            index_of_largest = values.index(max(values))
-            values.pop(index_of_largest)
-            indices.pop(index_of_largest)
             nr_of_on_hours -= 1
         logger.debug("No valid combinations")
         # Was not possible to find cheap enough combination
         false_list = [False] * periods_ahead_to_calculate
         return false_list
 
+    @staticmethod
+    def find_cheapest_blocks_to_run_in(max_total_cost: float,
+                                       max_periods_to_run: int,
+                                       min_periods_to_run: int,
+                                       upcoming_prices: List[float],
+                                       max_blocks: int = 2,
+                                       min_block_length: int = 1,
+                                       min_gap: int = 2,
+                                       available: List[bool] = None) -> List[bool]:
+        """
+        Like find_cheapest_periods_to_run_in, but on periods form blocks with set constraints
+        The largest number of on periods not costing more than max_total_cost is selected, if no number of periods
+        from min_periods_to_run is cheap enough, the min_periods_to_run cheapest periods are selected.
+        :param max_total_cost: maximum total cost the device is allowed to use
+        :param max_periods_to_run: what is the maximum number of on periods for the device to be on
+        :param min_periods_to_run: what is the minimum number of periods for the device to be on, This has higher priority
+        than max_total_cost.
+        :param upcoming_prices: list of upcomming electricity prices, each value meaning one period
+        :param max_blocks: maximum number of contiguous on blocks
+        :param min_block_length: minimum number of periods in each block
+        :param min_gap: minimum number of off periods between blocks
+        :param available: for each period whether the device may run, all available if None
+        :return: list of bools representing wether a device should be on or off for upcomming prices list
+        """
+        periods_ahead_to_calculate = len(upcoming_prices)
+        plans = ScheduleCreator.find_cheapest_blocks_for_each_n(upcoming_prices, max_periods_to_run, max_blocks,
+                                                                min_block_length, min_gap, available)
+        run_counts = [n for n in plans.costs if min_periods_to_run <= n <= max_periods_to_run]
+        if not run_counts:
+            logger.warning(f"No valid combinations with {max_blocks} blocks of at least {min_block_length} periods")
+            return [False] * periods_ahead_to_calculate
+        cheap_enough_counts = [n for n in run_counts if plans.get_cost(n) <= max_total_cost]
+        # Most periods under cost limit, otherwise the minimum
+        nr_of_on_periods = max(cheap_enough_counts) if cheap_enough_counts else min(run_counts)
+        logger.debug(f"Lowest cost of running {nr_of_on_periods} periods is {plans.get_cost(nr_of_on_periods)}")
+        on_periods = set(plans.get_indices(nr_of_on_periods))
+        return [x in on_periods for x in range(periods_ahead_to_calculate)]
+
+    @staticmethod
+    def find_cheapest_blocks_for_each_n(prices: List[float],
+                                        max_n: int,
+                                        max_blocks: int,
+                                        min_block_length: int = 1,
+                                        min_gap: int = 2,
+                                        available: List[bool] = None) -> 'BlockPlans':
+        """
+        Find the cheapest periods to run in for every number of on periods up to max_n, such that they form at most
+        max_blocks contiguous blocks of at least min_block_length periods, separated by at least min_gap periods.
+        Dynamic programming over periods, states are the number of on periods and blocks so far, O(L*n*k).
+        :param prices: list of prices, each value meaning one period
+        :param max_n: largest number of on periods
+        :param max_blocks: maximum number of blocks
+        :param min_block_length: minimum number of periods in a block
+        :param min_gap: minimum number of off periods between blocks
+        :param available: for each period whether it may be used, all available if None
+        :return: cheapest cost and periods for every n the constraints allow, n = 0 included
+        """
+        length = len(prices)
+        max_n = max(0, min(max_n, length))
+        max_blocks = max(0, max_blocks)
+        min_block_length = max(1, min_block_length)
+        min_gap = max(0, min_gap)
+        if available is None:
+            available = [True] * length
+        # Cost and number of unavailable periods of any window
+        prefix = [0]
+        unavailable_prefix = [0]
+        for price, period_available in zip(prices, available):
+            prefix.append(prefix[-1] + price)
+            unavailable_prefix.append(unavailable_prefix[-1] + (not period_available))
+
+        def block_cost(start: int, end: int) -> float | None:
+            # None if the block can not be used
+            if end > length or unavailable_prefix[end] != unavailable_prefix[start]:
+                return None
+            return prefix[end] - prefix[start]
+
+        inf = float("inf")
+        unreachable = [inf] * (max_n + 1)
+        # free[pos][blocks][n]: best cost of the first pos periods with n on periods in blocks, where the last period is
+        # off and a new block may start
+        # on[pos][blocks][n]: same, where the last period is on in a block that may end
+        free, on = [], []
+        for pos in range(length + 1):
+            on_now = [unreachable]
+            for blocks in range(1, max_blocks + 1):
+                row = unreachable
+                if blocks * min_block_length > pos:
+                    # Not enough periods for this many blocks yet
+                    on_now.append(row)
+                    continue
+                if pos and available[pos - 1] and on[pos - 1][blocks] is not unreachable:
+                    # Previous block one period longer
+                    price = prices[pos - 1]
+                    row = [inf] + [cost + price for cost in on[pos - 1][blocks][:-1]]
+                block_start = pos - min_block_length
+                cost_of_block = block_cost(block_start, pos) if block_start >= 0 else None
+                if cost_of_block is not None and free[block_start][blocks - 1] is not unreachable:
+                    # New block of minimum length
+                    started = [inf] * min_block_length + [cost + cost_of_block
+                                                          for cost in free[block_start][blocks - 1][:-min_block_length]]
+                    row = started if row is unreachable else [x if x <= y else y for x, y in zip(row, started)]
+                on_now.append(row)
+            on.append(on_now)
+            # Blocks that ended min_gap periods ago, blocks ended close to the end need no full gap
+            ended_at = range(pos - min_gap, pos - min_gap + 1) if pos < length else \
+                range(max(0, length - min_gap), length + 1)
+            free_now = []
+            for blocks in range(max_blocks + 1):
+                row = free[pos - 1][blocks] if pos else ([0.0] + [inf] * max_n if blocks == 0 else unreachable)
+                for end in ended_at:
+                    if end >= 0 and blocks and on[end][blocks] is not unreachable:
+                        row = [x if x <= y else y for x, y in zip(row, on[end][blocks])]
+                free_now.append(row)
+            free.append(free_now)
+        return BlockPlans(prices, available, min_block_length, min_gap, free, on)
+
     @staticmethod
     def find_n_smallest_items_in_list(items: list, n: int) -> [list, list]:
         """
@@ -192,11 +449,95 @@ class ScheduleCreator:
         return list(indices), list(values)
 
     @staticmethod
-    def find_n_smallest_items_in_list_v2(items: List [float], n: int) -> Tuple[List[int], List[float]]:
+    def find_n_smallest_items_in_list_v2(items: List[float], n: int) -> Tuple[List[int], List[float]]:
         """
         Find n smallest values such that they form:
           - either one contiguous chunk
           - or two contiguous chunks separated by at least 2 elements
+        For each length of the first chunk, the cheapest second chunk after every start of the first one is taken from
+        a suffix minimum of window sums, O(n*L) instead of checking every pair of starts.
+        Result is the same as find_n_smallest_items_in_list_v2_brute_force, including which of equal cost
+        combinations is returned.
+
+        :param items: list of values
+        :param n: total number of elements to select
+        :return: (indices list, values list)
+        """
+        length = len(items)
+        if n <= 0 or n > length:
+            return [], []
+        window_sums = ScheduleCreator.get_window_sums(items, n)
+        # ----- Single chunk, first cheapest -----
+        best_sum = float("inf")
+        best_chunks = None
+        for start, chunk_sum in enumerate(window_sums[n]):
+            if chunk_sum < best_sum:
+                best_sum = chunk_sum
+                best_chunks = (start, n, None, 0)
+        # ----- Two chunks with >=2 gap -----
+        # Cheapest second chunk of each length starting at or after each index
+        suffix_min_sums = {}
+        for len1 in range(1, n):
+            len2 = n - len1
+            if len2 not in suffix_min_sums:
+                suffix_min_sums[len2] = ScheduleCreator.get_suffix_minimums(window_sums[len2])
+            suffix_min = suffix_min_sums[len2]
+            last_start2 = length - len2
+            for start1, sum1 in enumerate(window_sums[len1]):
+                min_start2 = start1 + len1 + 2
+                if min_start2 > last_start2:
+                    break
+                # Adding the cheapest second chunk gives the cheapest sum for this first chunk, strict < keeps the
+                # first of equal combinations, same as the brute force search order
+                s = sum1 + suffix_min[min_start2]
+                if s < best_sum:
+                    best_sum = s
+                    best_chunks = (start1, len1, None, len2)
+        start1, len1, start2, len2 = best_chunks
+        if len2:
+            # First start of the second chunk giving the best sum
+            sum1 = window_sums[len1][start1]
+            start2 = next(start for start in range(start1 + len1 + 2, length - len2 + 1)
+                          if sum1 + window_sums[len2][start] == best_sum)
+            best_indices = list(range(start1, start1 + len1)) + list(range(start2, start2 + len2))
+        else:
+            best_indices = list(range(start1, start1 + len1))
+        values = [items[i] for i in best_indices]
+        return best_indices, values
+
+    @staticmethod
+    def get_window_sums(items: List[float], max_window: int) -> Dict[int, List[float]]:
+        """
+        :param items: list of values
+        :param max_window: longest window
+        :return: {window length: list of sums of each window of that length, by start index}
+        """
+        prefix = [0]
+        for value in items:
+            prefix.append(prefix[-1] + value)
+        length = len(items)
+        # Calculated as a difference of prefix sums like in the brute force search, so sums are bit for bit equal
+        return {window: [prefix[start + window] - prefix[start] for start in range(length - window + 1)]
+                for window in range(1, max_window + 1)}
+
+    @staticmethod
+    def get_suffix_minimums(values: List[float]) -> List[float]:
+        """
+        :return: list where item i is the minimum of values[i:]
+        """
+        suffix_min = values[:]
+        for i in range(len(values) - 2, -1, -1):
+            if suffix_min[i + 1] < suffix_min[i]:
+                suffix_min[i] = suffix_min[i + 1]
+        return suffix_min
+
+    @staticmethod
+    def find_n_smallest_items_in_list_v2_brute_force(items: List[float], n: int) -> Tuple[List[int], List[float]]:
+        """
+        Find n smallest values such that they form:
+          - either one contiguous chunk
+          - or two contiguous chunks separated by at least 2 elements
+        Checks every combination, O(n*L^2). Kept as the reference find_n_smallest_items_in_list_v2 is tested against.
 
         :param items: list of values
         :param n: total number of elements to select
@@ -244,20 +585,24 @@ class ScheduleCreator:
         values = [items[i] for i in best_indices]
         return best_indices, values
 
-
     @staticmethod
     def get_list_of_upcoming_prices(prices_today: DayPrices,
                                     prices_tomorrow: DayPrices,
-                                    periods_ahead_to_calculate: int) -> [int, list]:
+                                    periods_ahead_to_calculate: int,
+                                    start_period: int = None) -> [int, list]:
         """
         Get a list of the upcoming prices from today's and tomorrow's price dictionarries
         :param prices_today: dictionary with keys 0...95 holding electricity prices for each period today
         :param prices_tomorrow: dictionary with keys 0...95 holding electricity prices for each period tomorrow
         :param periods_ahead_to_calculate: for how many periods ahead to get the prices
+        :param start_period: period of today to start from, the next period if None
         :return:
         """
         # get the number of the next hour, will be needed when returning schedule dictionaries
-        next_period_number = (datetime.datetime.now().hour * 4) + (datetime.datetime.now().minute//15) + 1
+        if start_period is None:
+            next_period_number = (datetime.datetime.now().hour * 4) + (datetime.datetime.now().minute//15) + 1
+        else:
+            next_period_number = start_period
         logger.debug(f"Schedule next period is {next_period_number}")
         # How many prices for each hour from today's dictionary
         periods_from_today = min(periods_ahead_to_calculate, 96 - next_period_number)
@@ -272,5 +617,87 @@ class ScheduleCreator:
         return next_period_number, future_periods
 
 
+class BlockPlans:
+    """
+    Result of ScheduleCreator.find_cheapest_blocks_for_each_n
+    Periods of a plan are found from the dynamic programming tables only when asked for, usually only one of the plans
+    is used.
+    """
+
+    def __init__(self, prices: List[float], available: List[bool], min_block_length: int, min_gap: int,
+                 free: List[List[List[float]]], on: List[List[List[float]]]):
+        self._prices = prices
+        self._available = available
+        self._min_block_length = min_block_length
+        self._min_gap = min_gap
+        self._free = free
+        self._on = on
+        self._length = len(prices)
+        # n: (cost, state is on, blocks) of the cheapest final state
+        self._final_states = {}
+        for n in range(len(free[-1][0])):
+            best = min(((states[-1][blocks][n], state_is_on, blocks)
+                        for blocks in range(len(free[-1])) for state_is_on, states in ((False, free), (True, on))),
+                       key=lambda state: state[0])
+            if best[0] != float("inf"):
+                self._final_states[n] = best
+        # n: cost
+        self.costs = {n: state[0] for n, state in self._final_states.items()}
+
+    def __contains__(self, n: int) -> bool:
+        return n in self.costs
+
+    def get_cost(self, n: int) -> float:
+        return self.costs[n]
+
+    def get_indices(self, n: int) -> List[int]:
+        """
+        :return: on periods of the cheapest plan with n on periods, ascending
+        """
+        free, on, prices, available = self._free, self._on, self._prices, self._available
+        state_cost, state_is_on, blocks = self._final_states[n]
+        # Walk back through states, each state equals the cost of the state it was reached from. Costs are compared
+        # exactly, the same additions are repeated as when the tables were filled, so they are bit for bit equal.
+        indices = []
+        pos, count = self._length, n
+        while pos or state_is_on:
+            if state_is_on:
+                if available[pos - 1] and count and on[pos - 1][blocks][count - 1] + prices[pos - 1] == state_cost:
+                    # Block one period longer
+                    indices.append(pos - 1)
+                    pos, count = pos - 1, count - 1
+                else:
+                    # Block started
+                    block_start = pos - self._min_block_length
+                    if block_start < 0 or count < self._min_block_length or \
+                            free[block_start][blocks - 1][count - self._min_block_length] == float("inf"):
+                        raise ValueError(f"No block start leads to cost {state_cost} of the plan with {n} on periods "
+                                         f"at period {pos}")
+                    indices.extend(range(pos - 1, block_start - 1, -1))
+                    pos, count, blocks, state_is_on = block_start, count - self._min_block_length, blocks - 1, False
+                state_cost = (on if state_is_on else free)[pos][blocks][count]
+            elif free[pos - 1][blocks][count] == state_cost:
+                # Period off
+                pos -= 1
+            else:
+                # Block ended
+                pos = next((end for end in self.get_block_end_positions(pos)
+                            if end >= 0 and on[end][blocks][count] == state_cost), None)
+                if pos is None:
+                    raise ValueError(f"No block end leads to cost {state_cost} of the plan with {n} on periods")
+                state_is_on = True
+        indices.reverse()
+        return indices
+
+    def get_block_end_positions(self, pos: int) -> range:
+        """
+        :return: positions where a block could end for the next block to start after pos, blocks ending close to the
+        end need no full gap
+        """
+        if pos < self._length:
+            return range(pos - self._min_gap, pos - self._min_gap + 1)
+        return range(max(0, self._length - self._min_gap), self._length + 1)
+
+
 if __name__ == '__main__':
     test()
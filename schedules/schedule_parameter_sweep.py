@@ -0,0 +1,166 @@
+"""
+Parameter sweep for AutoScheduleCreator settings
+Every combination of the sweep grid is backtested over historical prices in a process pool using all cores. The energy
+cost is calculated with the power the device was measured to use when on, from the shelly_data table. Results are
+streamed as they are finished and the Pareto front of energy cost and delivered runtime is kept: settings for which
+no other setting runs the device longer for the same or lower cost.
+"""
+import datetime
+import itertools
+import logging
+import os
+import time
+from typing import Iterator, List, Tuple
+from helpers.database_mngr import DbMngr
+from schedules.auto_schedule_creator import AutoScheduleCreator
+from schedules.schedule_backtest import PriceHistory, iterate_backtest, get_price_history, PRICE_SOURCE, \
+    PERIODS_PER_DAY, DEFAULT_START_PERIOD
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "schedule_parameter_sweep.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+# AutoScheduleCreator settings to sweep, every combination is backtested
+SWEEP_GRID = {
+    "period_split": AutoScheduleCreator.ALLOWED_PERIODS,
+    "max_total_cost": [100.0, 200.0, 300.0, 450.0, 600.0, 900.0, 1e9],
+    "max_periods_to_run": [4, 8, 12, 16, 20, 28],
+    "min_periods_to_run": [0, 4],
+}
+# Device the consumption is taken from in main_fc, 1 kW is used if not set or without data
+SWEEP_DEVICE_NAME = ""
+SWEEP_DEVICE_POWER_KW = 1.0
+# Measured consumption of this many last days is used
+MEASURED_DAYS = 90
+# Power below this is standby, not running
+MIN_ON_POWER_W = 5.0
+
+
+def main_fc():
+    history = get_price_history(PRICE_SOURCE)
+    on_power_kw = None
+    if SWEEP_DEVICE_NAME:
+        db_mngr = DbMngr()
+        end_date = datetime.date.today()
+        on_power_kw = get_measured_on_power_kw(db_mngr, SWEEP_DEVICE_NAME,
+                                               end_date - datetime.timedelta(days=MEASURED_DAYS), end_date)
+        db_mngr.stop()
+    combinations = get_parameter_combinations(SWEEP_GRID)
+    print(f"Sweeping {len(combinations)} settings over {history.get_days_with_prices()} days of prices on "
+          f"{os.cpu_count()} cores")
+    time_start = time.perf_counter()
+    pareto_front = []
+    for done, (params, result, pareto_front) in enumerate(sweep_parameters(history, combinations,
+                                                                           device_power_kw=SWEEP_DEVICE_POWER_KW,
+                                                                           on_power_kw=on_power_kw), start=1):
+        if done % 20 == 0 or done == len(combinations):
+            print(f"{done}/{len(combinations)} done in {time.perf_counter() - time_start:.1f} s, "
+                  f"Pareto front {len(pareto_front)} settings")
+    print_pareto_front(pareto_front)
+
+
+def get_parameter_combinations(grid: dict) -> List[dict]:
+    """
+    :return: AutoScheduleCreator parameters, one for each combination of the grid where min is not above max
+    """
+    combinations = []
+    for values in itertools.product(*grid.values()):
+        params = dict(zip(grid.keys(), values))
+        if params["min_periods_to_run"] <= params["max_periods_to_run"]:
+            combinations.append(params)
+    return combinations
+
+
+def get_measured_on_power_kw(db_mngr: DbMngr, name: str, start_date: datetime.date, end_date: datetime.date) \
+        -> List[float]:
+    """
+    :param db_mngr: database with shelly_data
+    :param name: device name in the devices table
+    :return: mean power when on for each period of the day, kW, None if the device has no data when on
+    """
+    power_sums = [0.0] * PERIODS_PER_DAY
+    power_counts = [0] * PERIODS_PER_DAY
+    for record_time, off_on, power in db_mngr.get_shelly_power_data(name, start_date, end_date):
+        if not off_on or power < MIN_ON_POWER_W:
+            continue
+        period = record_time.hour * 4 + record_time.minute // 15
+        power_sums[period] += power
+        power_counts[period] += 1
+    if not any(power_counts):
+        logger.warning(f"No measured consumption of {name} when on")
+        return None
+    # Periods the device was never measured in use the mean of all periods
+    mean_power = sum(power_sums) / sum(power_counts)
+    return [(power_sum / count if count else mean_power) / 1000 for power_sum, count in zip(power_sums, power_counts)]
+
+
+def sweep_parameters(history: PriceHistory,
+                     combinations: List[dict],
+                     start_period: int = DEFAULT_START_PERIOD,
+                     device_power_kw: float = 1.0,
+                     on_power_kw: List[float] = None,
+                     max_workers: int = None) -> Iterator[Tuple[dict, dict, List[Tuple[dict, dict]]]]:
+    """
+    :param history: prices to backtest over
+    :param combinations: AutoScheduleCreator parameters to backtest
+    :param start_period: first period of each daily run, the period after the calculation time
+    :param device_power_kw: power of the device when on, if no measured power
+    :param on_power_kw: measured power for each period of the day when on
+    :param max_workers: processes to use, all cores if None
+    :return: parameters, backtest result and the Pareto front so far, as soon as each combination is finished
+    """
+    strategies = {str(i): params for i, params in enumerate(combinations)}
+    pareto_front = []
+    for name, result in iterate_backtest(history, strategies, start_period, device_power_kw, on_power_kw,
+                                         max_workers):
+        params = strategies[name]
+        pareto_front = get_pareto_front(pareto_front + [(params, result)])
+        yield params, result, pareto_front
+
+
+def get_pareto_front(results: List[Tuple[dict, dict]]) -> List[Tuple[dict, dict]]:
+    """
+    Settings with constraint violations are left out
+    :param results: (parameters, backtest result)
+    :return: results not dominated by a result with lower or equal energy cost and longer or equal runtime, sorted by
+    runtime
+    """
+    valid_results = [(params, result) for params, result in results
+                     if not (result["min_periods_violations"] or result["max_periods_violations"] or
+                             result["max_total_cost_violations"])]
+    # Longest runtime first, cheapest first for equal runtime
+    valid_results.sort(key=lambda item: (-item[1]["runtime_h"], item[1]["energy_cost"]))
+    pareto_front = []
+    lowest_cost = float("inf")
+    for params, result in valid_results:
+        if result["energy_cost"] < lowest_cost:
+            pareto_front.append((params, result))
+            lowest_cost = result["energy_cost"]
+    pareto_front.reverse()
+    return pareto_front
+
+
+def print_pareto_front(pareto_front: List[Tuple[dict, dict]]) -> None:
+    print(f"{'split':>6}{'max cost':>10}{'max on':>8}{'min on':>8}{'runtime h':>11}{'min day h':>11}"
+          f"{'energy cost':>13}{'mean price':>12}")
+    for params, result in pareto_front:
+        mean_price = result["total_cost"] / result["on_periods"] if result["on_periods"] else 0.0
+        print(f"{params['period_split']:>6}{params['max_total_cost']:>10g}{params['max_periods_to_run']:>8}"
+              f"{params['min_periods_to_run']:>8}{result['runtime_h']:>11.1f}{result['min_daily_runtime_h']:>11.2f}"
+              f"{result['energy_cost']:>13.2f}{mean_price:>12.1f}")
+
+
+if __name__ == '__main__':
+    main_fc()
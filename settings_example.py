@@ -21,6 +21,12 @@ GRAFANA_CLOUD_SOURCE_TAG = "home_data"
 # Mqtt settings
 MQTT_SERVER = "0.0.0.0"
 MQTT_PORT = 1883
+# Number of worker threads handling received MQTT messages, sharded by device. 0 - handle on the MQTT loop thread
+MQTT_WORKER_THREADS = 0
+# If set, all received MQTT messages are recorded to this file for replaying later. Empty - recording disabled
+MQTT_RECORD_FILE = ""
+# How often to log MQTT message rate and latency statistics. 0 - do not log
+MQTT_STATS_LOG_INTERVAL_S = 0
 
 # Other settings
 PRICE_FILE_LOCATION = "C:\\py_related\\home_el_cntrl\\price_lists"
@@ -0,0 +1,328 @@
+"""
+Simulated fleet of Shelly devices for load and soak testing of the controller
+Creates N simulated devices on an InProcessBroker and a local HTTP server for the Gen1 relay URLs and Gen2 RPC calls,
+plus the matching device configuration so the controller devices can be created with get_dev_list_from_dic_list.
+run_load_test runs the controller side (MQTT client, devices, supervisor, fleet state, RPC poller) against the
+simulated fleet, toggles outputs and reports CPU time, latency and memory.
+Run from the simulator folder: python fleet_simulator.py [number of devices] [duration s]
+"""
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from devices.deviceTypes import DeviceType
+from devices.device import Device
+from helpers.device_supervisor import DeviceSupervisor
+from helpers.fleet_state import FleetStateTable
+from helpers.http_client_pool import HttpClientPool
+from helpers.shelly_rpc_client import ShellyRpcFleetPoller
+from helpers.state_saver import StateSaver
+from simulator.sim_broker import InProcessBroker, SimulatedMqttClient
+from simulator.sim_devices import SimShellyPlug, SimShellyPlus, SimShellyPro3EM
+from system_setup.device_registry import DeviceRegistry
+from system_setup.device_setup import get_dev_list_from_dic_list
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "simulator.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    results = run_load_test(n_devices=50, duration_s=10)
+    print(json.dumps(results, indent=2))
+
+
+class FleetHttpServer:
+    """
+    Local HTTP server standing in for the web interface of all simulated devices
+    Device is selected by the first path part, so the device address is 127.0.0.1:<port>/<device id>
+    Gen1: GET /<id>/relay/0?turn=on|off, Gen2: POST /<id>/rpc
+    """
+
+    def __init__(self, devices: dict, port: int = 0):
+        """
+        :param devices: device id: simulated device
+        :param port: port to listen on, 0 - any free port
+        """
+        self.devices = devices
+        fleet_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                device_id, _, path = url.path.lstrip("/").partition("/")
+                device = fleet_server.devices.get(device_id)
+                if not isinstance(device, SimShellyPlug) or path != "relay/0":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                turn = parse_qs(url.query).get("turn", [""])[0]
+                if turn in ("on", "off"):
+                    device.set_output(turn == "on")
+                    device.publish_state()
+                self.send_json(200, device.get_http_relay_status())
+
+            def do_POST(self):
+                device_id, _, path = self.path.lstrip("/").partition("/")
+                device = fleet_server.devices.get(device_id)
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not isinstance(device, SimShellyPlus) or path != "rpc":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                self.send_json(200, device.handle_rpc(request))
+
+            def send_json(self, code: int, reply: dict):
+                body = json.dumps(reply).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.address = f"127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FleetSimulator:
+    """
+    Creates and runs the simulated devices
+    Devices publish their readings every tick_s, spread over the tick so the broker is not hit all at once.
+    """
+    # Share of each device type in the fleet, URL controlled plugs are simulated Gen1 plugs used over HTTP
+    DEVICE_MIX = {DeviceType.SHELLY_PLUG: 0.35,
+                  DeviceType.URL_CONTROLLED_SHELLY_PLUG: 0.15,
+                  DeviceType.SHELLY_PLUS: 0.2,
+                  DeviceType.SHELLY_PLUS_PM: 0.25,
+                  DeviceType.SHELLY_PRO_3EM: 0.05}
+    TICK_S = 5.0
+
+    def __init__(self, n_devices: int, broker: InProcessBroker = None, tick_s: float = TICK_S, seed: int = None):
+        """
+        :param n_devices: number of simulated devices
+        :param broker: broker to use, new one if not given
+        :param tick_s: interval of readings published by each device
+        :param seed: random seed, for repeatable runs
+        """
+        if seed is not None:
+            random.seed(seed)
+        self.broker = broker if broker else InProcessBroker()
+        self.tick_s = tick_s
+        # Device id: simulated device
+        self.devices = {}
+        # Configuration of the controller devices, same format as the device file
+        self.dev_dic_list = []
+        # Devices only used over HTTP
+        self.http_only_ids = set()
+        self.http_server = FleetHttpServer(self.devices)
+        self._stop_event = threading.Event()
+        self._tick_thread = None
+        self.ticks = 0
+        self._create_devices(n_devices)
+
+    def _create_devices(self, n_devices: int):
+        device_types = list(self.DEVICE_MIX)
+        counts = {device_type: int(n_devices * share) for device_type, share in self.DEVICE_MIX.items()}
+        # Remainder of rounding goes to the most common type
+        counts[device_types[0]] += n_devices - sum(counts.values())
+        address = self.http_server.address
+        nr = 0
+        for device_type in device_types:
+            for _ in range(counts[device_type]):
+                nr += 1
+                name = f"Sim {device_type.name} {nr}"
+                if device_type in (DeviceType.SHELLY_PLUG, DeviceType.URL_CONTROLLED_SHELLY_PLUG):
+                    device_id = f"shellyplug-s-{nr:012X}"
+                    self.devices[device_id] = SimShellyPlug(self.broker, device_id)
+                    if device_type == DeviceType.SHELLY_PLUG:
+                        self.dev_dic_list.append({"type": device_type.name, "name": name, "plug_id": device_id})
+                    else:
+                        self.http_only_ids.add(device_id)
+                        url = f"http://{address}/{device_id}/relay/0"
+                        self.dev_dic_list.append({"type": device_type.name, "name": name,
+                                                  "url_on": f"{url}?turn=on", "url_off": f"{url}?turn=off"})
+                elif device_type in (DeviceType.SHELLY_PLUS, DeviceType.SHELLY_PLUS_PM):
+                    with_pm = device_type == DeviceType.SHELLY_PLUS_PM
+                    device_id = f"shellyplus1{'pm' if with_pm else ''}-{nr:012x}"
+                    self.devices[device_id] = SimShellyPlus(self.broker, device_id, with_pm=with_pm)
+                    self.dev_dic_list.append({"type": device_type.name, "name": name, "plug_id": device_id,
+                                              "ip": f"{address}/{device_id}"})
+                elif device_type == DeviceType.SHELLY_PRO_3EM:
+                    device_id = f"shellypro3em-{nr:012x}"
+                    self.devices[device_id] = SimShellyPro3EM(self.broker, device_id)
+                    self.dev_dic_list.append({"type": device_type.name, "name": name, "device_id": device_id})
+
+    def start(self):
+        self.http_server.start()
+        self._tick_thread = threading.Thread(target=self._run, name="fleet_simulator", daemon=True)
+        self._tick_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._tick_thread:
+            self._tick_thread.join()
+        self.http_server.stop()
+
+    def _run(self):
+        # Plugs controlled over HTTP are only polled, they do not need to publish readings
+        devices = [device for device_id, device in self.devices.items() if device_id not in self.http_only_ids]
+        while not self._stop_event.is_set():
+            time_tick_start = time.perf_counter()
+            for nr, device in enumerate(devices):
+                # Spread the publishes of the devices over the tick
+                time_to_wait = time_tick_start + self.tick_s * nr / len(devices) - time.perf_counter()
+                if time_to_wait > 0 and self._stop_event.wait(time_to_wait):
+                    return
+                device.tick(time.time())
+            self.ticks += 1
+            self._stop_event.wait(max(0.0, time_tick_start + self.tick_s - time.perf_counter()))
+
+
+def run_load_test(n_devices: int = 500, duration_s: float = 60, toggle_interval_s: float = 2.0,
+                  toggles_per_interval: int = 20, loop_interval_s: float = 0.3) -> dict:
+    """
+    Run the controller against a simulated fleet, same wiring as mainUi without the UI, schedules and data logger
+    :param n_devices: number of simulated devices
+    :param duration_s: how long to run
+    :param toggle_interval_s: how often to switch outputs of random devices
+    :param toggles_per_interval: how many devices to switch each time
+    :param loop_interval_s: interval of the MQTT and device loops
+    :return: CPU time, command latency, MQTT statistics and memory use
+    """
+    tracemalloc.start()
+    simulator = FleetSimulator(n_devices)
+    mqtt_client = SimulatedMqttClient(simulator.broker)
+    # Keep state files of simulated devices out of the real state folder, devices load their state when created
+    state_dir = tempfile.TemporaryDirectory()
+    dev_registry = DeviceRegistry(get_dev_list_from_dic_list(simulator.dev_dic_list, mqtt_client.publish,
+                                                             state_file_loc=state_dir.name))
+    for dev in dev_registry.get_by_type(DeviceType.SHELLY_PLUG, DeviceType.SHELLY_PLUS, DeviceType.SHELLY_PLUS_PM,
+                                        DeviceType.SHELLY_PRO_3EM):
+        mqtt_client.add_listen_topic(dev.listen_topic, dev.process_received_mqtt_data)
+    fleet_state = FleetStateTable()
+    for dev in dev_registry:
+        dev.attach_fleet_state(fleet_state)
+    device_supervisor = DeviceSupervisor(tick_s=1.0)
+    unsupervised_devs = [dev for dev in dev_registry if not dev.supervise(device_supervisor)]
+    rpc_poller = ShellyRpcFleetPoller(dev_registry.get_by_type(DeviceType.SHELLY_PLUS, DeviceType.SHELLY_PLUS_PM),
+                                      max_jitter_s=0.5)
+    switchable_devs = [dev for dev in dev_registry if dev.device_type != DeviceType.SHELLY_PRO_3EM]
+    for dev in switchable_devs:
+        dev.set_mode(Device.MODE_MAN)
+    # Device: (commanded state, perf_counter time of command)
+    pending_commands = {}
+    command_latencies_s = []
+    setup_memory_b = tracemalloc.get_traced_memory()[0]
+    simulator.start()
+    mqtt_client.start()
+    rpc_poller.poll_all()
+    cpu_time_start = time.process_time()
+    time_start = time.perf_counter()
+    time_of_last_toggle = time_start
+    loops = 0
+    loop_time_max_s = 0.0
+    while time.perf_counter() - time_start < duration_s:
+        time_loop_start = time.perf_counter()
+        mqtt_client.loop()
+        rpc_poller.loop()
+        device_supervisor.tick()
+        for dev in unsupervised_devs:
+            dev.loop()
+        for dev, (off_on, time_cmd) in list(pending_commands.items()):
+            if dev.state_off_on == off_on:
+                command_latencies_s.append(time_loop_start - time_cmd)
+                del pending_commands[dev]
+        if time_loop_start - time_of_last_toggle >= toggle_interval_s:
+            time_of_last_toggle = time_loop_start
+            for dev in random.sample(switchable_devs, min(toggles_per_interval, len(switchable_devs))):
+                if dev in pending_commands:
+                    continue
+                off_on = not dev.get_cmd_given()
+                pending_commands[dev] = (off_on, time.perf_counter())
+                dev.set_manual_run(off_on)
+        loops += 1
+        loop_time_s = time.perf_counter() - time_loop_start
+        loop_time_max_s = max(loop_time_max_s, loop_time_s)
+        time.sleep(max(0.0, loop_interval_s - loop_time_s))
+    cpu_time_s = time.process_time() - cpu_time_start
+    wall_time_s = time.perf_counter() - time_start
+    memory_b, memory_peak_b = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    simulator.stop()
+    mqtt_client.stop()
+    rpc_poller.stop()
+    HttpClientPool.get_shared().stop()
+    StateSaver.stop()
+    state_dir.cleanup()
+    mqtt_stats = mqtt_client.get_stats_snapshot()
+    command_latencies_s.sort()
+    results = {
+        "devices": len(dev_registry),
+        "wall_time_s": round(wall_time_s, 1),
+        "cpu_time_s": round(cpu_time_s, 2),
+        "cpu_load_percent": round(100 * cpu_time_s / wall_time_s, 1),
+        "loops": loops,
+        "loop_time_max_ms": round(loop_time_max_s * 1000, 1),
+        "online_devices": sum(1 for dev in dev_registry if dev.state_online),
+        "plug_power_w": round(fleet_state.column_sum("power", DeviceType.SHELLY_PLUG), 1),
+        "broker": simulator.broker.get_stats(),
+        "mqtt_messages": sum(prefix["messages"] for prefix in mqtt_stats["prefixes"].values()),
+        "mqtt_max_queue_latency_ms": round(mqtt_stats["max_queue_latency_s"] * 1000, 1),
+        "mqtt_queue_latency_hist": dict(zip([str(bound) for bound in mqtt_stats["histogram_bounds_s"]] + ["inf"],
+                                            mqtt_stats["queue_latency_hist"])),
+        "commands_confirmed": len(command_latencies_s),
+        "commands_unconfirmed": len(pending_commands),
+        "command_latency_median_ms": round(_percentile(command_latencies_s, 0.5) * 1000, 1),
+        "command_latency_p95_ms": round(_percentile(command_latencies_s, 0.95) * 1000, 1),
+        "command_latency_max_ms": round(_percentile(command_latencies_s, 1.0) * 1000, 1),
+        "supervisor": device_supervisor.get_stats(),
+        "memory_setup_mb": round(setup_memory_b / 1e6, 1),
+        "memory_end_mb": round(memory_b / 1e6, 1),
+        "memory_peak_mb": round(memory_peak_b / 1e6, 1),
+    }
+    logger.info(f"Load test results {results}")
+    return results
+
+
+def _percentile(sorted_values: list[float], share: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print(json.dumps(run_load_test(n_devices=int(sys.argv[1]),
+                                       duration_s=float(sys.argv[2]) if len(sys.argv) > 2 else 60), indent=2))
+    else:
+        test()
@@ -0,0 +1,163 @@
+"""
+In-process MQTT broker stand-in and a MyMqttClient that uses it instead of a network connection
+Supports '+' and '#' wildcards, messages are delivered synchronously on the publishing thread.
+"""
+import logging
+import os
+import threading
+from typing import Callable
+from helpers.mqtt_client import MyMqttClient
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "simulator.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+
+def test():
+    broker = InProcessBroker()
+    broker.subscribe("shellies/+/relay/0", test_cb)
+    broker.subscribe("shellyplus1-441793ab3fb4/#", test_cb)
+    broker.publish("shellies/shellyplug-s-80646F840029/relay/0", "on")
+    broker.publish("shellies/shellyplug-s-80646F840029/relay/0/power", "12.5")
+    broker.publish("shellyplus1-441793ab3fb4/status/switch:0", '{"id":0,"output":true}')
+    print(broker.get_stats())
+
+
+def test_cb(topic: str, payload: bytes):
+    print(f"{topic} {payload}")
+
+
+class InProcessBroker:
+    """
+    Topic filters are kept in a tree by topic level, so a publish only visits the branches matching its topic
+    instead of every subscription.
+    """
+
+    class _Node:
+        __slots__ = ("children", "callbacks")
+
+        def __init__(self):
+            self.children = {}
+            self.callbacks = []
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = self._Node()
+        self._stats = {"published": 0, "delivered": 0}
+
+    def subscribe(self, topic_filter: str, callback: Callable[[str, bytes], None]) -> None:
+        """
+        :param topic_filter: topic, may contain '+' and a trailing '#'
+        :param callback: called with topic and payload bytes for each matching message
+        """
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split("/"):
+                node = node.children.setdefault(level, self._Node())
+            node.callbacks.append(callback)
+
+    def unsubscribe(self, topic_filter: str, callback: Callable[[str, bytes], None]) -> None:
+        with self._lock:
+            node = self._root
+            for level in topic_filter.split("/"):
+                node = node.children.get(level)
+                if node is None:
+                    return
+            if callback in node.callbacks:
+                node.callbacks.remove(callback)
+
+    def publish(self, topic: str, payload) -> None:
+        """
+        :param topic: topic without wildcards
+        :param payload: str or bytes
+        """
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self._lock:
+            callbacks = []
+            self._collect(self._root, topic.split("/"), 0, callbacks)
+            self._stats["published"] += 1
+            self._stats["delivered"] += len(callbacks)
+        for callback in callbacks:
+            callback(topic, payload)
+
+    def _collect(self, node, levels: list[str], level_nr: int, callbacks: list) -> None:
+        # '#' matches the rest of the topic, including the parent level
+        multi_level = node.children.get("#")
+        if multi_level:
+            callbacks.extend(multi_level.callbacks)
+        if level_nr == len(levels):
+            callbacks.extend(node.callbacks)
+            return
+        child = node.children.get(levels[level_nr])
+        if child:
+            self._collect(child, levels, level_nr + 1, callbacks)
+        single_level = node.children.get("+")
+        if single_level:
+            self._collect(single_level, levels, level_nr + 1, callbacks)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+class SimulatedMqttClient(MyMqttClient):
+    """
+    MyMqttClient connected to an InProcessBroker. No paho client or MQTT thread is started, received messages go
+    through the same queue, dispatch and statistics as with a real broker.
+    """
+
+    def __init__(self, broker: InProcessBroker, worker_threads: int = 0, stats_log_interval_s: float = 0):
+        super().__init__(worker_threads=worker_threads, stats_log_interval_s=stats_log_interval_s)
+        self.broker = broker
+        self.started = False
+
+    def start(self, broker_addr: str = "", port: int = 0, user: str = "", psw: str = "", recorder=None):
+        """
+        Address and credentials are ignored, subscribes all listen topics on the in-process broker
+        """
+        self.recorder = recorder
+        for topic in self.subscription_dict:
+            self.broker.subscribe(topic, self._on_broker_msg)
+        self.started = True
+        self.queue_from_mqtt_thread.put({"msg_type": self.MqttClientThread.MsgType.MQTT_CLIENT_STATUS_CHANGE,
+                                         "data": self.MqttClientThread.STATUS_CONNECTED})
+
+    def add_listen_topic(self, topic: str, callback: Callable[[str, str], None]):
+        self.subscription_dict[topic] = callback
+        self.topic_index.add(topic, callback)
+        if self.started:
+            self.broker.subscribe(topic, self._on_broker_msg)
+
+    def loop(self):
+        super().loop()
+        # Send coalesced publishes, done by the MQTT thread with a real broker
+        for topic, payload in self.publish_coalescer.pop_ready():
+            self.broker.publish(topic, payload)
+
+    def stop(self):
+        if self.shard_pool:
+            self.shard_pool.stop()
+        if self.recorder:
+            self.recorder.close()
+
+    def _on_broker_msg(self, topic: str, payload: bytes):
+        if self.recorder:
+            self.recorder.record(topic, payload)
+        self.inject_received_msg(topic, payload)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,287 @@
+"""
+Simulated Shelly devices
+Each device publishes the same MQTT topics and payloads as the real hardware to an InProcessBroker and reacts to the
+command topics the controller devices publish. Power readings follow a random walk while the output is on.
+Device state is changed from broker callbacks, HTTP server threads and the tick thread, so it is kept under a lock.
+"""
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from simulator.sim_broker import InProcessBroker
+
+
+def test():
+    broker = InProcessBroker()
+    broker.subscribe("#", test_cb)
+    devices = [SimShellyPlug(broker, "shellyplug-s-000000000001"),
+               SimShellyPlus(broker, "shellyplus1pm-000000000002", with_pm=True),
+               SimShellyPro3EM(broker, "shellypro3em-000000000003")]
+    for device in devices:
+        device.tick(time.time())
+    broker.publish("shellies/shellyplug-s-000000000001/relay/0/command", "on")
+    broker.publish("shellyplus1pm-000000000002/command/switch:0", "on")
+    broker.publish("shellyplus1pm-000000000002/command", "status_update")
+
+
+def test_cb(topic: str, payload: bytes):
+    print(f"{topic} {payload}")
+
+
+class SimShellyDevice(ABC):
+    """
+    Base of simulated devices
+    """
+    # Random walk limits of the load connected to an output
+    MIN_LOAD_W = 5.0
+    MAX_LOAD_W = 2000.0
+    # Largest change of the load per tick
+    MAX_LOAD_STEP_W = 50.0
+
+    def __init__(self, broker: InProcessBroker, device_id: str):
+        """
+        :param broker: broker to publish to and receive commands from
+        :param device_id: id used in the topics, same format as the real device
+        """
+        self.broker = broker
+        self.device_id = device_id
+        self._lock = threading.Lock()
+        self.output_on = False
+        self.load_w = random.uniform(self.MIN_LOAD_W, self.MAX_LOAD_W / 4)
+        self.temperature = random.uniform(30.0, 45.0)
+        # Total energy in Wh
+        self.energy_wh = random.uniform(0, 10000.0)
+        self.time_of_last_tick = None
+        self.commands_received = 0
+
+    def get_power(self) -> float:
+        return self.load_w if self.output_on else 0.0
+
+    def set_output(self, on: bool) -> bool:
+        """
+        :return: previous output state
+        """
+        with self._lock:
+            was_on = self.output_on
+            self.output_on = on
+            self.commands_received += 1
+        return was_on
+
+    def tick(self, now: float) -> None:
+        """
+        Advance the simulated readings and publish them
+        :param now: unix time
+        """
+        with self._lock:
+            if self.time_of_last_tick is not None:
+                self.energy_wh += self.get_power() * (now - self.time_of_last_tick) / 3600
+            self.time_of_last_tick = now
+            step = random.uniform(-self.MAX_LOAD_STEP_W, self.MAX_LOAD_STEP_W)
+            self.load_w = min(self.MAX_LOAD_W, max(self.MIN_LOAD_W, self.load_w + step))
+            self.temperature = min(80.0, max(20.0, self.temperature + random.uniform(-0.2, 0.2)))
+        self.publish_readings(now)
+
+    @abstractmethod
+    def publish_readings(self, now: float) -> None:
+        """
+        Publish the current readings the same way as the real device
+        :param now: unix time
+        """
+        pass
+
+
+class SimShellyPlug(SimShellyDevice):
+    """
+    Gen1 Shelly Plug S, topics shellies/<id>/...
+    Also reachable over HTTP with /relay/0?turn=on|off, see FleetHttpServer
+    """
+
+    def __init__(self, broker: InProcessBroker, device_id: str):
+        super().__init__(broker, device_id)
+        self.base_topic = f"shellies/{device_id}"
+        broker.subscribe(f"{self.base_topic}/relay/0/command", self.on_command)
+
+    def on_command(self, topic: str, payload: bytes) -> None:
+        command = payload.decode().lower()
+        if command in ("on", "off"):
+            self.set_output(command == "on")
+            self.publish_state()
+
+    def publish_state(self) -> None:
+        self.broker.publish(f"{self.base_topic}/relay/0", "on" if self.output_on else "off")
+
+    def publish_readings(self, now: float) -> None:
+        self.publish_state()
+        self.broker.publish(f"{self.base_topic}/relay/0/power", f"{self.get_power():.2f}")
+        # Gen1 reports energy in Wmin
+        self.broker.publish(f"{self.base_topic}/relay/0/energy", f"{int(self.energy_wh * 60)}")
+        self.broker.publish(f"{self.base_topic}/temperature", f"{self.temperature:.2f}")
+        self.broker.publish(f"{self.base_topic}/overtemperature", "0")
+
+    def get_http_relay_status(self) -> dict:
+        # Reply of the /relay/0 URL
+        return {"ison": self.output_on, "has_timer": False, "timer_started": 0, "timer_duration": 0,
+                "timer_remaining": 0, "overpower": False, "source": "http"}
+
+
+class SimShellyPlus(SimShellyDevice):
+    """
+    Gen2 Shelly Plus 1 or Plus 1PM, topics <id>/status/..., <id>/command and <id>/events/rpc
+    Also answers Shelly.GetStatus and Switch.Set RPC calls, see FleetHttpServer
+    """
+
+    def __init__(self, broker: InProcessBroker, device_id: str, with_pm: bool = False):
+        """
+        :param with_pm: Plus 1PM, switch status includes power measurements
+        """
+        super().__init__(broker, device_id)
+        self.with_pm = with_pm
+        self.input_on = False
+        self.time_start = time.time()
+        broker.subscribe(f"{device_id}/command", self.on_command)
+        broker.subscribe(f"{device_id}/command/switch:0", self.on_switch_command)
+
+    def on_command(self, topic: str, payload: bytes) -> None:
+        if payload.decode() == "status_update":
+            self.publish_status()
+
+    def on_switch_command(self, topic: str, payload: bytes) -> None:
+        command = payload.decode().lower()
+        if command in ("on", "off"):
+            self.set_output(command == "on")
+            self.publish_switch_status(source="mqtt")
+
+    def get_switch_status(self, source: str = "init") -> dict:
+        status = {"id": 0, "source": source, "output": self.output_on}
+        if self.with_pm:
+            power = self.get_power()
+            status.update({"apower": round(power, 1), "voltage": 233.6, "current": round(power / 233.6, 3),
+                           "aenergy": {"total": round(self.energy_wh, 3), "by_minute": [0.0, 0.0, 0.0],
+                                       "minute_ts": int(time.time())}})
+        status["temperature"] = {"tC": round(self.temperature, 1), "tF": round(self.temperature * 1.8 + 32, 1)}
+        return status
+
+    def get_status(self) -> dict:
+        # Reply of Shelly.GetStatus and payload of <id>/status
+        return {"input:0": {"id": 0, "state": self.input_on},
+                "switch:0": self.get_switch_status(),
+                "sys": {"mac": self.device_id.split("-")[-1].upper(), "uptime": int(time.time() - self.time_start)}}
+
+    def publish_switch_status(self, source: str = "init") -> None:
+        switch_status = self.get_switch_status(source)
+        self.broker.publish(f"{self.device_id}/status/switch:0", json.dumps(switch_status))
+        self.broker.publish(f"{self.device_id}/events/rpc",
+                            json.dumps({"src": self.device_id, "dst": f"{self.device_id}/events",
+                                        "method": "NotifyStatus",
+                                        "params": {"ts": round(time.time(), 2), "switch:0": switch_status}}))
+
+    def publish_status(self) -> None:
+        # Same as the device does on a status_update command
+        self.broker.publish(f"{self.device_id}/status", json.dumps(self.get_status()))
+        self.broker.publish(f"{self.device_id}/status/input:0", json.dumps({"id": 0, "state": self.input_on}))
+        self.broker.publish(f"{self.device_id}/status/switch:0", json.dumps(self.get_switch_status()))
+
+    def publish_readings(self, now: float) -> None:
+        if self.with_pm:
+            # Power changes are reported by the 1PM on their own
+            self.publish_switch_status()
+
+    def handle_rpc(self, request: dict) -> dict:
+        """
+        :param request: {"id":1,"method":"Shelly.GetStatus"}
+        :return: RPC reply
+        """
+        method = request.get("method")
+        if method == "Shelly.GetStatus":
+            return {"id": request.get("id"), "src": self.device_id, "result": self.get_status()}
+        if method == "Switch.Set":
+            was_on = self.set_output(bool(request.get("params", {}).get("on")))
+            self.publish_switch_status(source="http")
+            return {"id": request.get("id"), "src": self.device_id, "result": {"was_on": was_on}}
+        return {"id": request.get("id"), "src": self.device_id,
+                "error": {"code": -114, "message": f"Method {method} not found"}}
+
+
+class SimShellyPro3EM(SimShellyDevice):
+    """
+    Shelly Pro 3EM in 3 x EM1 profile, NotifyStatus messages on <id>/events/rpc for each phase
+    Real time values every tick, energy totals and NotifyEvent minute data every ENERGY_PUBLISH_INTERVAL_S.
+    """
+    ENERGY_PUBLISH_INTERVAL_S = 60
+    VOLTAGE_V = 234.0
+
+    def __init__(self, broker: InProcessBroker, device_id: str):
+        super().__init__(broker, device_id)
+        # Meter is always measuring
+        self.output_on = True
+        self.phase_loads_w = [random.uniform(self.MIN_LOAD_W, self.MAX_LOAD_W / 4) for _ in range(3)]
+        self.phase_energy_wh = [random.uniform(0, 30000.0) for _ in range(3)]
+        self.time_of_last_energy_publish = 0
+        # Readings published since the last minute data, per phase (power, apparent power, voltage, current)
+        self.period_readings = [[] for _ in range(3)]
+        self.period_energy_start_wh = list(self.phase_energy_wh)
+
+    def tick(self, now: float) -> None:
+        with self._lock:
+            for phase in range(3):
+                if self.time_of_last_tick is not None:
+                    self.phase_energy_wh[phase] += self.phase_loads_w[phase] * (now - self.time_of_last_tick) / 3600
+                step = random.uniform(-self.MAX_LOAD_STEP_W, self.MAX_LOAD_STEP_W)
+                self.phase_loads_w[phase] = min(self.MAX_LOAD_W, max(self.MIN_LOAD_W,
+                                                                     self.phase_loads_w[phase] + step))
+            self.time_of_last_tick = now
+        self.publish_readings(now)
+
+    def publish_readings(self, now: float) -> None:
+        for phase in range(3):
+            power = self.phase_loads_w[phase]
+            voltage = self.VOLTAGE_V + random.uniform(-1.5, 1.5)
+            pf = 0.9
+            self.period_readings[phase].append((power, power / pf, voltage, power / pf / voltage))
+            self._publish_notify_status(now, f"em1:{phase}",
+                                        {"id": phase, "act_power": round(power, 1),
+                                         "aprt_power": round(power / pf, 1),
+                                         "current": round(power / pf / voltage, 3), "freq": 50.0, "pf": pf,
+                                         "voltage": round(voltage, 1)})
+        if now - self.time_of_last_energy_publish >= self.ENERGY_PUBLISH_INTERVAL_S:
+            self.time_of_last_energy_publish = now
+            for phase in range(3):
+                self._publish_notify_status(now, f"em1data:{phase}",
+                                            {"id": phase, "total_act_energy": round(self.phase_energy_wh[phase], 2),
+                                             "total_act_ret_energy": 0.0})
+            self.publish_minute_data(now)
+
+    def publish_minute_data(self, now: float) -> None:
+        """
+        NotifyEvent with one row of aggregated values per phase, see ShellyEnergyMeter3em.MINUTE_DATA_FIELDS
+        """
+        period_start = int(now // self.ENERGY_PUBLISH_INTERVAL_S * self.ENERGY_PUBLISH_INTERVAL_S)
+        for phase in range(3):
+            readings = self.period_readings[phase]
+            if not readings:
+                continue
+            power, aprt_power, voltage, current = (list(column) for column in zip(*readings))
+            energy_wh = self.phase_energy_wh[phase] - self.period_energy_start_wh[phase]
+            row = [round(energy_wh, 4), round(energy_wh, 4), 0.0, 0.0,
+                   max(power), min(power), max(aprt_power), min(aprt_power),
+                   max(voltage), min(voltage), sum(voltage) / len(voltage),
+                   max(current), min(current), sum(current) / len(current)]
+            event = {"component": f"em1data:{phase}", "id": phase, "event": "data", "ts": float(period_start),
+                     "data": {"ts": period_start, "period": self.ENERGY_PUBLISH_INTERVAL_S,
+                              "values": [[round(value, 3) for value in row]]}}
+            self.broker.publish(f"{self.device_id}/events/rpc",
+                                json.dumps({"src": self.device_id, "dst": f"{self.device_id}/events",
+                                            "method": "NotifyEvent",
+                                            "params": {"ts": round(now, 2), "events": [event]}}))
+            self.period_readings[phase] = []
+            self.period_energy_start_wh[phase] = self.phase_energy_wh[phase]
+
+    def _publish_notify_status(self, now: float, component: str, data: dict) -> None:
+        self.broker.publish(f"{self.device_id}/events/rpc",
+                            json.dumps({"src": self.device_id, "dst": f"{self.device_id}/events",
+                                        "method": "NotifyStatus", "params": {"ts": round(now, 2), component: data}}))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,192 @@
+import os
+import logging
+import threading
+from collections.abc import Callable
+from typing import Iterator
+from devices.deviceTypes import DeviceType
+from devices.device import Device
+from system_setup.device_setup import get_device_list_from_file
+import settings
+
+# Setup logging
+log_formatter = logging.Formatter('%(asctime)s:%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.BASE_LOG_LEVEL)
+# Console debug
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(log_formatter)
+stream_handler.setLevel(settings.CONSOLE_LOG_LEVEL)
+logger.addHandler(stream_handler)
+
+# File logger
+file_handler = logging.FileHandler(os.path.join("../logs", "device_registry.log"))
+file_handler.setFormatter(log_formatter)
+file_handler.setLevel(settings.FILE_LOG_LEVEL)
+logger.addHandler(file_handler)
+
+"""
+Registry of the devices used in the system with indexed lookups
+Devices can be found by name, database id, plug_id/device_id, MQTT topic and type without scanning the device list.
+"""
+
+
+def test_fc() -> None:
+    from devices.shellyPlugMqtt import ShellyPlug
+    from devices.shellyPlus import ShellyPlus
+    registry = DeviceRegistry([ShellyPlug(name="Plug 1", mqtt_publish=fake_mqtt_publish,
+                                          plug_id="shellyplug-s-80646F840029"),
+                               ShellyPlus(name="Relay", mqtt_publish=fake_mqtt_publish,
+                                          plug_id="shellyplus1-441793ab3fb4")])
+    registry.set_db_ids({"Plug 1": 1, "Relay": 3})
+    print(registry.get_by_name("Relay"))
+    print(registry.get_by_db_id(1))
+    print(registry.get_by_topic("shellies/shellyplug-s-80646F840029/relay/0/power"))
+    print(registry.get_by_topic("shellyplus1-441793ab3fb4/status/switch:0"))
+    print(registry.get_by_plug_id("shellyplus1-441793ab3fb4"))
+    print(registry.get_by_type(DeviceType.SHELLY_PLUG, DeviceType.SHELLY_PLUS))
+    registry.remove("Plug 1")
+    print(len(registry), "Plug 1" in registry)
+
+
+def fake_mqtt_publish(str1: str, str2: str):
+    # For testing
+    pass
+
+
+class DeviceRegistry:
+    """
+    Holds the system devices with hash indexes by name, database id, plug_id, MQTT topic prefix and type
+    Iterating gives the devices in the order they were added. Add and remove may be called at runtime.
+    """
+
+    @classmethod
+    def from_file(cls, mqtt_publish_method: Callable[[str, str], None], file_path: str) -> "DeviceRegistry":
+        """
+        :param mqtt_publish_method: Needed for MQTT device initialisation
+        :param file_path: Path of device file
+        :return: registry of the devices defined in the device file
+        """
+        return cls(get_device_list_from_file(mqtt_publish_method, file_path))
+
+    def __init__(self, devices: list[Device] = None):
+        """
+        :param devices: initial devices
+        """
+        self._lock = threading.Lock()
+        # Dictionaries keep insertion order, used for iteration
+        self._by_name = {}
+        self._by_db_id = {}
+        # Database ids known before the device was added
+        self._db_ids = {}
+        self._by_plug_id = {}
+        self._by_topic_prefix = {}
+        self._by_type = {}
+        for device in devices or []:
+            self.add(device)
+
+    def __iter__(self) -> Iterator[Device]:
+        return iter(list(self._by_name.values()))
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def add(self, device: Device) -> None:
+        """
+        :raises ValueError: if a device with the same name is already registered
+        """
+        with self._lock:
+            if device.name in self._by_name:
+                raise ValueError(f"Device with name {device.name} already registered")
+            self._by_name[device.name] = device
+            self._by_type.setdefault(device.device_type, {})[device.name] = device
+            plug_id = self._get_plug_id(device)
+            if plug_id:
+                self._by_plug_id[plug_id] = device
+            topic_prefix = self._get_topic_prefix(device)
+            if topic_prefix:
+                self._by_topic_prefix[topic_prefix] = device
+            db_id = self._db_ids.get(device.name)
+            if db_id is not None:
+                self._by_db_id[db_id] = device
+        logger.debug(f"Registered {device}")
+
+    def remove(self, name: str) -> Device | None:
+        """
+        :param name: name of device to remove
+        :return: removed device, None if not registered
+        """
+        with self._lock:
+            device = self._by_name.pop(name, None)
+            if device is None:
+                return None
+            del self._by_type[device.device_type][name]
+            self._by_plug_id.pop(self._get_plug_id(device), None)
+            self._by_topic_prefix.pop(self._get_topic_prefix(device), None)
+            db_id = self._db_ids.get(name)
+            if db_id is not None:
+                self._by_db_id.pop(db_id, None)
+        logger.debug(f"Removed {device}")
+        return device
+
+    def set_db_ids(self, db_ids: dict[str, int]) -> None:
+        """
+        :param db_ids: device name: device_id in the database devices table
+        """
+        with self._lock:
+            self._db_ids = dict(db_ids)
+            self._by_db_id = {db_id: self._by_name[name] for name, db_id in self._db_ids.items()
+                              if name in self._by_name}
+
+    def get_by_name(self, name: str) -> Device | None:
+        return self._by_name.get(name)
+
+    def get_by_db_id(self, db_id: int) -> Device | None:
+        return self._by_db_id.get(db_id)
+
+    def get_db_id(self, name: str) -> int | None:
+        return self._db_ids.get(name)
+
+    def get_by_plug_id(self, plug_id: str) -> Device | None:
+        return self._by_plug_id.get(plug_id)
+
+    def get_by_topic(self, topic: str) -> Device | None:
+        """
+        :param topic: topic of a received MQTT message
+        :return: device listening to the topic
+        """
+        # Check each leading part of the topic, cost depends on topic depth not on number of devices
+        end = topic.find("/")
+        while end != -1:
+            device = self._by_topic_prefix.get(topic[:end + 1])
+            if device:
+                return device
+            end = topic.find("/", end + 1)
+        return None
+
+    def get_by_type(self, *device_types: DeviceType) -> list[Device]:
+        """
+        :param device_types: one or more device types
+        :return: devices of the given types
+        """
+        devices = []
+        for device_type in device_types:
+            devices.extend(self._by_type.get(device_type, {}).values())
+        return devices
+
+    @staticmethod
+    def _get_plug_id(device: Device) -> str:
+        # MQTT devices have a plug_id, the energy meter a device_id
+        return getattr(device, "plug_id", "") or getattr(device, "device_id", "")
+
+    @staticmethod
+    def _get_topic_prefix(device: Device) -> str:
+        # Listen topic without the '#'
+        listen_topic = getattr(device, "listen_topic", "")
+        return listen_topic[:-1] if listen_topic.endswith("#") else listen_topic
+
+
+if __name__ == "__main__":
+    test_fc()
@@ -35,9 +35,11 @@ Methods for getting list of devices used in the particular system
 Configuration file expected like below:
 [
     {"type": "SHELLY_PLUG", "name": "Plug 1", "plug_id": "shellyplug-s-80646F840029"},
-    {"type": "SHELLY_PLUG", "name": "Plug 2", "plug_id": "shellyplug-s-C8C9A3B8E92E"}
+    {"type": "SHELLY_PLUG", "name": "Plug 2", "plug_id": "shellyplug-s-C8C9A3B8E92E"},
+    {"type": "SHELLY_PLUS", "name": "Relay", "plug_id": "shellyplus1-441793ab3fb4", "ip": "172.31.0.3"}
 ]
 type must be from devices.deviceTypes Enum
+ip is optional for SHELLY_PLUS and SHELLY_PLUS_PM, if given the device status can also be read over HTTP
 """
 
 def test_fc() -> None:
@@ -61,10 +63,12 @@ def get_device_list_from_file(mqtt_publish_method: Callable[[str, str], None],
     dev_list = get_dev_list_from_dic_list(dev_dic_list, mqtt_publish_method)
     return dev_list
 
-def get_dev_list_from_dic_list(dev_dic_list: list[dict], mqtt_publish_method:  Callable[[str,str], None]) -> list[Device]:
+def get_dev_list_from_dic_list(dev_dic_list: list[dict], mqtt_publish_method:  Callable[[str,str], None],
+                               state_file_loc: str = "C:\\py_related\\home_el_cntrl\\state") -> list[Device]:
     """
     :param dev_dic_list: list of dictionaries that describe the devices in the system
     :param mqtt_publish_method: Needed for MQTT device initialisation
+    :param state_file_loc: folder the device states are loaded from and saved in
     :return: List of Device objects defined in the device dictionary list
     """
     dev_list: list[Device] = []
@@ -72,23 +76,30 @@ def get_dev_list_from_dic_list(dev_dic_list: list[dict], mqtt_publish_method:  C
         if dev_dic["type"] == DeviceType.SHELLY_PLUG.name:
             dev_list.append(ShellyPlug(name=dev_dic["name"],
                                 mqtt_publish=mqtt_publish_method,
-                                plug_id=dev_dic["plug_id"]))
+                                plug_id=dev_dic["plug_id"],
+                                state_file_loc=state_file_loc))
         elif dev_dic["type"] == DeviceType.SHELLY_PLUS.name:
             dev_list.append(ShellyPlus(name=dev_dic["name"],
                                        mqtt_publish=mqtt_publish_method,
-                                       plug_id=dev_dic["plug_id"]))
+                                       plug_id=dev_dic["plug_id"],
+                                       ip=dev_dic.get("ip", ""),
+                                       state_file_loc=state_file_loc))
         elif dev_dic["type"] == DeviceType.SHELLY_PLUS_PM.name:
             dev_list.append(ShellyPlusPM(name=dev_dic["name"],
                                        mqtt_publish=mqtt_publish_method,
-                                       plug_id=dev_dic["plug_id"]))
+                                       plug_id=dev_dic["plug_id"],
+                                       ip=dev_dic.get("ip", ""),
+                                       state_file_loc=state_file_loc))
         elif dev_dic["type"] == DeviceType.URL_CONTROLLED_SHELLY_PLUG.name:
             dev_list.append(URLControlledShellyPlug(name=dev_dic["name"],
                                        url_on=dev_dic["url_on"],
-                                       url_off=dev_dic["url_off"]))
+                                       url_off=dev_dic["url_off"],
+                                       state_file_loc=state_file_loc))
         elif dev_dic["type"] == DeviceType.SHELLY_PRO_3EM.name:
             dev_list.append(ShellyEnergyMeter3em(name=dev_dic["name"],
                                        mqtt_publish=mqtt_publish_method,
-                                       device_id=dev_dic["device_id"]))
+                                       device_id=dev_dic["device_id"],
+                                       state_file_loc=state_file_loc))
         else:
             raise Exception("Device file contains unknown device type")
     return dev_list
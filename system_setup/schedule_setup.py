@@ -8,6 +8,7 @@ from schedules.schedule_protocol import ScheduleWithDevice
 from devices.device import Device
 from devices.shellyPlugUrlControlled import URLControlledShellyPlug
 from devices.deviceTypes import DeviceType
+from system_setup.device_registry import DeviceRegistry
 from schedules.schedule_types import ScheduleType
 import settings
 import json
@@ -55,7 +56,7 @@ def fake_get_prices() -> tuple[dict,dict]:
     pass
 
 def get_schedule_list_from_file(get_prices_method: Callable[[], tuple[dict, dict]],
-                                dev_list: list[Device],
+                                dev_list: list[Device] | DeviceRegistry,
                               file_path: str) -> list:
     """
     :param get_prices_method: method needed for objects that rely on creating schedules for devices according to electricity
@@ -71,7 +72,7 @@ def get_schedule_list_from_file(get_prices_method: Callable[[], tuple[dict, dict
 
 def get_sch_list_from_dic_list(sch_dic_list: list[dict],
                                get_prices_method:  Callable[[], tuple[dict, dict]],
-                               dev_list: list[Device]) -> list:
+                               dev_list: list[Device] | DeviceRegistry) -> list:
     """
     :param sch_dic_list: List of Schedule objects defined in the device file
     :param get_prices_method: method needed for objects that rely on creating schedules for devices according to electricity
@@ -80,6 +81,8 @@ def get_sch_list_from_dic_list(sch_dic_list: list[dict],
     :return: List of Schedule objects defined in the device file
     """
     logger.debug("get_sch_list_from_dic_list")
+    # Devices are assigned by name, look them up from the registry index
+    dev_registry = dev_list if isinstance(dev_list, DeviceRegistry) else DeviceRegistry(dev_list)
     sch_list: list = []
     for sch_dic in sch_dic_list:
         if sch_dic["type"] == ScheduleType.HOURLY_SCHEDULE_2_DAYS.name:
@@ -87,7 +90,7 @@ def get_sch_list_from_dic_list(sch_dic_list: list[dict],
             logger.debug(f"Got 2day schedule {sch_2d}")
             assigned_dev_name = sch_dic[ASSIGNED_DEV_KEY]
             logger.debug(f"Assigned device name {assigned_dev_name}")
-            _assign_dev_to_sch_by_name(sch_2d, assigned_dev_name, dev_list)
+            _assign_dev_to_sch_by_name(sch_2d, assigned_dev_name, dev_registry)
             sch_list.append(sch_2d)
         elif sch_dic["type"] == ScheduleType.AUTO_SCHEDULE_CREATOR.name:
             assigned_schedule_name = sch_dic["assigned_schedule"]
@@ -103,7 +106,7 @@ def get_sch_list_from_dic_list(sch_dic_list: list[dict],
             logger.debug("DAILY_TIMED_SCHEDULE")
             daily_schedule = DailyTimedSchedule(name=sch_dic["name"])
             assigned_dev_name = sch_dic[ASSIGNED_DEV_KEY]
-            _assign_dev_to_sch_by_name(daily_schedule, assigned_dev_name, dev_list)
+            _assign_dev_to_sch_by_name(daily_schedule, assigned_dev_name, dev_registry)
             # if assigned_dev_name:
             #     assigned_dev = next((dev for dev in dev_list if dev.name == assigned_dev_name),None)
             #     if not assigned_dev:
@@ -116,15 +119,15 @@ def get_sch_list_from_dic_list(sch_dic_list: list[dict],
     return sch_list
 
 
-def _assign_dev_to_sch_by_name(sch:ScheduleWithDevice, dev_name: str, dev_list: list[Device]) -> None:
+def _assign_dev_to_sch_by_name(sch:ScheduleWithDevice, dev_name: str, dev_registry: DeviceRegistry) -> None:
     """
     :param sch: schedule to which to add the device
     :param dev_name: device name to add
-    :param dev_list: list of devices, device object is gotten frrom here by name
+    :param dev_registry: registry of devices, device object is gotten frrom here by name
     :return:
     """
     if dev_name:
-        assigned_dev = next((dev for dev in dev_list if dev.name == dev_name), None)
+        assigned_dev = dev_registry.get_by_name(dev_name)
         if not assigned_dev:
             raise Exception(
                 f"The assigned device for DAILY_TIMED_SCHEDULE does not exist: {dev_name}")